@@ -3,7 +3,7 @@
 Exports:
 - LLMAnalyzer: Uses a Large Language Model to analyze captured packets or journal logs.
 - SnortAnalyzer: Uses Snort3 IDS to analyze captured packets.
-- SimpleJournalAnalyzer: Pass-through analyzer for journalctl entries.
+- SimpleJournalAnalyzer: Signature analyzer for journalctl entries.
 """
 from .llm_analyzer import LLMAnalyzer
 from .snort_analyzer import SnortAnalyzer
@@ -0,0 +1,176 @@
+"""
+Signature matching over journal messages.
+
+Rules are loaded from an ini file, one section per rule:
+
+    [failed_password]
+    literal = Failed password for
+    pattern = Failed password for (?:invalid user )?(?P<user>\\S+) from (?P<ip>\\S+)
+
+- literal: text every matching message contains (case-insensitive), several
+  literals can be given one per line
+- pattern: regex run on the messages containing a literal, the named groups
+  `user` and `ip` are counted
+- min_count: matches needed before the rule reports an attack (default 1)
+
+All literals are compiled into one regex shaped like a trie of the literals,
+so a message is scanned once whatever the number of rules, and the rule
+regexes only run on the messages in which one of their literals was found.
+"""
+
+import configparser
+import re
+from collections import Counter
+
+
+class RuleError(Exception):
+    pass
+
+
+class Rule:
+    __slots__ = ("name", "literals", "pattern", "min_count")
+
+    def __init__(self, name, literals, pattern, min_count=1):
+        self.name = name
+        self.literals = literals
+        self.pattern = pattern
+        self.min_count = min_count
+
+
+def _trie_regex(words) -> str:
+    """
+    regex matching any of `words`, prefix-factored so that alternatives are
+    rejected on their first character
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        if "" in node and len(node) == 1:
+            return ""
+        optional = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if optional:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class RuleSet:
+    """
+    The rules of a rules file, compiled once. `scan` counts the matches of
+    a sequence of journal entries per rule, per source ip and per user.
+    """
+
+    def __init__(self, rules: list[Rule]):
+        self.rules = rules
+        by_literal = {}
+        for rule in rules:
+            for literal in rule.literals:
+                by_literal.setdefault(literal.lower(), []).append(rule)
+        # the trie regex matches the longest literal at a position, which
+        # also stands for the literals that are prefixes of it
+        self._by_literal = {
+            literal: [rule for prefix, prefix_rules in by_literal.items() if literal.startswith(prefix) for rule in prefix_rules]
+            for literal in by_literal
+        }
+        # matched against lowercased messages: a case-sensitive search lets re
+        # skip quickly to the first characters of the literals, IGNORECASE does not
+        self._prefilter = re.compile(_trie_regex(by_literal)) if rules else None
+
+    @classmethod
+    def from_file(cls, path) -> "RuleSet":
+        parser = configparser.ConfigParser(interpolation=None)
+        if not parser.read(path):
+            raise RuleError(f"rules file {path} not found")
+        rules = []
+        for name in parser.sections():
+            section = parser[name]
+            literals = [line.strip() for line in section.get("literal", "").splitlines() if line.strip()]
+            if not literals:
+                raise RuleError(f"rule {name}: no literal")
+            try:
+                pattern = re.compile(section["pattern"], re.IGNORECASE)
+            except (KeyError, re.error) as e:
+                raise RuleError(f"rule {name}: bad pattern: {e}") from e
+            rules.append(Rule(name, literals, pattern, int(section.get("min_count", 1))))
+        return cls(rules)
+
+    def scan(self, entries, field="MESSAGE"):
+        """
+        one pass over the entries
+        returns (rule counts, ip counts, user counts) as Counters
+        """
+        rule_counts = Counter()
+        ip_counts = Counter()
+        user_counts = Counter()
+        prefilter = self._prefilter
+        if prefilter is None:
+            return rule_counts, ip_counts, user_counts
+        by_literal = self._by_literal
+
+        for entry in entries:
+            msg = entry.get(field)
+            # binary messages are exported as arrays of bytes
+            if not isinstance(msg, str):
+                continue
+            lowered = msg.lower()
+            hit = prefilter.search(lowered)
+            if hit is None:
+                continue
+
+            candidates = []
+            seen = set()
+            while hit is not None:
+                for rule in by_literal.get(hit.group(), ()):
+                    if rule.name not in seen:
+                        seen.add(rule.name)
+                        candidates.append(rule)
+                # literals may overlap, look for the next one from the next position
+                hit = prefilter.search(lowered, hit.start() + 1)
+            ip = user = None
+            for rule in candidates:
+                match_ = rule.pattern.search(msg)
+                if match_ is None:
+                    continue
+                rule_counts[rule.name] += 1
+                groups = match_.groupdict()
+                ip = ip or groups.get("ip")
+                user = user or groups.get("user")
+            # an entry matched by several rules counts once per ip and user
+            if ip:
+                ip_counts[ip] += 1
+            if user:
+                user_counts[user] += 1
+        return rule_counts, ip_counts, user_counts
+
+    def counts(self, entries, field="MESSAGE") -> Counter:
+        """
+        `scan` as one Counter keyed by ("rule", name), ("ip", ip) and
+        ("user", user), e.g. for the minute buckets of a JournalWindow
+        """
+        rule_counts, ip_counts, user_counts = self.scan(entries, field)
+        counts = Counter()
+        for kind, kind_counts in (("rule", rule_counts), ("ip", ip_counts), ("user", user_counts)):
+            for key, n in kind_counts.items():
+                counts[(kind, key)] = n
+        return counts
+
+    @staticmethod
+    def split(counts):
+        """
+        inverse of `counts`: (rule counts, ip counts, user counts)
+        """
+        split = {"rule": Counter(), "ip": Counter(), "user": Counter()}
+        for (kind, key), n in counts.items():
+            split[kind][key] = n
+        return split["rule"], split["ip"], split["user"]
+
+    def triggered(self, rule_counts) -> list[str]:
+        return [rule.name for rule in self.rules if rule_counts.get(rule.name, 0) >= rule.min_count]
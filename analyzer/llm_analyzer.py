@@ -1,8 +1,12 @@
 import json
 import os
-from typing import Any, Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
 
+from analyzer.verdict_cache import VerdictCache
 from api.analyzer import AnalyzerManager
+from api import metrics
 from transport.message import Analyzer as MessageAnalyzerKind, NetworkPacketMessage, JournalMessage, Message
 
 
@@ -13,24 +17,59 @@ class LLMAnalyzer(AnalyzerManager):
     environment variable OPENAI_API_KEY is set and the `openai` package is
     installed. If neither is available, it will raise a RuntimeError instructing
     the user how to enable the LLM integration.
+
+    Large messages are split into chunks of at most `max_chunk_chars` which are
+    analyzed concurrently (map) and combined into one verdict (reduce): the
+    message is an attack if any chunk is. The OpenAI client, and with it the
+    HTTP connection pool, is created once and shared by all calls.
+
+    With a VerdictCache, chunks whose (model, system prompt, prompt) were
+    already answered are not sent again; results made only of cached verdicts
+    are marked `cached: true`.
     """
 
-    def __init__(self, model: Optional[str] = None):
+    # the message format consumed, see Message.supported_analyzers
+    kind = MessageAnalyzerKind.LLM
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        *,
+        max_chunk_chars: int = 60000,
+        concurrency: int = 4,
+        timeout: float = 60.0,
+        max_retries: int = 2,
+        cache: Optional[VerdictCache] = None,
+    ):
         """Create a new LLM-backed analyzer.
 
         Args:
             model: The LLM model name to use. Defaults to a lightweight model if
                 not provided.
+            max_chunk_chars: Upper bound on the size of one prompt sent to the LLM.
+            concurrency: Maximum number of LLM requests in flight, shared by all
+                analyses running at the same time.
+            timeout: Timeout in seconds of one LLM request.
+            max_retries: Retries of one LLM request on connection errors, 429 and 5xx.
+            cache: Verdict cache consulted before contacting the LLM.
         """
         self._model = model or os.environ.get("LLM_MODEL", "gpt-4o-mini")
+        self._max_chunk_chars = max_chunk_chars
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._concurrency = max(1, concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="llm")
+        self._cache = cache
+        self._client = None
+        self._client_lock = threading.Lock()
 
     def analyze(self, message: Message) -> Dict[str, Any]:
         if not isinstance(message, (NetworkPacketMessage, JournalMessage)):
             raise TypeError("LLMAnalyzer requires a NetworkPacketMessage or JournalMessage input")
 
-        # Prepare the prompt tailored by the message for LLM consumption.
-        prompt_bytes = message.to_format_of_analyzer(MessageAnalyzerKind.LLM)
-        prompt = prompt_bytes.decode("utf-8", errors="replace")
+        # Prepare the prompts tailored by the message for LLM consumption.
+        with metrics.stage("prompt"):
+            prompts = message.to_text_chunks_of_analyzer(MessageAnalyzerKind.LLM, self._max_chunk_chars)
 
         # Compose a strict JSON response instruction to make parsing robust.
         if isinstance(message, NetworkPacketMessage):
@@ -48,45 +87,84 @@ class LLMAnalyzer(AnalyzerManager):
                 "Do not include markdown, code fences, or extra text."
             )
 
-        # Attempt OpenAI SDK v1 first, fall back to legacy if needed.
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError(
-                "LLMAnalyzer requires OPENAI_API_KEY to be set in the environment to contact the LLM."
-            )
+        # chunks answered from the verdict cache need neither the key nor the LLM
+        results = [self._cached_result(system_prompt, prompt) for prompt in prompts]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                raise RuntimeError(
+                    "LLMAnalyzer requires OPENAI_API_KEY to be set in the environment to contact the LLM."
+                )
 
-        try:
-            # Prefer modern OpenAI SDK (>=1.0)
-            from openai import OpenAI  # type: ignore
-
-            client = OpenAI(api_key=api_key)
-            print(f"[1] length of prompt sent to LLM: {len(prompt)}")
-            response = client.chat.completions.create(
-                model=self._model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0,
-            )
-            print(f"[2] length of prompt sent to LLM: {len(prompt)}")
-            content = response.choices[0].message.content or "{}"
-        except Exception:
-            # Try legacy SDK for broader compatibility
+            if len(prompts) == 1:
+                results[0] = self._analyze_chunk(system_prompt, prompts[0], api_key)
+            else:
+                futures = {
+                    i: self._executor.submit(metrics.bind_context(self._analyze_chunk), system_prompt, prompts[i], api_key)
+                    for i in pending
+                }
+                # each request is bounded by the client timeout and its retries,
+                # chunks queued behind `concurrency` others get as much time again
+                waves = -(-len(futures) // self._concurrency)
+                wait(futures.values(), timeout=waves * self._timeout * (self._max_retries + 1))
+                for i, future in futures.items():
+                    if not future.done():
+                        future.cancel()
+                        results[i] = TimeoutError("LLM request did not finish in time")
+                    elif future.exception() is not None:
+                        results[i] = future.exception()
+                    else:
+                        results[i] = future.result()
+
+        return self._reduce(results)
+
+    """
+    the cached verdict of one prompt as a chunk result, None when it is not cached
+    """
+    def _cached_result(self, system_prompt: str, prompt: str):
+        if self._cache is None:
+            return None
+        verdict = self._cache.get(self._cache.key(self._model, system_prompt, prompt))
+        if verdict is None:
+            return None
+        return verdict["is_attack"], verdict["reasoning"], verdict["raw_output"], True
+
+    """
+    send one prompt, returns (is_attack, reasoning, raw output, cached)
+    """
+    def _analyze_chunk(self, system_prompt: str, prompt: str, api_key: str):
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        client = self._get_client(api_key)
+        if client is not None:
+            try:
+                with metrics.stage("llm_request"):
+                    response = client.chat.completions.create(
+                        model=self._model,
+                        messages=messages,
+                        temperature=0,
+                    )
+                content = response.choices[0].message.content or "{}"
+            except Exception as e:  # pragma: no cover - network/env dependent
+                raise RuntimeError(
+                    "Failed to call OpenAI API. Install the 'openai' package and ensure your key is valid."
+                ) from e
+        else:
+            # Legacy SDK (<1.0) for broader compatibility
             try:
                 import openai  # type: ignore
 
                 openai.api_key = api_key
-                print(f"[3] length of prompt sent to LLM: {len(prompt)}")
-                completion = openai.ChatCompletion.create(
-                    model=self._model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0,
-                )
-                print(f"[4] length of prompt sent to LLM: {len(prompt)}")
+                with metrics.stage("llm_request"):
+                    completion = openai.ChatCompletion.create(
+                        model=self._model,
+                        messages=messages,
+                        temperature=0,
+                        request_timeout=self._timeout,
+                    )
                 content = completion["choices"][0]["message"]["content"] or "{}"
             except Exception as e2:  # pragma: no cover - network/env dependent
                 raise RuntimeError(
@@ -100,13 +178,60 @@ class LLMAnalyzer(AnalyzerManager):
             reasoning = str(parsed.get("reasoning", ""))
         except Exception:
             # Non-JSON or malformed response. Provide the raw output for caller to inspect.
+            # Not cached, the next call may get a usable answer.
             is_attack = False
             reasoning = "Model did not return valid JSON. See raw_output."
+            return is_attack, reasoning, content, False
+
+        if self._cache is not None:
+            self._cache.put(self._cache.key(self._model, system_prompt, prompt), {"is_attack": is_attack, "reasoning": reasoning, "raw_output": content})
+        return is_attack, reasoning, content, False
+
+    """
+    the OpenAI SDK >= 1.0 client, created on first use and reused so its
+    connection pool is kept across requests; None with the legacy SDK
+    """
+    def _get_client(self, api_key: str):
+        with self._client_lock:
+            if self._client is None or self._client.api_key != api_key:
+                try:
+                    from openai import OpenAI  # type: ignore
+                except ImportError:
+                    return None
+                self._client = OpenAI(api_key=api_key, timeout=self._timeout, max_retries=self._max_retries)
+            return self._client
+
+    """
+    combine the chunk results: attack if any chunk is one, failed chunks are
+    reported in the reasoning, and only when all of them failed is the
+    analysis an error
+    """
+    def _reduce(self, results: List[Any]) -> Dict[str, Any]:
+        succeeded = [r for r in results if not isinstance(r, BaseException)]
+        if not succeeded:
+            raise results[0]
+
+        if len(results) == 1:
+            is_attack, reasoning, raw_output, _ = results[0]
+        else:
+            is_attack = any(r[0] for r in succeeded)
+            parts = []
+            for i, r in enumerate(results, 1):
+                if isinstance(r, BaseException):
+                    parts.append(f"[part {i}/{len(results)}] analysis failed: {r}")
+                elif r[0] or not is_attack:
+                    # when there is an attack only the chunks that found it explain it
+                    parts.append(f"[part {i}/{len(results)}] {r[1]}")
+            reasoning = "\n".join(parts)
+            raw_output = "\n".join(r[2] for r in succeeded)
 
         return {
             "analyzer": "LLM",
             "is_attack": is_attack,
             "reasoning": reasoning,
-            "raw_output": content,
+            "raw_output": raw_output,
             "model": self._model,
+            "chunks": len(results),
+            "failed_chunks": len(results) - len(succeeded),
+            "cached": len(succeeded) == len(results) and all(r[3] for r in succeeded),
         }
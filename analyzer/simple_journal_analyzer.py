@@ -1,51 +1,57 @@
 from typing import Any, Dict
-import json
-import re
+import os
 
 from api.analyzer import AnalyzerManager
-from transport.message import JournalMessage, Analyzer as MessageAnalyzerKind
+from api import metrics
+from transport.message import Analyzer as MessageAnalyzerKind, JournalMessage
+from .journal_rules import RuleSet
+
+DEFAULT_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal_rules.ini")
 
 
 class SimpleJournalAnalyzer(AnalyzerManager):
-    """Pass-through analyzer for journalctl entries.
+    """Signature analyzer for journalctl entries.
 
-    Consumes a JournalMessage and returns the original dict entries without
-    transformation. Useful for piping logs to downstream consumers or for simple
-    display.
+    Consumes a JournalMessage and matches its entries against the rules of
+    `rules_path` (see journal_rules.py), compiled once on construction.
+    Reports the triggered rules and the users and source addresses seen in
+    the matching entries.
     """
 
+    kind = MessageAnalyzerKind.SimpleJournal
+
+    def __init__(self, rules_path=None):
+        self.rules_path = rules_path or DEFAULT_RULES
+        self.rules = RuleSet.from_file(self.rules_path)
+
     def analyze(self, message: JournalMessage) -> Dict[str, Any]:
         if not isinstance(message, JournalMessage):
             raise TypeError("SimpleJournalAnalyzer requires a JournalMessage input")
+        if self.kind not in message.supported_analyzers():
+            raise TypeError(f"{type(message).__name__} is not supported by SimpleJournalAnalyzer")
 
-        raw_bytes = message.to_format_of_analyzer(MessageAnalyzerKind.SimpleJournal)
-        json_obj = json.loads(raw_bytes.decode("utf-8", errors="replace"))
-        attack_entries = []
-        pattern = re.compile(r"invalid user ([a-zA-Z0-9_]+) from ((\d+\.){3}(\d+))")
-        for e in json_obj:
-            msg: str = e["MESSAGE"]
-            match_ = pattern.search(msg.lower())
-            if match_:
-                attack_entries.append((match_.group(1), match_.group(2)))
-        if not attack_entries:
+        # in-process: read the entries in place instead of a json round trip
+        view = message.native_view()
+        if view.window_counts is not None and view.counted_by == self.rules.counts:
+            # already counted with these rules by the monitor's detection stage
+            rule_counts, ip_counts, user_counts = self.rules.split(view.window_counts)
+        else:
+            with metrics.stage("rules"):
+                rule_counts, ip_counts, user_counts = self.rules.scan(view.entries)
+        triggered = self.rules.triggered(rule_counts)
+        if not triggered:
             return {
                 "is_attack": False
             }
-        attack_users = {}
-        attack_ips = {}
-        for user, ip in attack_entries:
-            if user not in attack_users:
-                attack_users[user] = 0
-            if ip not in attack_ips:
-                attack_ips[ip] = 0
-            attack_users[user] += 1
-            attack_ips[ip] += 1
         return {
             "is_attack": True,
+            "rules": [
+                {"rule": rule, "count": rule_counts[rule]} for rule in triggered
+            ],
             "attack_users": [
-                {"username": user, "count": count} for user, count in attack_users.items()
+                {"username": user, "count": count} for user, count in user_counts.most_common()
             ],
             "attack_ips": [
-                {"ip": ip, "count": count} for ip, count in attack_ips.items()
+                {"ip": ip, "count": count} for ip, count in ip_counts.most_common()
             ]
-        }
\ No newline at end of file
+        }
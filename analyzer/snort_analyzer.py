@@ -1,3 +1,4 @@
+import json
 import os
 import shutil
 import subprocess
@@ -5,7 +6,9 @@ import tempfile
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+from analyzer.snort_pool import ALERT_FIELDS, SnortPool
 from api.analyzer import AnalyzerManager
+from api import metrics
 from transport.message import Analyzer as MessageAnalyzerKind, NetworkPacketMessage
 
 
@@ -22,9 +25,25 @@ class SnortAnalyzer(AnalyzerManager):
     2) /etc/snort/snort.lua
     3) /usr/local/etc/snort/snort.lua
     4) <repo_root>/tmp/install/etc/snort/snort.lua
+
+    With workers > 0 captures are inspected by a pool of long-lived Snort
+    processes (see SnortPool), started on the first analysis, each capture
+    spread over `shards` of them; with workers = 0 every analysis runs its
+    own Snort.
+    Alerts are parsed from Snort's alert_json output.
     """
 
-    def __init__(self, snort_exec: Optional[str] = None, snort_config: Optional[str] = None, extra_args: Optional[List[str]] = None):
+    kind = MessageAnalyzerKind.Snort
+
+    def __init__(
+        self,
+        snort_exec: Optional[str] = None,
+        snort_config: Optional[str] = None,
+        extra_args: Optional[List[str]] = None,
+        workers: int = 0,
+        shards: int = 1,
+        job_timeout: float = 120.0,
+    ):
         self._snort_exec = snort_exec or os.environ.get("SNORT_EXECUTABLE") or shutil.which("snort")
         if not self._snort_exec:
             raise FileNotFoundError(
@@ -32,6 +51,12 @@ class SnortAnalyzer(AnalyzerManager):
             )
         self._snort_config = snort_config or self._discover_config()
         self._extra_args = extra_args or []
+        self._pool = None
+        if workers > 0:
+            self._pool = SnortPool(
+                self._snort_exec, self._snort_config, workers=workers, shards=shards, extra_args=self._extra_args,
+                job_timeout=job_timeout,
+            )
 
     def _discover_config(self) -> Optional[str]:
         # Respect explicit env var first
@@ -59,51 +84,76 @@ class SnortAnalyzer(AnalyzerManager):
         if not isinstance(message, NetworkPacketMessage):
             raise TypeError("SnortAnalyzer requires a NetworkPacketMessage input")
 
-        # Prepare a temporary pcap file with the capture bytes from the message.
-        pcap_bytes = message.to_format_of_analyzer(MessageAnalyzerKind.Snort)
+        # Stream the capture from the message to a temporary pcap file, so
+        # that large captures are never held in memory as a whole.
         with tempfile.NamedTemporaryFile(suffix=".pcap", delete=True) as tf:
-            tf.write(pcap_bytes)
-            tf.flush()
-
-            # At this point _snort_exec is guaranteed to be non-None (constructor check)
-            snort_exec: str = str(self._snort_exec)
-            cmd: List[str] = [snort_exec]
-
-            # Use a quiet mode if supported to reduce noise
-            cmd += ["-q"]
-
-            # Read from pcap file
-            cmd += ["-r", tf.name]
-
-            # If a configuration is available, include it
-            if self._snort_config:
-                cmd += ["-c", self._snort_config]
+            with metrics.stage("pcap"):
+                message.write_format_of_analyzer(MessageAnalyzerKind.Snort, tf)
+                tf.flush()
+            with metrics.stage("snort"):
+                if self._pool is not None:
+                    tf.seek(0)
+                    alerts = self._pool.analyze_pcap(tf)
+                    rc = 0
+                    raw_output = "\n".join(json.dumps(alert) for alert in alerts)
+                else:
+                    alerts, rc, raw_output = self._run_once(tf.name)
+        return self._result(alerts, rc, raw_output)
 
-            # Prefer a simple alert output format if supported
-            cmd += ["-A", "alert_fast"]
-
-            # Append any caller-provided arguments last
-            cmd += self._extra_args
-
-            proc = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False,
-            )
-
-        stdout = proc.stdout
-        stderr = proc.stderr
-        rc = proc.returncode
-
-        # Heuristic: consider any non-empty fast alert output or 'Alert' token as an attack
-        raw_output = (stdout or "") + ("\n" + stderr if stderr else "")
-        is_attack = False
-        details = ""
-        if "[**]" in raw_output or "Alert" in raw_output or "ALERT" in raw_output or "alert" in raw_output:
-            is_attack = True
-            details = "Snort reported alerts."
+    """
+    inspect one capture with a dedicated Snort process, returns (alerts, return code, raw output)
+    """
+    def _run_once(self, pcap_path: str):
+        # At this point _snort_exec is guaranteed to be non-None (constructor check)
+        snort_exec: str = str(self._snort_exec)
+        cmd: List[str] = [snort_exec]
+
+        # Use a quiet mode if supported to reduce noise
+        cmd += ["-q"]
+
+        # Do not drop packets over checksums, captures may come from offloading NICs
+        cmd += ["-k", "none"]
+
+        # Read from pcap file
+        cmd += ["-r", pcap_path]
+
+        # If a configuration is available, include it
+        if self._snort_config:
+            cmd += ["-c", self._snort_config]
+
+        # One JSON object per alert on stdout
+        cmd += ["-A", "alert_json", "--lua", f"alert_json = {{ file = false, fields = '{ALERT_FIELDS}' }}"]
+
+        # Append any caller-provided arguments last
+        cmd += self._extra_args
+
+        proc = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+
+        alerts = []
+        for line in proc.stdout.splitlines():
+            line = line.strip()
+            if line.startswith("{"):
+                try:
+                    alerts.append(json.loads(line))
+                except ValueError:
+                    pass
+        raw_output = (proc.stdout or "") + ("\n" + proc.stderr if proc.stderr else "")
+        return alerts, proc.returncode, raw_output
+
+    def _result(self, alerts: List[Dict[str, Any]], rc: int, raw_output: str) -> Dict[str, Any]:
+        is_attack = bool(alerts)
+        if is_attack:
+            counts: Dict[str, int] = {}
+            for alert in alerts:
+                msg = alert.get("msg", "")
+                counts[msg] = counts.get(msg, 0) + 1
+            details = "Snort reported alerts: " + "; ".join(f"{msg} (x{n})" for msg, n in counts.items())
         elif rc != 0:
             details = f"Snort exited with code {rc}. See raw_output for details."
         else:
@@ -113,6 +163,7 @@ class SnortAnalyzer(AnalyzerManager):
             "analyzer": "Snort",
             "is_attack": is_attack,
             "details": details,
+            "alerts": alerts,
             "return_code": rc,
             "raw_output": raw_output,
             "snort_exec": self._snort_exec,
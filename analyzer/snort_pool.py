@@ -0,0 +1,361 @@
+"""
+Pool of long-lived Snort processes.
+
+Loading snort.lua and the rules takes seconds, so each worker keeps one Snort
+running across jobs, reading a single endless pcap stream from a FIFO given
+with -r. A job appends its packets to the streams of the workers it checked
+out, then a marker packet matched by a rule of the pool (MARKER_SID). Snort
+inspects packets in order, so the job's alerts are all out once the marker's
+alert is read. The marker is followed by MARKER_PADDING filler packets, so
+that the DAQ, which reads packets in batches, does not hold it back waiting
+for the next job.
+
+Jobs are kept apart in time rather than by restarting Snort: the packets of
+a job are shifted to start JOB_GAP seconds after the previous packet of the
+worker, past Snort's flow and port_scan timeouts, so no state of one job is
+live when the next starts. The alerts' `seconds` and `timestamp` are shifted
+back.
+
+A job checks out `shards` idle workers and hands them back when done, so up
+to workers // shards jobs run at once. Its packets are sharded by host pair:
+both directions and every session between two hosts go to the same Snort, so
+port scans of one host by another are seen whole; sweeps of one source over
+many hosts are split across shards (shards = 1 keeps captures whole).
+
+The pool has only been run against a stand-in snort (tests/test_snort_pool.py),
+it stays off by default (`[snort] workers = 0`) until
+`python -m analyzer.snort_pool --verify <pcap>...` reports the same alerts as
+one Snort per capture with the Snort 3 build and rules in use.
+"""
+
+import json
+import os
+import queue
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+from transport.pcap import LINKTYPE_ETHERNET, PcapError, PcapReader, global_header, host_pair_key, record, udp_frame
+
+ALERT_FIELDS = "timestamp gid sid rev msg proto src_addr src_port dst_addr dst_port action priority class"
+
+# seconds between the last packet of a job and the first of the next one on a worker
+JOB_GAP = 86400
+MARKER_SID = 9000001
+MARKER_CONTENT = "monilyzer-snort-pool-job-end"
+MARKER_RULE = f'alert udp any any -> any 9 (msg:"monilyzer job end"; content:"{MARKER_CONTENT}"; sid:{MARKER_SID}; rev:1;)'
+MARKER_FRAME = udp_frame(socket.inet_aton("198.18.0.1"), socket.inet_aton("198.18.0.2"), 9, 9, MARKER_CONTENT.encode())
+FILLER_FRAME = udp_frame(socket.inet_aton("198.18.0.1"), socket.inet_aton("198.18.0.2"), 9, 9, b"")
+# at least the DAQ's batch_size (64 by default)
+MARKER_PADDING = 256
+
+
+class SnortWorkerError(Exception):
+    pass
+
+
+class SnortWorker:
+    """
+    One long-lived Snort reading the jobs from a FIFO. Not thread-safe, a job
+    checks it out of SnortPool.
+    """
+
+    def __init__(self, index: int, cmd: List[str], fifo_dir: str, startup_timeout: float):
+        self.index = index
+        self.base_cmd = cmd
+        self.fifo = os.path.join(fifo_dir, f"worker-{index}.pcap")
+        self.startup_timeout = startup_timeout
+        self.utc = "-U" in cmd
+        self.proc = None
+        self._fd = None
+        self._readers = []
+        self._alerts = queue.Queue()  # alerts read from Snort, None once its output ends
+        self._stderr = []             # last lines of stderr, for error reports
+        self._clock = None            # time of the last packet written (us)
+        self._offset = 0              # shift of the running job's packets (us)
+        self._shifted = False
+
+    def start(self):
+        """
+        start Snort, without waiting for its configuration to load
+        """
+        if not os.path.exists(self.fifo):
+            os.mkfifo(self.fifo, 0o600)
+        self._alerts = queue.Queue()
+        self._stderr = []
+        self._clock = None
+        self.proc = subprocess.Popen(
+            self.base_cmd + ["-r", self.fifo],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        self._readers = [
+            threading.Thread(target=self._read_alerts, args=(self.proc, self._alerts), daemon=True),
+            threading.Thread(target=self._read_stderr, args=(self.proc,), daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+
+    def stop(self):
+        self._close_input()
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+
+    def begin_job(self):
+        """
+        (re)start Snort if it is not running, and wait for it to open its input,
+        i.e. for its configuration to be loaded
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            self.stop()
+            self.start()
+        if self._fd is None:
+            deadline = time.monotonic() + self.startup_timeout
+            while True:
+                try:
+                    fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+                    break
+                except OSError:
+                    if self.proc.poll() is not None:
+                        raise SnortWorkerError(f"snort worker {self.index} exited during startup: {self._wait_stderr()}")
+                    if time.monotonic() > deadline:
+                        self.stop()
+                        raise SnortWorkerError(f"snort worker {self.index} did not open its input in time")
+                    time.sleep(0.05)
+            os.set_blocking(fd, True)
+            self._fd = fd
+            self._write(global_header(LINKTYPE_ETHERNET))
+        self._offset = 0
+        self._shifted = False
+
+    def write_packet(self, ts_usec: int, frame: bytes):
+        if not self._shifted:
+            # whole seconds, so that the fractions of the alerts' timestamps stay right
+            if self._clock is not None:
+                self._offset = -(-(self._clock + JOB_GAP * 1_000_000 - ts_usec) // 1_000_000) * 1_000_000
+            self._shifted = True
+        ts_usec += self._offset
+        self._write(record(ts_usec, frame))
+        if self._clock is None or ts_usec > self._clock:
+            self._clock = ts_usec
+
+    def finish_job(self, timeout: float) -> List[Dict[str, Any]]:
+        """
+        write the marker and wait for its alert, returns the alerts of the job
+        """
+        ts_usec = self._clock + 1 if self._clock is not None else int(time.time() * 1_000_000)
+        self._write(record(ts_usec, MARKER_FRAME) + record(ts_usec + 1, FILLER_FRAME) * MARKER_PADDING)
+        self._clock = ts_usec + 1
+
+        alerts = []
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                alert = self._alerts.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.stop()
+                raise SnortWorkerError(f"snort worker {self.index} did not finish the job in {timeout}s")
+            if alert is None:
+                self.stop()
+                raise SnortWorkerError(f"snort worker {self.index} exited during a job: {self._wait_stderr()}")
+            if alert.get("sid") == MARKER_SID:
+                return alerts
+            alerts.append(self._shift_back(alert))
+
+    def _shift_back(self, alert):
+        seconds = alert.pop("seconds", None)
+        timestamp = alert.get("timestamp")
+        if self._offset and isinstance(seconds, int) and isinstance(timestamp, str) and "." in timestamp:
+            # MM/DD-HH:MM:SS.ffffff, YY/MM/DD-... with -y
+            fmt = "%y/%m/%d-%H:%M:%S" if timestamp.count("/") == 2 else "%m/%d-%H:%M:%S"
+            clock = time.gmtime if self.utc else time.localtime
+            original = seconds - self._offset // 1_000_000
+            alert["timestamp"] = time.strftime(fmt, clock(original)) + timestamp[timestamp.index("."):]
+        return alert
+
+    def _wait_stderr(self) -> str:
+        for reader in self._readers:
+            reader.join(1)
+        return "\n".join(self._stderr[-20:])
+
+    def _close_input(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except (BrokenPipeError, OSError) as e:
+                raise SnortWorkerError(f"snort worker {self.index} input closed: {self._wait_stderr()}") from e
+            view = view[written:]
+
+    @staticmethod
+    def _read_alerts(proc, alerts):
+        try:
+            for line in proc.stdout:
+                line = line.strip()
+                if not line.startswith("{"):
+                    continue
+                try:
+                    alerts.put(json.loads(line))
+                except ValueError:
+                    continue
+        finally:
+            alerts.put(None)
+
+    def _read_stderr(self, proc):
+        for line in proc.stderr:
+            self._stderr.append(line.rstrip())
+            del self._stderr[:-100]
+
+
+class SnortPool:
+    """
+    workers: number of long-lived Snort processes
+    shards: workers a job is spread over, up to workers // shards jobs run at once
+    job_timeout: seconds to wait for the alerts of one job
+    startup_timeout: seconds Snort may take to load its configuration
+
+    Nothing is started until the first job, so a Snort that fails to start
+    fails the analyses, not the server. A worker failing a job is stopped
+    and started again by its next job.
+    """
+
+    def __init__(self, snort_exec: str, snort_config: Optional[str], *, workers=2, shards=1, extra_args=None,
+                 job_timeout=120.0, startup_timeout=120.0):
+        # `seconds` to shift the alerts' times back, removed from the alerts
+        cmd = [snort_exec, "-q", "-k", "none", "-A", "alert_json",
+               "--lua", f"alert_json = {{ file = false, fields = '{ALERT_FIELDS} seconds' }}",
+               "--rule", MARKER_RULE]
+        if snort_config:
+            cmd += ["-c", snort_config]
+        cmd += extra_args or []
+        self.job_timeout = job_timeout
+        self._fifo_dir = tempfile.mkdtemp(prefix="monilyzer-snort-")
+        self._workers = [SnortWorker(i, cmd, self._fifo_dir, startup_timeout) for i in range(max(1, workers))]
+        self.shards = max(1, min(shards, len(self._workers)))
+        self._idle = list(self._workers)
+        self._started = False
+        self._cond = threading.Condition()
+
+    def close(self):
+        with self._cond:
+            for worker in self._workers:
+                worker.stop()
+                try:
+                    os.remove(worker.fifo)
+                except OSError:
+                    pass
+            try:
+                os.rmdir(self._fifo_dir)
+            except OSError:
+                pass
+
+    def analyze_pcap(self, stream) -> List[Dict[str, Any]]:
+        """
+        stream: binary file object of an Ethernet pcap
+        returns the alerts of the job's workers
+        """
+        reader = PcapReader(stream)
+        if reader.linktype != LINKTYPE_ETHERNET:
+            raise PcapError(f"unsupported pcap linktype {reader.linktype}")
+
+        workers = self._check_out()
+        try:
+            for worker in workers:
+                worker.begin_job()
+            if len(workers) == 1:
+                write = workers[0].write_packet
+                for ts_usec, frame in reader:
+                    write(ts_usec, frame)
+            else:
+                for ts_usec, frame in reader:
+                    workers[zlib.crc32(host_pair_key(frame)) % len(workers)].write_packet(ts_usec, frame)
+            alerts = []
+            for worker in workers:
+                alerts.extend(worker.finish_job(self.job_timeout))
+            return alerts
+        except Exception:
+            # the workers are started again by their next job
+            for worker in workers:
+                worker.stop()
+            raise
+        finally:
+            with self._cond:
+                self._idle.extend(workers)
+                self._cond.notify_all()
+
+    def _check_out(self) -> List[SnortWorker]:
+        """
+        take `shards` idle workers at once, waiting for them if needed
+        """
+        with self._cond:
+            if not self._started:
+                # every Snort loads its configuration while the first job waits for its own
+                for worker in self._workers:
+                    worker.start()
+                self._started = True
+            self._cond.wait_for(lambda: len(self._idle) >= self.shards)
+            workers, self._idle = self._idle[:self.shards], self._idle[self.shards:]
+            return workers
+
+
+def _run_once(snort_exec, snort_config, extra_args, path) -> List[Dict[str, Any]]:
+    cmd = [snort_exec, "-q", "-k", "none", "-r", path, "-A", "alert_json",
+           "--lua", f"alert_json = {{ file = false, fields = '{ALERT_FIELDS}' }}"]
+    if snort_config:
+        cmd += ["-c", snort_config]
+    proc = subprocess.run(cmd + extra_args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=False)
+    return [json.loads(line) for line in proc.stdout.splitlines() if line.strip().startswith("{")]
+
+
+if __name__ == "__main__":
+    import argparse
+    import shutil
+
+    parser = argparse.ArgumentParser(description="run captures through a SnortPool")
+    parser.add_argument("pcaps", nargs="+")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=2, help="times each capture is analyzed")
+    parser.add_argument("--verify", action="store_true", help="compare with one snort per capture")
+    args = parser.parse_args()
+
+    snort_exec = os.environ.get("SNORT_EXECUTABLE") or shutil.which("snort")
+    snort_config = os.environ.get("SNORT_CONFIG")
+    pool = SnortPool(snort_exec, snort_config, workers=args.workers, shards=args.shards)
+    key = lambda alert: json.dumps(alert, sort_keys=True)
+    failed = False
+    try:
+        for _ in range(args.rounds):
+            for path in args.pcaps:
+                start = time.monotonic()
+                with open(path, "rb") as f:
+                    alerts = pool.analyze_pcap(f)
+                print(f"{path}: {len(alerts)} alerts in {time.monotonic() - start:.2f}s")
+                if args.verify:
+                    expected = _run_once(snort_exec, snort_config, [], path)
+                    if sorted(map(key, alerts)) != sorted(map(key, expected)):
+                        failed = True
+                        print(f"{path}: differs from one snort per capture ({len(expected)} alerts)")
+    finally:
+        pool.close()
+    raise SystemExit(1 if failed else 0)
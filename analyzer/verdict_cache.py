@@ -0,0 +1,166 @@
+"""
+Content-addressed cache of LLM verdicts.
+
+Verdicts are keyed by sha256(model, system prompt, user prompt), so a prompt
+that is byte-identical to an earlier one (e.g. polling a quiet host) is
+answered without an LLM round trip. Entries are kept in an in-memory LRU and,
+when `directory` is set, in one JSON file per entry that survives restarts.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# temporary files of atomic writes older than this are leftovers of interrupted writes
+STALE_TMP_SECONDS = 300
+
+
+class VerdictCache:
+    """
+    ttl: seconds a verdict stays valid, in both tiers
+    max_entries: entries kept in memory
+    directory: directory of the on-disk tier, None keeps verdicts in memory only
+    max_disk_entries: files kept on disk, the oldest are removed beyond it
+    """
+
+    def __init__(self, *, ttl=3600, max_entries=1024, directory=None, max_disk_entries=16384):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()  # key -> (expires_at, verdict), expires_at in epoch seconds
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(model: str, system_prompt: str, prompt: str) -> str:
+        h = hashlib.sha256()
+        for part in (model, system_prompt, prompt):
+            data = part.encode("utf-8")
+            # length-prefixed so that the parts cannot run into each other
+            h.update(len(data).to_bytes(8, "big"))
+            h.update(data)
+        return h.hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+
+        entry = self._read(key)
+        if entry is None:
+            return None
+        expires_at, verdict = entry
+        if expires_at <= now:
+            self._remove(key)
+            return None
+        with self._lock:
+            self._store(key, expires_at, verdict)
+        return verdict
+
+    def put(self, key: str, verdict):
+        """
+        verdict: JSON-serializable value
+        """
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, verdict)
+        self._write(key, expires_at, verdict)
+
+    def _store(self, key, expires_at, verdict):
+        self._entries[key] = (expires_at, verdict)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry["expires_at"], entry["verdict"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write(self, key, expires_at, verdict):
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"expires_at": expires_at, "verdict": verdict}, f)
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            print(f"Failed to persist LLM verdict: {e}")
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % 64 == 0
+        if prune:
+            self._prune()
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    """
+    drop expired files, then the least recently written ones beyond max_disk_entries,
+    and the temporary files left behind by writes that were interrupted (e.g. by a crash)
+    """
+    def _prune(self):
+        now = time.time()
+        files = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".tmp"):
+                    try:
+                        # not one being written right now
+                        if entry.stat().st_mtime + STALE_TMP_SECONDS <= now:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+                    continue
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        files.sort()
+        excess = len(files) - self.max_disk_entries
+        for i, (mtime, path) in enumerate(files):
+            if i < excess or mtime + self.ttl <= now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -7,6 +7,14 @@ class AnalyzerManager:
         self.analyzers[name] = analyzer
         self.support.append(name)
 
+    def compatible(self, message) -> list[str]:
+        """
+        names of the registered analyzers that can consume `message`, by the
+        `kind` of message format each analyzer declares
+        """
+        supported = message.supported_analyzers()
+        return [name for name in self.support if getattr(self.analyzers[name], "kind", None) in supported]
+
     def analyze(self, name, message):
         if name not in self.analyzers:
             raise KeyError(f"Analyzer '{name}' not registered")
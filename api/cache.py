@@ -0,0 +1,96 @@
+"""
+Result cache for /opt queries
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    TTL + LRU cache of query results with single-flight deduplication.
+
+    Queries are keyed by (monitor, analyzer, hours or start/end, time bucket), so identical
+    queries within the same `bucket_seconds` window share a result. The end
+    of a range left to default to now (`open_end`) is left out of the key,
+    like `hours` such queries are told apart by the time bucket only. While a
+    result is being computed, identical queries wait for that computation
+    instead of starting their own. Failed computations are not cached, nor
+    results the optional `cacheable` predicate rejects.
+
+    get_or_compute returns (value, status), status being one of
+    HIT, MISS or COALESCED (waited on another request's computation).
+    """
+
+    HIT = "HIT"
+    MISS = "MISS"
+    COALESCED = "COALESCED"
+
+    def __init__(self, *, ttl=60, max_entries=256, bucket_seconds=60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bucket_seconds = bucket_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._flights = {}             # key -> _Flight
+        self._lock = threading.Lock()
+
+    def key(self, options: dict) -> tuple:
+        return (
+            options.get("monitor"),
+            options.get("analyzer"),
+            options.get("hours"),
+            options.get("start"),
+            None if options.get("open_end") else options.get("end"),
+            int(time.time() // self.bucket_seconds),
+        )
+
+    def get_or_compute(self, key, compute, cacheable=None):
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1], self.HIT
+                del self._entries[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, self.COALESCED
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and (cacheable is None or cacheable(flight.value)):
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._entries.move_to_end(key)
+                    self._evict()
+            flight.done.set()
+        return flight.value, self.MISS
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,206 @@
+"""
+Process-wide metrics.
+
+Counters and histograms with labels, rendered in the Prometheus text format
+on /metrics. `stage` times a block of code into the stage histogram and, when
+it runs within `request_timings`, into the breakdown of the current request,
+which the handler returns in the Server-Timing header. `timed` does the same
+for the items of an iterator, leaving out the time of its consumer.
+
+Hot loops count into local variables and report once per file or process,
+so instrumentation costs a few calls per file rather than per record.
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# seconds, from fast cache hits up to LLM calls with retries
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra="") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_, labelnames=()):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> total
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += n
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_, labelnames=()) -> Counter:
+        metric = Counter(name, help_, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("monilyzer_requests_total", "/opt requests", ("monitor", "analyzer", "code", "cache"))
+REQUEST_SECONDS = REGISTRY.histogram("monilyzer_request_seconds", "/opt request latency", ("monitor", "analyzer"))
+ANALYZER_SECONDS = REGISTRY.histogram("monilyzer_analyzer_seconds", "analyzer call latency", ("analyzer",))
+STAGE_SECONDS = REGISTRY.histogram("monilyzer_stage_seconds", "latency of the stages of a request", ("stage",))
+SUBPROCESS_SECONDS = REGISTRY.histogram("monilyzer_subprocess_seconds", "run time of decoding subprocesses", ("command",))
+FILES_READ = REGISTRY.counter("monilyzer_files_read_total", "data files opened", ("source",))
+BYTES_READ = REGISTRY.counter("monilyzer_bytes_read_total", "bytes of data read", ("source",))
+RECORDS_READ = REGISTRY.counter("monilyzer_records_read_total", "records decoded", ("source",))
+
+# stage timings of the request being handled in this context, None outside requests
+_timings = contextvars.ContextVar("monilyzer_timings", default=None)
+
+
+def observe_stage(name, elapsed):
+    STAGE_SECONDS.observe(elapsed, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, elapsed))
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def timed(name, iterator):
+    """
+    yields the items of `iterator`, timing into stage `name` only the time
+    spent producing them, not the consumer's time between two items
+    """
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        # a consumer stopping early closes the producer now, not when collected
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            start = time.perf_counter()
+            close()
+            elapsed += time.perf_counter() - start
+        observe_stage(name, elapsed)
+
+
+@contextmanager
+def request_timings():
+    """
+    collect the stages run within the block, yields the list of (stage, seconds)
+    """
+    timings = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def bind_context(fn):
+    """
+    `fn` bound to a copy of the current context, so that the stages it runs
+    in a pool thread count towards the submitting request; bind once per call
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def observe_read(source, *, files=0, bytes_=0, records=0):
+    if files:
+        FILES_READ.inc(files, source=source)
+    if bytes_:
+        BYTES_READ.inc(bytes_, source=source)
+    if records:
+        RECORDS_READ.inc(records, source=source)
+
+
+def server_timing(timings) -> str:
+    """
+    Server-Timing header value, durations of repeated stages summed
+    """
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in totals.items())
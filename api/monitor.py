@@ -2,15 +2,27 @@
 Monitor module
 """
 
-from driver.pmacct import DriverPmacct
+from driver.pmacct import DriverPmacct, PmacctIngestCache
 from driver.softflowd import DriverSoftflowd
 from driver.journalctl import DriverJournalctl
-from transport.message import JournalMessage, NetworkPacketMessage
+from driver.journaltail import JournalTail
+from driver.flow import FlowAggregate
+from driver.rollup import FlowRollup, RollupRefresher
+from driver.window import FlowWindow, JournalWindow
+from transport.message import JournalMessage, LLMEncoding, NetworkPacketMessage
+from api import metrics
+
+from datetime import timedelta
+import time
 
 """
-- It is possible to implement concurrency by adding lock mechanism.
-  But that's not necessary at this stage.
-  I.e., we can assume that only one thread is running for each monitor call.
+- Monitors may be called from several request threads at once.
+  `preprocess` returns the request's data instead of storing it on the monitor.
+  The state shared by the requests is locked where it is kept: the file
+  indexes, the pmacct ingestion cache (per file), the rollups (each loaded
+  by one request, the others wait for it), the detection windows (advanced
+  one at a time) and the journal tail. Cached partials are never modified
+  once handed out, results are merged into new FlowAggregates.
 """
 class MonitorManager:
     def __init__(self):
@@ -22,140 +34,278 @@ class MonitorManager:
         self.support.append(name)
 
 
-class MonitorPmacct:
+class FlowMonitor:
+    """
+    Shared query paths of the flow monitors. Subclasses set up in `load_config`
+    `driver`, `rollup`, `ip`, `window` and `message_options`, and implement
+    `_load_edges`, which reads the files of the partial minutes at the edges
+    of a time range.
+    """
+
     def __init__(self, config):
-        self.data = []
         self.load_config(config)
 
+    def preprocess(self, options: dict, data_filter: set = set()) -> list[dict]:
+        # parameters: the last `hours`, or the time range [start, end)
+        if "start" in options:
+            aggregation = self.aggregate_range(options["start"], options["end"], data_filter)
+        else:
+            aggregation = self.aggregate(options.get("hours", 1), data_filter)
+        with metrics.stage("summary"):
+            return aggregation.to_summary()
+
+    def aggregate(self, hours, data_filter: set = set()) -> FlowAggregate:
+        now = self.driver.now()
+        tcp_only = "tcp_only" in data_filter
+        traffic_in_only = "traffic_in_only" in data_filter
+        exclude_src = self.ip if traffic_in_only else None
+
+        # windows kept by the detection stage are read from its state
+        if self.window is not None and self.window.covers(hours, tcp_only=tcp_only, exclude_src=exclude_src):
+            with metrics.stage("window"):
+                return self.window.aggregate(hours, now)
+
+        range_ = self.driver.get_range_from_now(hours, now=now)
+        with metrics.stage("get_files"):
+            files = self.driver.get_files(range_[0], range_[1], range_[2], range_[3])
+
+        # filter and aggregate, planned over hour rollups and per-file partials
+        with metrics.stage("aggregate"):
+            return self.rollup.aggregate(
+                files, range_[0] + range_[1], range_[2] + range_[3], now,
+                tcp_only=tcp_only,
+                exclude_src=exclude_src,
+            )
+
+    def aggregate_range(self, start, end, data_filter: set = set()) -> FlowAggregate:
+        """
+        aggregate the flows started within [start, end), timezone-aware
+        datetimes: the whole minutes through the rollups, the files of the
+        partial minutes at the edges filtered on the flows' start
+        """
+        now = self.driver.now()
+        filters = {
+            "tcp_only": "tcp_only" in data_filter,
+            "exclude_src": self.ip if "traffic_in_only" in data_filter else None,
+        }
+        with metrics.stage("get_files"):
+            inner_range, inner, edges = split_range(self.driver, start, end)
+        # merged in time order, so that sources keep their first-seen order
+        head = [fp for fp in edges if not inner or self.driver.file_key(fp) < self.driver.file_key(inner[0])]
+        tail = edges[len(head):]
+        since_ms, until_ms = int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+        result = FlowAggregate()
+        with metrics.stage("aggregate"):
+            if head:
+                result.update(self._load_edges(head, since_ms, until_ms, **filters))
+            if inner:
+                result.update(self.rollup.aggregate(
+                    inner, inner_range[0] + inner_range[1], inner_range[2] + inner_range[3], now, **filters,
+                ))
+            if tail:
+                result.update(self._load_edges(tail, since_ms, until_ms, **filters))
+        return result
+
+    def start_rollup_refresh(self, hours, data_filter: set, interval):
+        self.refresher = RollupRefresher(lambda: self.aggregate(hours, data_filter), interval)
+        self.refresher.start()
+
+    def start_detection(self, hours, data_filter: set, interval):
+        """
+        keep sliding-window per-source state for the window lengths `hours`,
+        advanced every `interval` seconds, requests for them read the state
+        """
+        self.window = FlowWindow(
+            self.driver, self.rollup.partials, hours,
+            tcp_only="tcp_only" in data_filter,
+            exclude_src=self.ip if "traffic_in_only" in data_filter else None,
+        )
+        self.detector = RollupRefresher(self.window.advance, interval)
+        self.detector.start()
+
+    def _load_edges(self, files, since_ms, until_ms, **filters) -> FlowAggregate:
+        raise NotImplementedError
+
+    def to_message(self, options: dict, data: list[dict]):
+        return NetworkPacketMessage({"packets_summary": data, **collection_period(options)}, host_ip=self.ip, **self.message_options)
+
+
+class MonitorPmacct(FlowMonitor):
+    """
+    record structure:
+    {ip_src, ip_dst, port_src, port_dst, ip_proto, packets, bytes, timestamp_start}
+    """
+
     def load_config(self, config):
         self.config = config
         self.driver = DriverPmacct(data_dir=self.config["data_dir"])
+        self.cache = PmacctIngestCache(self.driver)
+        # minute rollups are the ingestion cache's per-file partials
+        self.rollup = FlowRollup(
+            self.driver.file_key,
+            load_minutes=lambda files, **filters: [self.cache.get_partial(fp, **filters) for fp in files],
+            load_hour=self.driver.aggregate_files,
+            cache_minutes=False,
+        )
         self.ip = self.config["ip"]
+        self.window = None
+        self.message_options = flow_message_options(config)
 
-    def preprocess(self, options: dict, data_filter: set = set()):
-        """
-        record structure:
-        {ip_src, ip_dst, port_src, port_dst, ip_proto, packets, bytes, timestamp_start}
-        """
-
-        self.data = []
+    def _load_edges(self, files, since_ms, until_ms, **filters) -> FlowAggregate:
+        # edge files are read whole but only partly used, past the ingestion cache
+        return self.driver.aggregate_files(files, since_ms=since_ms, until_ms=until_ms, **filters)
 
-        # parameters
-        hours = options.get("hours", 1)
 
-        # fetch data from pmacct
-        range_ = self.driver.get_range_from_now(hours)
-        files = self.driver.get_files(range_[0], range_[1], range_[2], range_[3])
-        all_data = []
-        for fp in files:
-            data = self.driver.read_data_from_file(fp)
-            all_data.extend(data)
-        
-        # filter
-        tcp_only = "tcp_only" in data_filter
-        traffic_in_only = "traffic_in_only" in data_filter
-        aggregation = {}
-        for record in all_data:
-            if tcp_only and record.get("ip_proto") != "tcp":
-                continue
-            if traffic_in_only and record.get("ip_src") == self.ip:
-                continue
-            aggregation_key = record.get("ip_src", None)
-            if aggregation_key:
-                if aggregation_key not in aggregation:
-                    aggregation[aggregation_key] = [0, []] # packets, ports
-                aggregation[aggregation_key][0] += record.get("packets", 0)
-                aggregation[aggregation_key][1].append(record.get("port_dst"))
-        
-        for ip_src, (packets, ports) in aggregation.items():
-            self.data.append({
-                "ip_src": ip_src,
-                "total_packets": packets,
-                # "number_of_unique_access_ports (from 1-65536)": len(set(ports))
-                "dst_ports": list(set(ports))
-            })
-
-    def to_message(self, options: dict):
-        return NetworkPacketMessage({"packets_summary": self.data, "collected in hours": options.get("hours", 1)})
-
-
-class MonitorSoftflowd:
-    def __init__(self, config):
-        self.data = []
-        self.load_config(config)
+class MonitorSoftflowd(FlowMonitor):
+    """
+    record structure:
+    {t_first, src4_addr, dst4_addr, proto, src_port, dst_port, in_packets, in_bytes}
+    """
 
     def load_config(self, config):
-        self.driver = DriverSoftflowd(data_dir=config["data_dir"])
+        self.driver = DriverSoftflowd(
+            data_dir=config["data_dir"],
+            backend=config.get("backend", "nfdump"),
+            decode_mode=config.get("decode_mode", "file"),
+            workers=int(config["workers"]) if config.get("workers") else None,
+        )
+        self.rollup = FlowRollup(self.driver.file_key, load_minutes=self._load_minutes, load_hour=self._load_hour)
         self.ip = config["ip"]
+        self.window = None
+        self.message_options = flow_message_options(config)
 
-    def preprocess(self, options: dict, data_filter: set = set()):
-        """
-        record structure:
-        {t_first, src4_addr, dst4_addr, src_port, dst_port, in_packets, in_bytes}
-        """
+    def _load_minutes(self, files, **filters) -> list[FlowAggregate]:
+        # columnar batches are filtered and aggregated as they are decoded,
+        # the driver may run several nfdump decodes concurrently
+        return self.driver.consume_files(
+            files, lambda batches: FlowAggregate.from_batches(batches, **filters), per_file=True, **filters
+        )
 
-        self.data = []
+    def _load_hour(self, files, **filters) -> FlowAggregate:
+        aggregation = FlowAggregate()
+        for partial in self.driver.consume_files(files, lambda batches: FlowAggregate.from_batches(batches, **filters), **filters):
+            aggregation.update(partial)
+        return aggregation
 
-        # parameters
-        hours = options.get("hours", 1)
-        
-        # fetch data from softflowd
-        range_ = self.driver.get_range_from_now(hours)
-        files = self.driver.get_files(range_[0], range_[1], range_[2], range_[3])
-        all_data = []
-        for fp in files:
-            data = self.driver.read_data_from_file(fp)
-            all_data.extend(data)
-        
-        # filter
-        traffic_in_only = "traffic_in_only" in data_filter
-        aggregation = {}
-        for record in all_data:
-            if traffic_in_only and record.get("src4_addr") == self.ip:
-                continue
-            aggregation_key = record.get("src4_addr", None)
-            if aggregation_key:
-                if aggregation_key not in aggregation:
-                    aggregation[aggregation_key] = [0, []] # packets, ports
-                aggregation[aggregation_key][0] += record.get("in_packets", 0)
-                aggregation[aggregation_key][1].append(record.get("dst_port"))
-        
-        for ip_src, (packets, ports) in aggregation.items():
-            self.data.append({
-                "ip_src": ip_src,
-                "total_packets": packets,
-                "dst_ports": list(set(ports))
-            })
-
-    def to_message(self, options: dict):
-        return NetworkPacketMessage({"packets_summary": self.data, "collected in hours": options.get("hours", 1)})
+    def _load_edges(self, files, since_ms, until_ms, **filters) -> FlowAggregate:
+        aggregation = FlowAggregate()
+        consume = lambda batches: FlowAggregate.from_batches(batches, since_ms=since_ms, until_ms=until_ms, **filters)
+        for partial in self.driver.consume_files(files, consume, **filters):
+            aggregation.update(partial)
+        return aggregation
 
 
 class MonitorJournalctl:
     def __init__(self, config):
-        self.data = []
         self.load_config(config)
 
     def load_config(self, config):
         services_str = config["services"]
         services = services_str.split(",")
         self.driver = DriverJournalctl(listen_services=services)
+        self.tail = None
+        self.window = None
+
+    def preprocess(self, options: dict, data_filter: set = set()) -> list[dict]:
+        data = []
+        # parameters: the last `hours`, or the time range [start, end)
+        if "start" in options:
+            since_us, until_us = int(options["start"].timestamp() * 1_000_000), int(options["end"].timestamp() * 1_000_000)
+            hours = (time.time() * 1_000_000 - since_us) / 3_600_000_000
+        else:
+            hours = options.get("hours", 1)
+
+        # answer from the followed journal when it covers the window,
+        # otherwise filter while journalctl's output streams by
+        # only the filtered fields are requested from journalctl
+        if self.tail is not None and self.tail.covers(hours, data_filter):
+            records = self.tail.entries_between(since_us, until_us) if "start" in options else self.tail.entries_since(hours)
+            source = "journal_tail"
+        elif "start" in options:
+            records = self.driver.iter_logs_between(since_us, until_us, data_filter)
+            source = "journalctl"
+        else:
+            records = self.driver.iter_logs(hours, data_filter)
+            source = "journalctl"
+        with metrics.stage(source):
+            for record in records:
+                f_items = {}
+                for field in data_filter:
+                    f_items[field] = record[field]
+                data.append(f_items)
+        return data
+
+    def start_tail(self, window_hours, max_entries, cursor_file=None, backfill=True, data_filter: set = None):
+        """
+        follow the journal in the background, requests of up to `window_hours`
+        (and filtering fields within `data_filter`) are then answered from memory
+        """
+        self.tail = JournalTail(
+            self.driver, window_hours=window_hours, max_entries=max_entries, cursor_file=cursor_file, backfill=backfill,
+            fields=data_filter,
+        )
+        self.tail.start()
 
-    def preprocess(self, options: dict, data_filter: set = set()):
-        self.data = []
-        # parameters
+    def start_detection(self, count, hours, interval):
+        """
+        keep sliding-window counts of the followed journal for the window
+        lengths `hours`, advanced every `interval` seconds
+        count: entries -> Counter, e.g. the rules of SimpleJournalAnalyzer
+        """
+        self.window = JournalWindow(self.tail, count, hours)
+        self.detector = RollupRefresher(self.window.advance, interval)
+        self.detector.start()
+
+    def to_message(self, options: dict, data: list[dict]):
         hours = options.get("hours", 1)
-        data = self.driver.get_logs(hours)
+        # the detection windows end now, time ranges are counted from `data`
+        if self.window is not None and "start" not in options and self.window.covers(hours):
+            return JournalMessage(data, window_counts=self.window.counts(hours), counted_by=self.window.count)
+        return JournalMessage(data)
 
-        # filter
-        for record in data:
-            f_items = {}
-            for field in data_filter:
-                f_items[field] = record[field]
-            self.data.append(f_items)
+"""
+prompt encoding options of the flow monitors' NetworkPacketMessage, from the
+optional `llm_encoding`, `top_k` and `token_budget` config keys
+"""
+def flow_message_options(config) -> dict:
+    encoding = config.get("llm_encoding") or "repr"
+    return {
+        "llm_encoding": {"repr": LLMEncoding.Repr, "compact": LLMEncoding.Compact}[encoding],
+        "top_k": int(config.get("top_k") or 20),
+        "token_budget": int(config.get("token_budget") or 4000),
+    }
 
-    def to_message(self, options: dict):
-        return JournalMessage(self.data)
+"""
+the period a flow message was collected over, with its bounds for time-range queries
+"""
+def collection_period(options) -> dict:
+    if "start" in options:
+        start, end = options["start"], options["end"]
+        return {
+            "collected in hours": round((end - start).total_seconds() / 3600, 4),
+            "collected from": start.isoformat(),
+            "collected to": end.isoformat(),
+        }
+    return {"collected in hours": options.get("hours", 1)}
+
+"""
+split the minute files overlapping [start, end) into the files of the whole
+minutes within it and the files of the partial minutes at its edges
+returns (range of the whole minutes or None, their files, edge files)
+"""
+def split_range(driver, start, end):
+    files = driver.get_files(*driver.get_range(start, end))
+    first = start.replace(second=0, microsecond=0)
+    if first < start:
+        first += timedelta(minutes=1)
+    last = end.replace(second=0, microsecond=0)
+    if first >= last:
+        return None, [], files
+    inner_range = driver.get_range(first, last)
+    inner = driver.get_files(*inner_range)
+    inner_set = set(inner)
+    return inner_range, inner, [fp for fp in files if fp not in inner_set]
 
 def get_default_filter():
     return {
@@ -177,6 +327,6 @@ if __name__ == "__main__":
     config = {"data_dir": "monitor/pmacct/data", "ip": "10.10.1.2"}
     monitor = MonitorPmacct(config)
     options = {"hours": 1}
-    monitor.preprocess(options, data_filter=get_default_filter()['pmacct'])
-    print(len(monitor.data))
-    print(monitor.to_message(options).json_obj)
+    data = monitor.preprocess(options, data_filter=get_default_filter()['pmacct'])
+    print(len(data))
+    print(monitor.to_message(options, data).json_obj)
@@ -0,0 +1,179 @@
+"""
+Opt-in profiling of single requests, and sampling of MoniLyzer's own resources.
+
+- RequestProfiler: a request asked for with `profile=1` (or `X-Profile: 1`)
+  runs under cProfile, and the allocation sites that grew most while it ran
+  are taken from tracemalloc. cProfile only sees the handling thread, work
+  handed to pools (LLM chunks, parallel nfdump, snort workers) shows as the
+  wait for it; tracemalloc sees every thread. Profiled requests run one at a
+  time, as both hook the whole interpreter.
+- ResourceSampler: a thread writing the process' CPU time, RSS and GC pauses
+  every `interval` seconds, in the CSV schema of testbed/monitor_precise.sh,
+  so that testbed/plot_precise.py charts it as before.
+"""
+
+import cProfile
+import gc
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# frames kept per traced allocation, the site reported is the innermost one
+TRACE_FRAMES = 1
+
+
+def _function_name(key) -> str:
+    filename, line, name = key
+    if filename == "~":
+        # built-in functions
+        return name
+    return f"{filename}:{line}({name})"
+
+
+class RequestProfiler:
+    """
+    top: functions and allocation sites reported
+    directory: where the cProfile stats of each profiled request are dumped
+        (for pstats, snakeviz, ...), None keeps them in the response only
+    """
+
+    def __init__(self, *, top=25, directory=None):
+        self.top = top
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    @contextmanager
+    def profile(self, name):
+        """
+        profile the block, yields the report dict, filled when the block exits
+        """
+        report = {}
+        with self._lock:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(TRACE_FRAMES)
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                yield report
+            finally:
+                profiler.disable()
+                report["wall_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                after = tracemalloc.take_snapshot()
+                report["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+                report["cpu"] = self._top_functions(profiler)
+                report["allocations"] = self._top_allocations(before, after)
+                if self.directory:
+                    report["file"] = self._dump(profiler, name)
+
+    def _top_functions(self, profiler) -> list[dict]:
+        stats = pstats.Stats(profiler).stats
+        top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:self.top]
+        return [
+            {
+                "function": _function_name(key),
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3),
+            }
+            for key, (_, calls, tottime, cumtime, _) in top
+        ]
+
+    def _top_allocations(self, before, after) -> list[dict]:
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+        return [
+            {
+                "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_bytes": stat.size_diff,
+                "count": stat.count_diff,
+            }
+            for stat in diff[:self.top] if stat.size_diff > 0
+        ]
+
+    def _dump(self, profiler, name) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        self._seq += 1
+        # the name comes from the query, keep it to a plain file name
+        name = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in name)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d_%H%M%S')}_{self._seq}_{name}.prof")
+        profiler.dump_stats(path)
+        return path
+
+
+class ResourceSampler(threading.Thread):
+    """
+    path: CSV file written, `{pid}` is replaced by the process id
+    interval: seconds between samples
+
+    The file starts with `#CLK_TCK:N` and the columns
+    Timestamp,CPU_Jiffies_Cumulative,RSS_Pages of testbed/monitor_precise.sh,
+    followed by GC_Collections_Cumulative and GC_Pause_ms_Cumulative, the
+    garbage collections and the time spent in them since the sampler started.
+    """
+
+    def __init__(self, path, interval=1.0):
+        super().__init__(daemon=True, name="monilyzer-sampler")
+        self.path = path.format(pid=os.getpid())
+        self.interval = interval
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._stopped = threading.Event()
+        # updated by the gc callback only, read by the sampler: no lock, which
+        # a collection triggered while the sampler holds it would deadlock on
+        self._gc_started = None
+        self._gc_collections = 0
+        self._gc_pause = 0.0
+
+    def run(self):
+        gc.callbacks.append(self._on_gc)
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(f"#CLK_TCK:{self.clock_ticks}\n")
+                f.write("Timestamp,CPU_Jiffies_Cumulative,RSS_Pages,GC_Collections_Cumulative,GC_Pause_ms_Cumulative\n")
+                while True:
+                    jiffies, rss_pages = self._read_stat()
+                    f.write(f"{time.time():.3f},{jiffies},{rss_pages},{self._gc_collections},{self._gc_pause * 1000:.3f}\n")
+                    f.flush()
+                    if self._stopped.wait(self.interval):
+                        return
+        except OSError as e:
+            print(f"Resource sampler stopped: {e}")
+        finally:
+            gc.callbacks.remove(self._on_gc)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _on_gc(self, phase, info):
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self._gc_pause += time.perf_counter() - self._gc_started
+            self._gc_collections += 1
+            self._gc_started = None
+
+    def _read_stat(self) -> tuple[int, int]:
+        """
+        (utime + stime in clock ticks, resident pages), as monitor_precise.sh reads them
+        """
+        try:
+            with open("/proc/self/stat", "r") as f:
+                # the fields after the command name, which may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+            return int(fields[11]) + int(fields[12]), int(fields[21])
+        except OSError:
+            # no procfs: CPU time from os.times, RSS left out
+            times = os.times()
+            return int((times.user + times.system) * self.clock_ticks), 0
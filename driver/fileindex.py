@@ -0,0 +1,83 @@
+"""
+Sorted in-memory index of the minute data files of a directory.
+
+Both flow collectors add one file per minute to their data directory. The
+index keeps the (minute key, path) pairs sorted and answers range lookups
+with bisect. The directory is only listed again when its mtime changes,
+and then only new names are parsed.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+# a directory changed within this window of the last listing may have been
+# modified again inside the same mtime tick, so it is not trusted yet
+MTIME_SLACK_NS = 1_000_000_000
+
+
+class FileIndex:
+    """
+    data_dir: directory holding the data files
+    parse_key: file name -> minute key 'YYYYMMDDHHMM', or None for files
+        that are not data files
+    """
+
+    def __init__(self, data_dir, parse_key):
+        self.data_dir = data_dir
+        self.parse_key = parse_key
+        self._names = {}     # file name -> key of every data file
+        self._keys = []      # sorted keys
+        self._paths = []     # paths, in the order of _keys
+        self._mtime_ns = None
+        self._listed_at_ns = 0
+        self._lock = threading.Lock()
+
+    def range(self, start_key, end_key) -> list[str]:
+        """
+        paths of the files whose key is within [start_key, end_key], sorted
+        """
+        with self._lock:
+            self._refresh()
+            lo = bisect_left(self._keys, start_key)
+            hi = bisect_right(self._keys, end_key)
+            return self._paths[lo:hi]
+
+    def _refresh(self):
+        mtime_ns = os.stat(self.data_dir).st_mtime_ns
+        if mtime_ns == self._mtime_ns and mtime_ns < self._listed_at_ns - MTIME_SLACK_NS:
+            return
+
+        listed_at_ns = time.time_ns()
+        names = os.listdir(self.data_dir)
+        current = set(names)
+        removed = [name for name in self._names if name not in current]
+        added = []
+        for name in names:
+            if name in self._names:
+                continue
+            key = self.parse_key(name)
+            if key is not None:
+                added.append((key, name))
+
+        if removed or added:
+            for name in removed:
+                del self._names[name]
+            last_key = self._keys[-1] if self._keys else ""
+            added.sort()
+            if not removed and (not added or added[0][0] >= last_key):
+                # the common case: new minute files after the newest one
+                for key, name in added:
+                    self._names[name] = key
+                    self._keys.append(key)
+                    self._paths.append(os.path.join(self.data_dir, name))
+            else:
+                for key, name in added:
+                    self._names[name] = key
+                entries = sorted((key, name) for name, key in self._names.items())
+                self._keys = [key for key, _ in entries]
+                self._paths = [os.path.join(self.data_dir, name) for _, name in entries]
+
+        self._mtime_ns = mtime_ns
+        self._listed_at_ns = listed_at_ns
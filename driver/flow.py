@@ -0,0 +1,296 @@
+"""
+Flow aggregation primitives shared by the flow drivers (pmacct, softflowd)
+and their monitors.
+
+- FlowBatch: columnar, array-backed batch of flow records filled in bulk by
+  the drivers
+- FlowAggregate: per-source partial aggregate (packets, dst ports), built
+  from a FlowBatch with vectorized group-by operations
+"""
+
+import itertools
+import socket
+from array import array
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+V4_MAPPED = 0xFFFF << 32
+
+PROTO_NUMBERS = {"icmp": 1, "igmp": 2, "tcp": 6, "udp": 17, "gre": 47, "esp": 50, "ah": 51, "ipv6-icmp": 58, "sctp": 132}
+PROTO_TCP = 6
+PROTO_UNKNOWN = 255
+# dst_port of records without one, reported as None like the records' missing key
+NO_PORT = -1
+
+
+@lru_cache(maxsize=65536)
+def pack_ip(addr: str) -> tuple[int, int]:
+    """
+    IPv4/IPv6 address string -> (hi, lo) 64-bit halves of the IPv6 address,
+    IPv4 addresses are stored IPv4-mapped (::ffff:a.b.c.d)
+    """
+    try:
+        return 0, V4_MAPPED | int.from_bytes(socket.inet_aton(addr), "big")
+    except OSError:
+        packed = int.from_bytes(socket.inet_pton(socket.AF_INET6, addr), "big")
+        return packed >> 64, packed & 0xFFFFFFFFFFFFFFFF
+
+
+def unpack_ip(hi: int, lo: int) -> str:
+    if hi == 0 and lo >> 32 == 0xFFFF:
+        return socket.inet_ntoa((lo & 0xFFFFFFFF).to_bytes(4, "big"))
+    return socket.inet_ntop(socket.AF_INET6, ((hi << 64) | lo).to_bytes(16, "big"))
+
+
+def proto_number(proto) -> int:
+    if isinstance(proto, int):
+        return proto
+    if isinstance(proto, str):
+        number = PROTO_NUMBERS.get(proto.lower())
+        if number is not None:
+            return number
+        if proto.isdigit():
+            return int(proto)
+    return PROTO_UNKNOWN
+
+
+@lru_cache(maxsize=4096)
+def _local_seconds(prefix: str) -> int:
+    return int(datetime.fromisoformat(prefix).timestamp())
+
+
+def parse_timestamp_ms(value) -> int:
+    """
+    local 'YYYY-MM-DD HH:MM:SS[.ffffff]' (pmacct) or 'YYYY-MM-DDTHH:MM:SS[.fff]'
+    (nfdump) -> milliseconds since the epoch, 0 when missing or malformed
+    """
+    if not value:
+        return 0
+    try:
+        ms = _local_seconds(value[:19]) * 1000
+    except ValueError:
+        return 0
+    frac = value[20:23]
+    if frac.isdigit():
+        ms += int(frac.ljust(3, "0"))
+    return ms
+
+
+def iter_chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class FlowBatch:
+    """
+    Columnar batch of flow records.
+
+    src_hi/src_lo, dst_hi/dst_lo: addresses as packed integers (see pack_ip)
+    src_port: uint16, dst_port: int32 (NO_PORT when missing), proto: uint8
+    packets, bytes: uint64
+    ts: flow start, int64 milliseconds since the epoch (0 when unknown)
+    """
+
+    COLUMNS = {
+        "src_hi": np.uint64,
+        "src_lo": np.uint64,
+        "dst_hi": np.uint64,
+        "dst_lo": np.uint64,
+        "src_port": np.uint16,
+        "dst_port": np.int32,
+        "proto": np.uint8,
+        "packets": np.uint64,
+        "bytes": np.uint64,
+        "ts": np.int64,
+    }
+
+    def __init__(self, **columns):
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.asarray(columns[name], dtype=dtype))
+
+    def __len__(self):
+        return len(self.src_lo)
+
+    @classmethod
+    def empty(cls) -> "FlowBatch":
+        return cls(**{name: () for name in cls.COLUMNS})
+
+    def take(self, selector) -> "FlowBatch":
+        return FlowBatch(**{name: getattr(self, name)[selector] for name in self.COLUMNS})
+
+    def select(self, *, tcp_only=False, exclude_src=None, since_ms=None, until_ms=None) -> "FlowBatch":
+        """
+        vectorized counterpart of the monitors' tcp_only/traffic_in_only filters
+        since_ms, until_ms: keep the flows started within [since_ms, until_ms),
+        flows of unknown start (ts 0) are kept
+        """
+        mask = None
+        if tcp_only:
+            mask = self.proto == PROTO_TCP
+        if exclude_src:
+            hi, lo = pack_ip(exclude_src)
+            outbound = (self.src_hi == np.uint64(hi)) & (self.src_lo == np.uint64(lo))
+            mask = ~outbound if mask is None else mask & ~outbound
+        if since_ms is not None or until_ms is not None:
+            within = self.ts == 0
+            if since_ms is not None and until_ms is not None:
+                within |= (self.ts >= since_ms) & (self.ts < until_ms)
+            elif since_ms is not None:
+                within |= self.ts >= since_ms
+            else:
+                within |= self.ts < until_ms
+            mask = within if mask is None else mask & within
+        return self if mask is None else self.take(mask)
+
+
+class FlowBatchBuilder:
+    """
+    Appends records column by column into typed arrays, `build` wraps them
+    into a FlowBatch without copying.
+    """
+
+    TYPECODES = {
+        "src_hi": "Q", "src_lo": "Q", "dst_hi": "Q", "dst_lo": "Q",
+        "src_port": "H", "dst_port": "i", "proto": "B",
+        "packets": "Q", "bytes": "Q", "ts": "q",
+    }
+
+    def __init__(self):
+        self._columns = {name: array(code) for name, code in self.TYPECODES.items()}
+        c = self._columns
+        self._appenders = (
+            c["src_hi"].append, c["src_lo"].append, c["dst_hi"].append, c["dst_lo"].append,
+            c["src_port"].append, c["dst_port"].append, c["proto"].append,
+            c["packets"].append, c["bytes"].append, c["ts"].append,
+        )
+
+    def __len__(self):
+        return len(self._columns["src_lo"])
+
+    def append(self, src_hi, src_lo, dst_hi, dst_lo, src_port, dst_port, proto, packets, bytes_, ts):
+        a = self._appenders
+        a[0](src_hi); a[1](src_lo); a[2](dst_hi); a[3](dst_lo)
+        a[4](src_port); a[5](dst_port); a[6](proto)
+        a[7](packets); a[8](bytes_); a[9](ts)
+
+    def build(self) -> FlowBatch:
+        return FlowBatch(**{
+            name: np.frombuffer(column, dtype=FlowBatch.COLUMNS[name]) if len(column) else ()
+            for name, column in self._columns.items()
+        })
+
+
+class FlowAggregate:
+    """
+    Per-source partial aggregate of flow records.
+
+    sources: ip_src -> [packets, dst ports]
+
+    Partials built from different files (or time slices) can be merged with
+    `update`, which keeps the first-seen order of the sources. The dst ports
+    are kept as an insertion-ordered dict (used as a set) in first-seen order,
+    so `to_summary` gives the same `list(set(ports))` as aggregating the raw
+    records in one pass.
+    """
+
+    def __init__(self):
+        self.sources = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    @classmethod
+    def from_batch(cls, batch: FlowBatch) -> "FlowAggregate":
+        """
+        group-by ip_src over a batch: packets are summed per source and dst
+        ports deduplicated per source, sources keep their first-seen order
+        """
+        aggregate = cls()
+        n = len(batch)
+        if n == 0:
+            return aggregate
+
+        order = np.lexsort((batch.src_lo, batch.src_hi))
+        hi = batch.src_hi[order]
+        lo = batch.src_lo[order]
+        boundary = np.empty(n, dtype=bool)
+        boundary[0] = True
+        np.not_equal(hi[1:], hi[:-1], out=boundary[1:])
+        boundary[1:] |= lo[1:] != lo[:-1]
+        starts = np.flatnonzero(boundary)
+        group = np.cumsum(boundary) - 1
+
+        packets = np.add.reduceat(batch.packets[order], starts)
+        first_seen = np.minimum.reduceat(order, starts)
+
+        # distinct (group, dst port) pairs in first-seen order within each group,
+        # the lexsort above is stable so positions in a group follow the records;
+        # ports are shifted by one so that NO_PORT fits in the 17 low bits
+        pairs, pair_first = np.unique(
+            (group.astype(np.int64) << 17) | (batch.dst_port[order].astype(np.int64) - NO_PORT),
+            return_index=True,
+        )
+        pairs = pairs[np.argsort(pair_first, kind="stable")]
+        pairs = pairs[np.argsort(pairs >> 17, kind="stable")]
+        pair_group = pairs >> 17
+        pair_port = (pairs & 0x1FFFF) + NO_PORT
+        if (pair_port == NO_PORT).any():
+            pair_port = [None if port == NO_PORT else port for port in pair_port.tolist()]
+        else:
+            pair_port = pair_port.tolist()
+        port_bounds = np.searchsorted(pair_group, np.arange(len(starts) + 1)).tolist()
+
+        hi_first = hi[starts].tolist()
+        lo_first = lo[starts].tolist()
+        packets = packets.tolist()
+        sources = aggregate.sources
+        for g in np.argsort(first_seen, kind="stable").tolist():
+            ports = dict.fromkeys(pair_port[port_bounds[g]:port_bounds[g + 1]])
+            sources[unpack_ip(hi_first[g], lo_first[g])] = [packets[g], ports]
+        return aggregate
+
+    @classmethod
+    def from_batches(cls, batches, *, tcp_only=False, exclude_src=None, since_ms=None, until_ms=None) -> "FlowAggregate":
+        """
+        filter and aggregate a stream of batches into one partial
+        """
+        aggregate = cls()
+        for batch in batches:
+            aggregate.update(cls.from_batch(batch.select(
+                tcp_only=tcp_only, exclude_src=exclude_src, since_ms=since_ms, until_ms=until_ms,
+            )))
+        return aggregate
+
+    def add(self, ip_src, packets, port_dst):
+        entry = self.sources.get(ip_src)
+        if entry is None:
+            entry = self.sources[ip_src] = [0, {}]
+        entry[0] += packets
+        entry[1][port_dst] = None
+
+    def update(self, other: "FlowAggregate"):
+        for ip_src, (packets, ports) in other.sources.items():
+            entry = self.sources.get(ip_src)
+            if entry is None:
+                self.sources[ip_src] = [packets, dict(ports)]
+            else:
+                entry[0] += packets
+                entry[1].update(ports)
+
+    def to_summary(self) -> list[dict]:
+        return [
+            {
+                "ip_src": ip_src,
+                "total_packets": packets,
+                # set() over the keys view (not the dict, which set() presizes)
+                # inserts in the same order as the original per-record list
+                "dst_ports": list(set(ports.keys())),
+            }
+            for ip_src, (packets, ports) in self.sources.items()
+        ]
@@ -1,36 +1,86 @@
 import subprocess
 import json
+import time
+
+from driver.jsonstream import loads
+from driver.journaltail import entry_time_us
+from api import metrics
 
 class DriverJournalctl:
     def __init__(self, *, listen_services):
         self.listen_services = listen_services # can be sshd, mysql, postgresql
 
-    def get_logs(self, hours=1):
+    def get_logs(self, hours=1, fields=None):
+        return list(self.iter_logs(hours, fields))
+
+    """
+    same as get_logs, but yields the decoded entries while journalctl runs
+    fields: only these fields are output by journalctl (--output-fields),
+    besides the ones it always adds (__CURSOR, __REALTIME_TIMESTAMP, ...)
+    """
+    def iter_logs(self, hours=1, fields=None):
         if hours == 1:
             time_setting = f"{hours} hour ago"
         else:
             time_setting = f"{hours} hours ago"
-        cmd = ["sudo", "journalctl", "--since", time_setting, "-o", "json"]
+        yield from self._iter_journal(["--since", time_setting], fields)
+
+    """
+    same as iter_logs, for the entries with a time within [since_us, until_us)
+    journalctl selects whole seconds of its own receive time, the entries are
+    then filtered on their source time (see driver.journaltail.entry_time_us)
+    """
+    def iter_logs_between(self, since_us, until_us, fields=None):
+        args = ["--since", f"@{since_us // 1_000_000}", "--until", f"@{-(-until_us // 1_000_000)}"]
+        for entry in self._iter_journal(args, fields):
+            if since_us <= entry_time_us(entry) < until_us:
+                yield entry
+
+    """
+    yield the entries after `cursor` (or the last ones journalctl shows when
+    None) and keep following the journal as new entries arrive
+    each entry carries its position in the `__CURSOR` field
+    """
+    def follow(self, cursor=None, fields=None):
+        args = ["-f"]
+        if cursor:
+            args += ["--after-cursor", cursor]
+        else:
+            args += ["-n", "0"]
+        yield from self._iter_journal(args, fields)
+
+    def _iter_journal(self, args, fields=None):
+        cmd = ["sudo", "journalctl", *args, "-o", "json"]
+        if fields:
+            cmd.append("--output-fields=" + ",".join(sorted(fields)))
 
         for s in self.listen_services:
             if s.endswith('.service'):
                 cmd.extend(['-u', s])
             else:
                 cmd.append(f"_COMM={s}")
-        result = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
-
-        all_logs = []
-        for line in result.stdout:
-            line = line.strip()
-            if line:
-                try:
-                    log_entry = json.loads(line)
-                    all_logs.append(log_entry)
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON: {e} in line: {line}")
-        
-        return all_logs
-
+        start = time.perf_counter()
+        read = records = 0
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as result:
+            try:
+                for line in result.stdout:
+                    read += len(line)
+                    line = line.strip()
+                    if line:
+                        try:
+                            entry = loads(line)
+                        except json.JSONDecodeError as e:
+                            print(f"Error decoding JSON: {e} in line: {line}")
+                            continue
+                        records += 1
+                        yield entry
+            finally:
+                if result.poll() is None:
+                    result.kill()
+                # a follower runs for as long as the tail, only one-shot reads are timed
+                if "-f" not in args:
+                    metrics.SUBPROCESS_SECONDS.observe(time.perf_counter() - start, command="journalctl")
+                metrics.observe_read("journalctl", bytes_=read, records=records)
 
 if __name__ == "__main__":
     listen_services = ["sshd"]
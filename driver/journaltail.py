@@ -0,0 +1,194 @@
+"""
+Background follower of the journal with a time-indexed ring buffer.
+
+Instead of running `journalctl --since` and decoding the whole window on
+every request, a JournalTail backfills the window once, then follows the
+journal (`-f --after-cursor`) and keeps the decoded entries in memory,
+sorted by _SOURCE_REALTIME_TIMESTAMP. A request for the last N hours is a
+binary search on that timestamp.
+
+The cursor of the last entry read is saved to `cursor_file`. When the
+follower dies it is restarted after that cursor, so nothing is read twice
+or lost; when monilyzer restarts with `backfill = false`, following resumes
+from the saved cursor instead of backfilling the window.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+# entries without a source timestamp are indexed by the journal's own one
+TIME_FIELDS = ("_SOURCE_REALTIME_TIMESTAMP", "__REALTIME_TIMESTAMP")
+
+# the follower is restarted after this many seconds when journalctl exits
+RESTART_DELAY = 5
+# the cursor file is rewritten at most this often
+CURSOR_SAVE_INTERVAL = 5
+
+
+def entry_time_us(entry) -> int:
+    for field in TIME_FIELDS:
+        value = entry.get(field)
+        if value:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+    return 0
+
+
+class JournalTail(threading.Thread):
+    """
+    driver: DriverJournalctl of the followed services
+    window_hours: entries older than this are dropped
+    max_entries: upper bound on the entries kept, the oldest are dropped first
+    cursor_file: where the last cursor is saved, None disables it
+    backfill: read the last `window_hours` with journalctl --since on start
+    fields: only these fields are read and kept, None keeps whole entries
+    """
+
+    def __init__(self, driver, *, window_hours=48, max_entries=200000, cursor_file=None, backfill=True, fields=None):
+        super().__init__(daemon=True)
+        self.driver = driver
+        self.window_hours = window_hours
+        self.max_entries = max_entries
+        self.cursor_file = cursor_file
+        self.backfill = backfill
+        self.fields = frozenset(fields) if fields else None
+        self.cursor = None
+        self._times = []     # sorted entry times (us), from self._head on
+        self._entries = []   # entries, in the order of _times
+        self._head = 0       # index of the oldest live entry, compacted lazily
+        self._covered_since_us = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._cursor_saved_at = 0.0
+
+    def covers(self, hours, fields=()) -> bool:
+        """
+        whether the buffer holds every entry of the last `hours`, with `fields`
+        """
+        if not self._ready.is_set():
+            return False
+        if self.fields is not None and not self.fields.issuperset(fields):
+            return False
+        with self._lock:
+            since_us = int((time.time() - hours * 3600) * 1_000_000)
+            return self._covered_since_us is not None and since_us >= self._covered_since_us
+
+    def entries_since(self, hours) -> list[dict]:
+        since_us = int((time.time() - hours * 3600) * 1_000_000)
+        with self._lock:
+            lo = bisect_left(self._times, since_us, self._head)
+            return self._entries[lo:]
+
+    def entries_between(self, since_us, until_us=None) -> list[dict]:
+        """
+        entries with a time within [since_us, until_us), in time order
+        """
+        with self._lock:
+            lo = bisect_left(self._times, since_us, self._head)
+            hi = len(self._times) if until_us is None else bisect_left(self._times, until_us, lo)
+            return self._entries[lo:hi]
+
+    def run(self):
+        if self.cursor_file and not self.backfill:
+            self.cursor = self._load_cursor()
+        if self.backfill or self.cursor is None:
+            self._run_backfill()
+        self._ready.set()
+
+        last_error = None
+        while not self._stopped.is_set():
+            try:
+                for entry in self.driver.follow(self.cursor, self.fields):
+                    self._add(entry)
+                    if self._stopped.is_set():
+                        return
+                error = "journalctl exited"
+            except Exception as e:
+                error = str(e)
+            # report each distinct failure once, e.g. no sudo rights
+            if error != last_error:
+                print(f"Journal follower stopped: {error}, restarting")
+            last_error = error
+            self._save_cursor(force=True)
+            if self._stopped.wait(RESTART_DELAY):
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run_backfill(self):
+        started_us = int((time.time() - self.window_hours * 3600) * 1_000_000)
+        try:
+            for entry in self.driver.iter_logs(self.window_hours, self.fields):
+                self._add(entry)
+        except Exception as e:
+            print(f"Journal backfill failed: {e}")
+            # without a backfill only what is followed from now on is covered
+            started_us = int(time.time() * 1_000_000)
+        with self._lock:
+            self._covered_since_us = started_us
+        self._save_cursor(force=True)
+
+    def _add(self, entry):
+        t = entry_time_us(entry)
+        cursor = entry.get("__CURSOR")
+        with self._lock:
+            if self._covered_since_us is None and not self.backfill:
+                # resumed from a cursor: covered from the first entry on
+                self._covered_since_us = t
+            if not self._times or t >= self._times[-1]:
+                self._times.append(t)
+                self._entries.append(entry)
+            else:
+                # source timestamps are not strictly ordered, insert in place
+                i = bisect_left(self._times, t, self._head)
+                self._times.insert(i, t)
+                self._entries.insert(i, entry)
+            self._evict(t)
+        if cursor:
+            self.cursor = cursor
+            self._save_cursor()
+
+    def _evict(self, now_us):
+        oldest_us = max(now_us, int(time.time() * 1_000_000)) - int(self.window_hours * 3600 * 1_000_000)
+        head = max(bisect_left(self._times, oldest_us, self._head), len(self._times) - self.max_entries)
+        if head > self._head:
+            self._head = head
+            if self._covered_since_us is not None and self._times[head - 1] >= self._covered_since_us:
+                # entries the window still needs were dropped for max_entries
+                self._covered_since_us = self._times[head - 1] + 1
+        # drop the dead prefix once it is as large as the live part
+        if self._head and self._head * 2 >= len(self._times):
+            del self._times[:self._head]
+            del self._entries[:self._head]
+            self._head = 0
+
+    def _load_cursor(self):
+        try:
+            with open(self.cursor_file, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _save_cursor(self, force=False):
+        if not self.cursor_file or not self.cursor:
+            return
+        now = time.monotonic()
+        if not force and now - self._cursor_saved_at < CURSOR_SAVE_INTERVAL:
+            return
+        self._cursor_saved_at = now
+        directory = os.path.dirname(self.cursor_file) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.cursor)
+            os.replace(tmp, self.cursor_file)
+        except OSError as e:
+            print(f"Failed to save journal cursor: {e}")
@@ -0,0 +1,56 @@
+"""
+JSON decoding helpers shared by the drivers.
+
+- `loads` uses orjson when it is installed (optional, much faster on the
+  pmacct/journalctl line formats) and falls back to the stdlib json module.
+  orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers only
+  need to catch the latter.
+- `iter_json_array` decodes a top-level JSON array (e.g. `nfdump -o json`)
+  element by element from a text stream, without buffering the whole output.
+"""
+
+import json
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def loads(s):
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+_SEPARATORS = " \t\r\n,["
+
+
+def iter_json_array(stream, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    while True:
+        # skip whitespace, the opening bracket and separators between elements
+        while pos < len(buf) and buf[pos] in _SEPARATORS:
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos < len(buf):
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+                yield obj
+                continue
+            except json.JSONDecodeError:
+                # element is cut at the end of the buffer, need more input
+                if eof:
+                    return
+        elif eof:
+            return
+
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
@@ -0,0 +1,421 @@
+"""
+In-process reader for nfcapd files, the alternative to `nfdump -r <file> -o json`.
+
+Supported layouts:
+- LAYOUT_VERSION_1 (nfdump 1.6.x): file header + stat record, data blocks of
+  type 2 holding extension maps and common records (type 10)
+- LAYOUT_VERSION_2 (nfdump 1.7.x): file header, data blocks of type 3 holding
+  V3 records (type 11) made of elements (generic flow, ipv4/ipv6 flow)
+
+Blocks may be uncompressed or bz2-compressed. LZO/LZ4/ZSTD compressed and
+encrypted files raise NfcapdError so the caller can fall back to nfdump.
+
+Records are yielded with the same keys nfdump's json output uses, restricted
+to the fields the softflowd driver keeps (src6_addr/dst6_addr for IPv6), or
+filled in bulk into FlowBatch columns with `iter_batches`.
+"""
+
+import bz2
+import socket
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from driver.flow import FlowBatch, V4_MAPPED
+
+
+class NfcapdError(Exception):
+    pass
+
+
+MAGIC = 0xA50C
+LAYOUT_VERSION_1 = 1
+LAYOUT_VERSION_2 = 2
+
+# LAYOUT_VERSION_1
+FILE_HEADER_V1 = struct.Struct("<HHII128s")
+STAT_RECORD_V1_SIZE = 136
+FLAG_LZO_COMPRESSED = 0x01
+FLAG_BZ2_COMPRESSED = 0x08
+FLAG_LZ4_COMPRESSED = 0x10
+FLAG_ZSTD_COMPRESSED = 0x20
+
+# LAYOUT_VERSION_2
+FILE_HEADER_V2 = struct.Struct("<HHIqBBHIqII")
+NOT_COMPRESSED = 0
+BZ2_COMPRESSED = 2
+
+BLOCK_HEADER = struct.Struct("<IIHH")
+DATA_BLOCK_TYPE_2 = 2
+DATA_BLOCK_TYPE_3 = 3
+
+RECORD_HEADER = struct.Struct("<HH")
+ExtensionMapType = 2
+CommonRecordType = 10
+V3Record = 11
+
+# common record (type 10)
+COMMON_RECORD = struct.Struct("<HHHHHHIIBBBBHHHBB")
+# its fields read in bulk, (name, numpy format, offset)
+COMMON_FIELDS = (
+    ("msec_first", "<u2", 8), ("first", "<u4", 12), ("proto", "u1", 22), ("src_port", "<u2", 24), ("dst_port", "<u2", 26),
+)
+FLAG_IPV6_ADDR = 0x01
+FLAG_PKG_64 = 0x02
+FLAG_BYTES_64 = 0x04
+IPV4_ADDR = struct.Struct("<II")
+IPV6_ADDR = struct.Struct("<QQQQ")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+
+# V3 record (type 11)
+V3_RECORD_HEADER = struct.Struct("<HHBBBBHBB")
+ELEMENT_HEADER = struct.Struct("<HH")
+EXgenericFlowID = 1
+EXipv4FlowID = 2
+EXipv6FlowID = 3
+EX_GENERIC_FLOW = struct.Struct("<QQQQQHHBBBB")
+# fields of EX_GENERIC_FLOW read in bulk, offsets from the element data
+EX_GENERIC_FLOW_FIELDS = (
+    ("msec_first", "<u8", 0), ("packets", "<u8", 24), ("bytes", "<u8", 32),
+    ("src_port", "<u2", 40), ("dst_port", "<u2", 42), ("proto", "u1", 44),
+)
+EX_IPV4_FLOW = struct.Struct("<II")
+EX_IPV6_FLOW = struct.Struct("<QQQQ")
+GENERIC_FLOW_NAMES = {name for name, _, _ in EX_GENERIC_FLOW_FIELDS}
+ADDRESS_NAMES = {"src", "dst", "src_hi", "src_lo", "dst_hi", "dst_lo"}
+
+
+def _ipv4(addr: int) -> str:
+    return socket.inet_ntoa(struct.pack(">I", addr))
+
+
+def _ipv6(hi: int, lo: int) -> str:
+    return socket.inet_ntop(socket.AF_INET6, struct.pack(">QQ", hi, lo))
+
+
+def _timestamp(msec: int) -> str:
+    # same layout as nfdump's json t_first, local time
+    t = datetime.fromtimestamp(msec // 1000)
+    return f"{t:%Y-%m-%dT%H:%M:%S}.{msec % 1000:03d}"
+
+
+class NfcapdReader:
+    """
+    Iterating the reader yields one dict per flow record. The file header is
+    checked when the reader is created, so unsupported files are rejected
+    before any record is produced.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        # extension maps of LAYOUT_VERSION_1 files, map_id -> extension ids
+        self.extension_maps = {}
+        with open(fp, "rb") as f:
+            head = f.read(FILE_HEADER_V1.size)
+        if len(head) < 4:
+            raise NfcapdError(f"{fp}: file too short")
+        magic, version = struct.unpack_from("<HH", head)
+        if magic != MAGIC:
+            raise NfcapdError(f"{fp}: bad magic {magic:#x}")
+
+        self.version = version
+        if version == LAYOUT_VERSION_1:
+            if len(head) < FILE_HEADER_V1.size:
+                raise NfcapdError(f"{fp}: truncated file header")
+            _, _, flags, self.num_blocks, _ = FILE_HEADER_V1.unpack(head)
+            if flags & (FLAG_LZO_COMPRESSED | FLAG_LZ4_COMPRESSED | FLAG_ZSTD_COMPRESSED):
+                raise NfcapdError(f"{fp}: unsupported compression flags {flags:#x}")
+            self.bz2 = bool(flags & FLAG_BZ2_COMPRESSED)
+            self.data_offset = FILE_HEADER_V1.size + STAT_RECORD_V1_SIZE
+        elif version == LAYOUT_VERSION_2:
+            if len(head) < FILE_HEADER_V2.size:
+                raise NfcapdError(f"{fp}: truncated file header")
+            (_, _, _, _, compression, encryption, _, _, _, _,
+             self.num_blocks) = FILE_HEADER_V2.unpack_from(head)
+            if encryption:
+                raise NfcapdError(f"{fp}: encrypted files are not supported")
+            if compression not in (NOT_COMPRESSED, BZ2_COMPRESSED):
+                raise NfcapdError(f"{fp}: unsupported compression {compression}")
+            self.bz2 = compression == BZ2_COMPRESSED
+            self.data_offset = FILE_HEADER_V2.size
+        else:
+            raise NfcapdError(f"{fp}: unsupported layout version {version}")
+
+    def __iter__(self):
+        for row in self.iter_rows():
+            yield _row_to_record(row)
+
+    """
+    yield FlowBatch objects of at most `size` records, filled straight from
+    the decoded columns without building per-record tuples or dicts
+    proto: only keep rows of this protocol number
+    exclude_src: (hi, lo) packed source address (see driver.flow.pack_ip) whose rows are skipped
+    """
+    def iter_batches(self, size=65536, *, ipv4_only=False, proto=None, exclude_src=None):
+        pending = []
+        count = 0
+        for columns in self.iter_columns():
+            mask = None
+            if ipv4_only:
+                mask = ~columns[0]
+            if proto is not None:
+                selected = columns[7] == proto
+                mask = selected if mask is None else mask & selected
+            if exclude_src is not None:
+                excluded = (columns[1] == np.uint64(exclude_src[0])) & (columns[2] == np.uint64(exclude_src[1]))
+                mask = ~excluded if mask is None else mask & ~excluded
+            if mask is not None:
+                columns = tuple(column[mask] for column in columns)
+            if not len(columns[0]):
+                continue
+            pending.append(columns)
+            count += len(columns[0])
+            if count >= size:
+                columns = _concat(pending)
+                full = count - count % size
+                for start in range(0, full, size):
+                    yield _to_batch(columns, slice(start, start + size))
+                pending = [tuple(column[full:] for column in columns)] if full < count else []
+                count -= full
+        if count:
+            yield _to_batch(_concat(pending), slice(None))
+
+    """
+    yield one tuple per flow record:
+    (is_ipv6, src_hi, src_lo, dst_hi, dst_lo, src_port, dst_port, proto,
+     packets, bytes, msec_first), addresses packed as in driver.flow.pack_ip
+    """
+    def iter_rows(self):
+        for columns in self.iter_columns():
+            yield from zip(*(column.tolist() for column in columns))
+
+    """
+    yield the flow records as tuples of NumPy columns, in the order of the
+    iter_rows tuples, one tuple per run of records sharing the same layout
+    """
+    def iter_columns(self):
+        with open(self.fp, "rb") as f:
+            f.seek(self.data_offset)
+            # nfcapd rewrites NumBlocks when it closes the file, so read
+            # blocks until EOF instead of trusting the header
+            while True:
+                head = f.read(BLOCK_HEADER.size)
+                if len(head) < BLOCK_HEADER.size:
+                    return
+                num_records, size, block_type, _ = BLOCK_HEADER.unpack(head)
+                block = f.read(size)
+                if len(block) < size:
+                    return
+                if block_type not in (DATA_BLOCK_TYPE_2, DATA_BLOCK_TYPE_3):
+                    continue
+                if self.bz2:
+                    try:
+                        block = bz2.decompress(block)
+                    except (OSError, ValueError) as e:
+                        raise NfcapdError(f"{self.fp}: corrupt bz2 block") from e
+                yield from self._iter_block(block, num_records)
+
+    """
+    records are decoded in runs: consecutive records of the same type, size
+    and layout (common record flags, V3 element headers) are read at once
+    with np.frombuffer and a structured dtype, nfcapd writes long runs of them
+    """
+    def _iter_block(self, block, num_records):
+        offset = 0
+        end = len(block)
+        left = num_records
+        while left > 0:
+            if offset + RECORD_HEADER.size > end:
+                return
+            record_type, size = RECORD_HEADER.unpack_from(block, offset)
+            if size < RECORD_HEADER.size or offset + size > end:
+                return
+            if record_type == ExtensionMapType:
+                self._extension_map(block, offset, size)
+                run = 1
+            else:
+                count = min(left, (end - offset) // size)
+                if record_type == CommonRecordType:
+                    (flags,) = struct.unpack_from("<H", block, offset + 4)
+                    run = _run_length(block, offset, count, size, (("flags", "<u2", 4),))
+                    yield self._common_columns(block, offset, run, size, flags)
+                elif record_type == V3Record:
+                    elements = self._v3_elements(block, offset, size)
+                    key = [("num_elements", "u1", 4)] + [
+                        (f"element_{i}", "<u4", pos) for i, (pos, _, _) in enumerate(elements)
+                    ]
+                    run = _run_length(block, offset, count, size, key)
+                    columns = self._v3_columns(block, offset, run, size, elements)
+                    if columns is not None:
+                        yield columns
+                else:
+                    run = _run_length(block, offset, count, size, ())
+            offset += run * size
+            left -= run
+
+    def _extension_map(self, block, offset, size):
+        map_id, _ = struct.unpack_from("<HH", block, offset + 4)
+        ids = []
+        for pos in range(offset + 8, offset + size - 1, 2):
+            (ex_id,) = struct.unpack_from("<H", block, pos)
+            if ex_id == 0:
+                break
+            ids.append(ex_id)
+        self.extension_maps[map_id] = ids
+
+    def _common_columns(self, block, offset, count, size, flags):
+        # mandatory extensions 1 (addresses) and 2 (counters) come first,
+        # the optional ones described by the extension map are not needed
+        v6 = bool(flags & FLAG_IPV6_ADDR)
+        fields = list(COMMON_FIELDS)
+        pos = COMMON_RECORD.size
+        if v6:
+            fields += [("src_hi", "<u8", pos), ("src_lo", "<u8", pos + 8), ("dst_hi", "<u8", pos + 16), ("dst_lo", "<u8", pos + 24)]
+            pos += IPV6_ADDR.size
+        else:
+            fields += [("src", "<u4", pos), ("dst", "<u4", pos + 4)]
+            pos += IPV4_ADDR.size
+        counter = U64 if flags & FLAG_PKG_64 else U32
+        fields.append(("packets", counter.format, pos))
+        pos += counter.size
+        counter = U64 if flags & FLAG_BYTES_64 else U32
+        fields.append(("bytes", counter.format, pos))
+        pos += counter.size
+        if pos > size:
+            raise NfcapdError(f"{self.fp}: common record of {size} bytes, {pos} expected")
+
+        records = np.frombuffer(block, _dtype(fields, size), count, offset)
+        ts = records["first"].astype(np.int64) * 1000 + records["msec_first"]
+        return _columns(records, v6, ts)
+
+    """
+    (header position, element type, data position) of the elements of the
+    V3 record at `offset`
+    """
+    def _v3_elements(self, block, offset, size):
+        (_, _, num_elements, _, _, _, _, _, _) = V3_RECORD_HEADER.unpack_from(block, offset)
+        pos = offset + V3_RECORD_HEADER.size
+        end = offset + size
+        elements = []
+        for _ in range(num_elements):
+            if pos + ELEMENT_HEADER.size > end:
+                break
+            element_type, length = ELEMENT_HEADER.unpack_from(block, pos)
+            if length < ELEMENT_HEADER.size:
+                break
+            elements.append((pos - offset, element_type, pos - offset + ELEMENT_HEADER.size))
+            pos += length
+        return elements
+
+    def _v3_columns(self, block, offset, count, size, elements):
+        fields = []
+        v6 = None
+        for _, element_type, data in elements:
+            if element_type == EXgenericFlowID:
+                fields = [field for field in fields if field[0] not in GENERIC_FLOW_NAMES]
+                fields += [(name, format_, data + at) for name, format_, at in EX_GENERIC_FLOW_FIELDS]
+            elif element_type in (EXipv4FlowID, EXipv6FlowID):
+                fields = [field for field in fields if field[0] not in ADDRESS_NAMES]
+                v6 = element_type == EXipv6FlowID
+                if v6:
+                    fields += [("src_hi", "<u8", data), ("src_lo", "<u8", data + 8), ("dst_hi", "<u8", data + 16), ("dst_lo", "<u8", data + 24)]
+                else:
+                    fields += [("src", "<u4", data), ("dst", "<u4", data + 4)]
+        # skip records without flow data (e.g. exporter info, stats)
+        if v6 is None or not any(field[0] == "msec_first" for field in fields):
+            return None
+        if max(at + np.dtype(format_).itemsize for _, format_, at in fields) > size:
+            raise NfcapdError(f"{self.fp}: V3 record elements exceed its {size} bytes")
+
+        records = np.frombuffer(block, _dtype(fields, size), count, offset)
+        return _columns(records, v6, records["msec_first"].astype(np.int64))
+
+
+def _dtype(fields, size) -> np.dtype:
+    """
+    structured dtype of a record of `size` bytes, fields: (name, format, offset)
+    """
+    return np.dtype({
+        "names": [name for name, _, _ in fields],
+        "formats": [format_ for _, format_, _ in fields],
+        "offsets": [at for _, _, at in fields],
+        "itemsize": size,
+    })
+
+
+def _run_length(block, offset, count, size, key) -> int:
+    """
+    number of records from `offset` (at most `count`, each `size` bytes long
+    if they form a run) that have the type and size of the first one and the
+    same `key` fields, (name, format, offset) triples
+    """
+    if count <= 1:
+        return count
+    records = np.frombuffer(block, _dtype([("type", "<u2", 0), ("size", "<u2", 2), *key], size), count, offset)
+    same = np.ones(count, dtype=bool)
+    for name in records.dtype.names:
+        column = records[name]
+        same &= column == column[0]
+    return count if same.all() else int(np.argmin(same))
+
+
+def _columns(records, v6, ts):
+    """
+    the iter_columns tuple of a run of records decoded with _dtype
+    """
+    count = len(records)
+    if v6:
+        addresses = [records[name].astype(np.uint64) for name in ("src_hi", "src_lo", "dst_hi", "dst_lo")]
+    else:
+        zeros = np.zeros(count, dtype=np.uint64)
+        addresses = [
+            zeros, records["src"].astype(np.uint64) | np.uint64(V4_MAPPED),
+            zeros, records["dst"].astype(np.uint64) | np.uint64(V4_MAPPED),
+        ]
+    return (
+        np.full(count, v6), *addresses,
+        records["src_port"].astype(np.uint16), records["dst_port"].astype(np.int32), records["proto"].astype(np.uint8),
+        records["packets"].astype(np.uint64), records["bytes"].astype(np.uint64), ts,
+    )
+
+
+def _concat(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+    return tuple(np.concatenate(columns) for columns in zip(*chunks))
+
+
+def _to_batch(columns, selector) -> FlowBatch:
+    (_, src_hi, src_lo, dst_hi, dst_lo, src_port, dst_port, proto, packets, bytes_, ts) = columns
+    return FlowBatch(
+        src_hi=src_hi[selector], src_lo=src_lo[selector], dst_hi=dst_hi[selector], dst_lo=dst_lo[selector],
+        src_port=src_port[selector], dst_port=dst_port[selector], proto=proto[selector],
+        packets=packets[selector], bytes=bytes_[selector], ts=ts[selector],
+    )
+
+
+def _row_to_record(row):
+    v6, s_hi, s_lo, d_hi, d_lo, src_port, dst_port, proto, packets, bytes_, msec_first = row
+    if v6:
+        record = {"src6_addr": _ipv6(s_hi, s_lo), "dst6_addr": _ipv6(d_hi, d_lo)}
+    else:
+        record = {"src4_addr": _ipv4(s_lo & 0xFFFFFFFF), "dst4_addr": _ipv4(d_lo & 0xFFFFFFFF)}
+    record["t_first"] = _timestamp(msec_first)
+    record["proto"] = proto
+    record["src_port"] = src_port
+    record["dst_port"] = dst_port
+    record["in_packets"] = packets
+    record["in_bytes"] = bytes_
+    return record
+
+if __name__ == "__main__":
+    import sys
+
+    cnt = 0
+    for record in NfcapdReader(sys.argv[1]):
+        cnt += 1
+        if cnt <= 5:
+            print(record)
+    print(f"Total records found: {cnt}")
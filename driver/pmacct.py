@@ -1,9 +1,53 @@
 import json
+import os
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 
+from driver.flow import NO_PORT, PROTO_TCP, PROTO_UNKNOWN, FlowAggregate, FlowBatch, FlowBatchBuilder, iter_chunks, pack_ip, parse_timestamp_ms, proto_number
+from driver.fileindex import FileIndex
+from driver.jsonstream import loads
+from api import metrics
+
+BATCH_SIZE = 65536
+# raw ip_proto values of TCP records, lowercased
+TCP_VALUES = (b'"tcp"',)
+
+
+def _proto(ip_proto) -> int:
+    """
+    protocol number of an ip_proto value, only "tcp" is TCP: tcp_only keeps
+    the records whose ip_proto is exactly "tcp", as pmacct writes it
+    """
+    number = proto_number(ip_proto)
+    if number == PROTO_TCP and ip_proto != "tcp":
+        return PROTO_UNKNOWN
+    return number
+
+
+def _raw_value(line, key):
+    """
+    raw bytes of the value of `key` in a flat json line, None if the key is
+    missing; only meant for scalar values without commas
+    """
+    i = line.find(key)
+    if i < 0:
+        return None
+    i = line.find(b':', i + len(key))
+    if i < 0:
+        return None
+    end = line.find(b',', i)
+    if end < 0:
+        end = line.find(b'}', i)
+        if end < 0:
+            return None
+    return line[i + 1:end].strip()
+
+
 class DriverPmacct:
     def __init__(self, *, data_dir: str):
         self._data_dir = data_dir
+        self._index = FileIndex(data_dir, self.parse_file_key)
 
     """
     read records from a pmacct json file
@@ -18,41 +62,151 @@ class DriverPmacct:
     - timestamp_start
     """
     def read_data_from_file(self, fp) -> list[dict]:
-        data = []
-        with open(fp, 'r') as f:
-            for line in f:
-                try:
-                    record = json.loads(line)
-                    # filters out some fields
-                    record.pop("event_type", None)
-                    record.pop("timestamp_end", None)
-                    data.append(record)
-                except json.JSONDecodeError:
-                    continue
-        return data
+        return list(self.iter_data_from_file(fp))
+
+    """
+    same as read_data_from_file, but yields the records one by one
+    line_filter: predicate on the raw lines (see line_prefilter), lines it
+    rejects are not decoded
+    """
+    def iter_data_from_file(self, fp, line_filter=None):
+        read = records = 0
+        try:
+            with open(fp, 'rb') as f:
+                for line in f:
+                    read += len(line)
+                    if line_filter is not None and not line_filter(line):
+                        continue
+                    record = self.decode_line(line)
+                    if record is not None:
+                        records += 1
+                        yield record
+        finally:
+            metrics.observe_read("pmacct", files=1, bytes_=read, records=records)
+
+    """
+    stream the complete lines appended to a pmacct json file since `offset`
+    """
+    def open_tail(self, fp, offset=0, line_filter=None) -> "PmacctTail":
+        return PmacctTail(self, fp, offset, line_filter)
+
+    """
+    filter and aggregate files without going through the ingestion cache,
+    used for closed hours whose rollup is kept instead of the per-file partials,
+    and for the edge files of time ranges, filtered on timestamp_start
+    """
+    def aggregate_files(self, files, *, tcp_only=False, exclude_src=None, since_ms=None, until_ms=None) -> FlowAggregate:
+        aggregation = FlowAggregate()
+        line_filter = self.line_prefilter(tcp_only=tcp_only, exclude_src=exclude_src)
+        for fp in files:
+            aggregation.update(FlowAggregate.from_batches(
+                self.iter_batches(self.iter_data_from_file(fp, line_filter)), tcp_only=tcp_only, exclude_src=exclude_src,
+                since_ms=since_ms, until_ms=until_ms,
+            ))
+        return aggregation
+
+    """
+    translate the flow filters into a predicate on raw json lines, which
+    rejects the lines whose record certainly fails them before any json
+    decoding; None when there is nothing to check
+    the predicate is conservative: lines it cannot judge (fields missing or
+    written differently) are kept, FlowBatch.select still applies the exact
+    filters to the decoded records
+    """
+    def line_prefilter(self, *, tcp_only=False, exclude_src=None):
+        if not tcp_only and not exclude_src:
+            return None
+        excluded = b'"' + exclude_src.encode() + b'"' if exclude_src else None
+
+        def keep(line):
+            if tcp_only:
+                proto = _raw_value(line, b'"ip_proto"')
+                if proto is not None and proto.lower() not in TCP_VALUES:
+                    return False
+            if excluded is not None and _raw_value(line, b'"ip_src"') == excluded:
+                return False
+            return True
+        return keep
+
+    def iter_batches(self, records):
+        for chunk in iter_chunks(records, BATCH_SIZE):
+            yield self.to_batch(chunk)
+
+    """
+    fill a FlowBatch from pmacct records, records without ip_src are dropped
+    aggregating the batches gives the summary of the records themselves, except
+    that sources are keyed by address: records whose ip_src is not an IP address
+    are dropped, and IPv6 sources are written in their canonical form (as
+    pmacct writes them)
+    """
+    def to_batch(self, records) -> FlowBatch:
+        builder = FlowBatchBuilder()
+        append = builder.append
+        for record in records:
+            ip_src = record.get("ip_src", None)
+            if not ip_src:
+                continue
+            try:
+                src_hi, src_lo = pack_ip(ip_src)
+            except OSError:
+                continue
+            ip_dst = record.get("ip_dst")
+            try:
+                dst_hi, dst_lo = pack_ip(ip_dst) if ip_dst else (0, 0)
+            except OSError:
+                dst_hi, dst_lo = 0, 0
+            port_dst = record.get("port_dst")
+            append(
+                src_hi, src_lo, dst_hi, dst_lo,
+                record.get("port_src") or 0, NO_PORT if port_dst is None else port_dst,
+                _proto(record.get("ip_proto")),
+                record.get("packets", 0), record.get("bytes", 0),
+                parse_timestamp_ms(record.get("timestamp_start")),
+            )
+        return builder.build()
+
+    def decode_line(self, line) -> dict | None:
+        try:
+            record = loads(line)
+        except json.JSONDecodeError:
+            return None
+        # filters out some fields
+        record.pop("event_type", None)
+        record.pop("timestamp_end", None)
+        return record
 
     def get_files(self, start_date, start_time, end_date, end_time):
+        # find all files in the range from the sorted file index
+        return self._index.range(start_date + start_time, end_date + end_time)
+
+    """
+    minute key 'YYYYMMDDHHMM' of a data file
+    """
+    def file_key(self, fp) -> str:
+        name = os.path.basename(fp)
+        return name[8:16] + name[17:21]
+
+    """
+    minute key of a file name, None if it is not a traffic_%Y%m%d_%H%M.json file
+    """
+    @staticmethod
+    def parse_file_key(name) -> str | None:
         prefix = "traffic_"
-        files = []
-        # find all files in the range
-        # first get all files in the data dir
-        import os
-        all_files = os.listdir(self._data_dir)
-        for file in all_files:
-            if file.startswith(prefix) and file.endswith(".json"):
-                # extract date and time
-                parts = file[len(prefix):-5].split('_')
-                if len(parts) != 2:
-                    continue
-                file_date, file_time = parts
-                if (file_date > start_date or (file_date == start_date and file_time >= start_time)) and \
-                   (file_date < end_date or (file_date == end_date and file_time <= end_time)):
-                    files.append(os.path.join(self._data_dir, file))
-        files.sort()
-        return files
-
-    def get_range_from_now(self, hours=1):
-        end = datetime.now(timezone.utc)
+        if not (name.startswith(prefix) and name.endswith(".json")):
+            return None
+        parts = name[len(prefix):-5].split('_')
+        if len(parts) != 2 or len(parts[0]) != 8 or len(parts[1]) != 4:
+            return None
+        return parts[0] + parts[1]
+
+    """
+    current time in the clock of the file names (rotatelogs uses UTC)
+    """
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def get_range_from_now(self, hours=1, now=None):
+        end = now or self.now()
         start = end - timedelta(hours=hours)
 
         start_date = start.strftime("%Y%m%d")
@@ -62,6 +216,133 @@ class DriverPmacct:
 
         return [start_date, start_time, end_date, end_time]
 
+    """
+    [start_date, start_time, end_date, end_time] of the minute files
+    overlapping [start, end), timezone-aware datetimes, in the clock of the
+    file names (UTC)
+    """
+    def get_range(self, start: datetime, end: datetime):
+        start = start.astimezone(timezone.utc)
+        last = (end - timedelta(microseconds=1)).astimezone(timezone.utc)
+        return [start.strftime("%Y%m%d"), start.strftime("%H%M"), last.strftime("%Y%m%d"), last.strftime("%H%M")]
+
+
+class PmacctTail:
+    """
+    Iterates the records of the complete lines of a pmacct json file starting
+    at a byte offset. `offset` advances past every complete line consumed, so
+    a half-written last line is left for the next read.
+    """
+
+    def __init__(self, driver: DriverPmacct, fp, offset=0, line_filter=None):
+        self.driver = driver
+        self.fp = fp
+        self.offset = offset
+        self.line_filter = line_filter
+
+    def __iter__(self):
+        line_filter = self.line_filter
+        start = self.offset
+        records = 0
+        try:
+            with open(self.fp, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self.offset += len(line)
+                    if line_filter is not None and not line_filter(line):
+                        continue
+                    record = self.driver.decode_line(line)
+                    if record is not None:
+                        records += 1
+                        yield record
+        finally:
+            metrics.observe_read("pmacct", files=1, bytes_=self.offset - start, records=records)
+
+
+class _CacheEntry:
+    __slots__ = ("ino", "mtime_ns", "size", "offset", "partial", "lock")
+
+    def __init__(self):
+        self.ino = None
+        self.mtime_ns = None
+        self.size = None
+        self.offset = 0
+        self.partial = FlowAggregate()
+        # held while the file is read and merged into `partial`
+        self.lock = threading.Lock()
+
+
+class PmacctIngestCache:
+    """
+    Ingestion cache on top of DriverPmacct.
+
+    Keeps a partial aggregate (per ip_src: packets, dst ports) for every file
+    it has read, keyed by path and filter settings and validated by
+    inode+mtime+size. Rotated files are immutable, so they are decoded once;
+    for the file rotatelogs is still writing, only the tail after the saved
+    byte offset is read. A query merges the cached partials of its files.
+
+    Safe to call from several threads: the tail of a file is read by one
+    caller at a time (the others wait for it and get its result), and a
+    partial that was returned is never modified, a grown file gets a new one.
+    """
+
+    def __init__(self, driver: DriverPmacct, *, max_entries=8192):
+        self.driver = driver
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()  # guards _entries, not the reads
+
+    def aggregate(self, files, *, tcp_only=False, exclude_src=None) -> FlowAggregate:
+        result = FlowAggregate()
+        for fp in files:
+            result.update(self.get_partial(fp, tcp_only=tcp_only, exclude_src=exclude_src))
+        return result
+
+    def get_partial(self, fp, *, tcp_only=False, exclude_src=None) -> FlowAggregate:
+        key = (fp, tcp_only, exclude_src)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _CacheEntry()
+                self._evict()
+            else:
+                self._entries.move_to_end(key)
+
+        with entry.lock:
+            try:
+                st = os.stat(fp)
+            except FileNotFoundError:
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                return FlowAggregate()
+
+            if entry.ino == st.st_ino and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+                return entry.partial
+            if entry.ino is not None and (entry.ino != st.st_ino or st.st_size < entry.offset):
+                # replaced or truncated, start over
+                entry.offset = 0
+                entry.partial = FlowAggregate()
+
+            tail = self.driver.open_tail(fp, entry.offset, self.driver.line_prefilter(tcp_only=tcp_only, exclude_src=exclude_src))
+            added = FlowAggregate.from_batches(self.driver.iter_batches(tail), tcp_only=tcp_only, exclude_src=exclude_src)
+            if added.sources:
+                # merged into a copy, callers may still be reading the previous partial
+                partial = FlowAggregate()
+                partial.update(entry.partial)
+                partial.update(added)
+                entry.partial = partial
+            entry.offset = tail.offset
+            entry.ino, entry.mtime_ns, entry.size = st.st_ino, st.st_mtime_ns, st.st_size
+            return entry.partial
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
 
 if __name__ == "__main__":
     driver = DriverPmacct(data_dir="./monitor/pmacct/data")
@@ -0,0 +1,232 @@
+"""
+Minute/hour rollups of flow aggregates.
+
+pmacct (rotatelogs, 60s) and softflowd (nfcapd -t 60) both write one data
+file per minute, so a minute rollup is the FlowAggregate of one file and an
+hour rollup is the merge of the minute files of an hour. Once an hour is
+closed its files no longer change, and its rollup is kept until the set of
+files in that hour changes (e.g. the cleanup cron job removes them).
+
+A query over a window of files is planned as the fewest hour rollups for the
+hours it fully covers plus minute rollups for the partial hours at the edges.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from driver.flow import FlowAggregate
+
+# the file of the last minute of an hour may still be written shortly after
+# the hour ends, an hour is only treated as closed after this delay
+CLOSE_DELAY = timedelta(minutes=2)
+
+
+def plan_rollups(keyed_files, start_key, end_key, closed_before):
+    """
+    keyed_files: sorted (minute key 'YYYYMMDDHHMM', path) pairs of the window
+    start_key, end_key: minute keys bounding the window (inclusive)
+    closed_before: hour key 'YYYYMMDDHH', hours before it are closed
+
+    returns the plan as an ordered list of steps, either
+    ("hour", hour_key, [paths]) or ("minute", None, [paths])
+    """
+    by_hour = OrderedDict()
+    for key, fp in keyed_files:
+        by_hour.setdefault(key[:10], []).append(fp)
+
+    plan = []
+    for hour, files in by_hour.items():
+        covered = start_key <= hour + "00" and end_key >= hour + "59"
+        if covered and hour < closed_before:
+            plan.append(("hour", hour, files))
+        elif plan and plan[-1][0] == "minute":
+            plan[-1][2].extend(files)
+        else:
+            plan.append(("minute", None, list(files)))
+    return plan
+
+
+class _Flight:
+    """
+    a rollup being loaded by one query, which the others wait for
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class FlowRollup:
+    """
+    file_key: path -> minute key 'YYYYMMDDHHMM'
+    load_minutes: (paths, **filters) -> list of FlowAggregate, one per path
+    load_hour: (paths, **filters) -> FlowAggregate of all the paths
+    cache_minutes: keep minute rollups here, validated by mtime+size; off when
+        load_minutes is already backed by a cache (PmacctIngestCache)
+
+    The lock only guards the cached rollups: files are decoded outside of it,
+    and a rollup being loaded by one query is waited for by the others
+    instead of being loaded again.
+    """
+
+    def __init__(self, file_key, load_minutes, load_hour, *, cache_minutes=True, max_hours=96, max_minutes=8192):
+        self.file_key = file_key
+        self.load_minutes = load_minutes
+        self.load_hour = load_hour
+        self.cache_minutes = cache_minutes
+        self.max_hours = max_hours
+        self.max_minutes = max_minutes
+        self._hours = OrderedDict()    # (hour key, filters) -> (paths, FlowAggregate)
+        self._minutes = OrderedDict()  # (path, filters) -> (mtime_ns, size, FlowAggregate)
+        self._flights = {}             # hour or minute rollup being loaded -> _Flight
+        self._lock = threading.Lock()
+
+    def aggregate(self, files, start_key, end_key, now: datetime, **filters) -> FlowAggregate:
+        closed_before = (now - CLOSE_DELAY).strftime("%Y%m%d%H")
+        plan = plan_rollups([(self.file_key(fp), fp) for fp in files], start_key, end_key, closed_before)
+
+        result = FlowAggregate()
+        for kind, hour, paths in plan:
+            if kind == "hour":
+                result.update(self._hour(hour, paths, filters))
+            else:
+                for partial in self._minutes_of(paths, filters):
+                    result.update(partial)
+        return result
+
+    def partials(self, paths, **filters) -> list[FlowAggregate]:
+        """
+        the minute rollups of `paths`, one per existing file
+        """
+        return self._minutes_of(paths, filters)
+
+    def _hour(self, hour, paths, filters):
+        key = (hour, tuple(sorted(filters.items())))
+        flight_key = ("hour", key, tuple(paths))
+        with self._lock:
+            cached = self._hours.get(key)
+            if cached is not None and cached[0] == paths:
+                self._hours.move_to_end(key)
+                return cached[1]
+            flight = self._flights.get(flight_key)
+            if flight is not None:
+                leader = False
+            else:
+                leader = True
+                flight = self._flights[flight_key] = _Flight()
+
+        if not leader:
+            return flight.wait()
+        try:
+            flight.value = self.load_hour(paths, **filters)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+                if flight.error is None:
+                    self._hours[key] = (list(paths), flight.value)
+                    self._hours.move_to_end(key)
+                    while len(self._hours) > self.max_hours:
+                        self._hours.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def _minutes_of(self, paths, filters):
+        if not self.cache_minutes:
+            return self.load_minutes(paths, **filters)
+
+        filter_key = tuple(sorted(filters.items()))
+        stats = {}
+        for fp in paths:
+            try:
+                stats[fp] = os.stat(fp)
+            except FileNotFoundError:
+                continue
+
+        partials = {}
+        leading = []  # (path, flight key, flight) loaded by this query
+        waiting = []  # (path, flight) loaded by another query
+        with self._lock:
+            for fp, st in stats.items():
+                cached = self._minutes.get((fp, filter_key))
+                if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                    self._minutes.move_to_end((fp, filter_key))
+                    partials[fp] = cached[2]
+                    continue
+                flight_key = ("minute", fp, filter_key, st.st_mtime_ns, st.st_size)
+                flight = self._flights.get(flight_key)
+                if flight is not None:
+                    waiting.append((fp, flight))
+                else:
+                    flight = self._flights[flight_key] = _Flight()
+                    leading.append((fp, flight_key, flight))
+
+        if leading:
+            loaded = []
+            error = None
+            try:
+                loaded = self.load_minutes([fp for fp, _, _ in leading], **filters)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                with self._lock:
+                    for i, (fp, flight_key, flight) in enumerate(leading):
+                        del self._flights[flight_key]
+                        flight.error = error
+                        if error is None and i < len(loaded):
+                            st = stats[fp]
+                            flight.value = partials[fp] = loaded[i]
+                            self._minutes[(fp, filter_key)] = (st.st_mtime_ns, st.st_size, loaded[i])
+                    while len(self._minutes) > self.max_minutes:
+                        self._minutes.popitem(last=False)
+                for _, _, flight in leading:
+                    flight.done.set()
+
+        for fp, flight in waiting:
+            partial = flight.wait()
+            if partial is not None:
+                partials[fp] = partial
+
+        return [partials[fp] for fp in paths if fp in partials]
+
+
+class RollupRefresher(threading.Thread):
+    """
+    Calls `refresh` every `interval` seconds, so that minute and hour rollups
+    are materialized as data lands instead of by the first query needing them.
+    """
+
+    def __init__(self, refresh, interval):
+        super().__init__(daemon=True)
+        self.refresh = refresh
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        last_error = None
+        while True:
+            try:
+                self.refresh()
+                last_error = None
+            except Exception as e:
+                # e.g. the monitor's collector is not running, report it once
+                if str(e) != last_error:
+                    print(f"Rollup refresh failed: {e}")
+                last_error = str(e)
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
@@ -1,55 +1,269 @@
+import itertools
+import os
 import subprocess
-import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import re
+import struct
+
+from driver.fileindex import FileIndex
+from driver.jsonstream import iter_json_array
+from driver.nfcapd import NfcapdReader, NfcapdError
+from driver.flow import NO_PORT, PROTO_TCP, FlowBatch, FlowBatchBuilder, iter_chunks, pack_ip, parse_timestamp_ms, proto_number
+from api import metrics
+
+KEEP_FIELDS = ("t_first", "src4_addr", "dst4_addr", "proto", "src_port", "dst_port", "in_packets", "in_bytes")
+BATCH_SIZE = 65536
+FILE_NAME = re.compile(r"nfcapd\.(\d{12})")
+
+DECODE_MODES = ("file", "range", "parallel")
+BACKENDS = ("nfdump", "native")
+
+
+class NfdumpError(Exception):
+    pass
+
+
+def _dst_port(port) -> int:
+    return NO_PORT if port is None else port
+
 
 class DriverSoftflowd:
-    def __init__(self, *, data_dir: str):
+    """
+    backend: how nfcapd files are decoded
+    - nfdump: run the nfdump binary and decode its json output
+    - native: read the files in-process (driver.nfcapd), files the reader
+      does not support (e.g. LZO compressed) still go through nfdump
+
+    decode_mode: how nfdump is invoked
+    - file: one nfdump per file, one after another
+    - range: a single nfdump over the whole range of files (-R first:last)
+    - parallel: one nfdump per file, up to `workers` running at a time
+    the native backend decodes files one after another in every mode
+    """
+    def __init__(self, *, data_dir: str, backend: str = "nfdump", decode_mode: str = "file", workers: int | None = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        if decode_mode not in DECODE_MODES:
+            raise ValueError(f"Unknown decode mode '{decode_mode}', expected one of {DECODE_MODES}")
         self._data_dir = data_dir
+        self._index = FileIndex(data_dir, self.parse_file_key)
+        self.backend = backend
+        self.decode_mode = decode_mode
+        self.workers = workers or os.cpu_count() or 1
 
     def read_data_from_file(self, fp) -> list[dict]:
-        data = []
-        cmd = ["nfdump", "-r", fp, "-o", "json"]
+        return list(self.iter_data_from_file(fp))
+
+    """
+    same as read_data_from_file, but streams nfdump's output and yields the
+    records one by one instead of buffering the whole json array
+    """
+    def iter_data_from_file(self, fp):
+        if self.backend == "native":
+            return self._native_or_nfdump(
+                fp, lambda: self._iter_native(NfcapdReader(fp)), lambda: self._iter_nfdump(["-r", fp])
+            )
+        return self._iter_nfdump(["-r", fp])
+
+    """
+    decode a sorted, contiguous list of files (as returned by get_files)
+    with a single nfdump invocation
+    """
+    def iter_data_from_range(self, files):
+        if not files:
+            return iter(())
+        if self.backend == "native":
+            return itertools.chain.from_iterable(self.iter_data_from_file(fp) for fp in files)
+        if len(files) == 1:
+            return self.iter_data_from_file(files[0])
+        return self._iter_nfdump(["-R", f"{files[0]}:{os.path.basename(files[-1])}"])
+
+    """
+    decode `files` according to the decode mode and pass each stream of
+    FlowBatch objects to `consume`, returns the results of `consume` in file
+    order (a single result in range mode, unless `per_file` is set)
+    filters (tcp_only, exclude_src) are pushed down into the decoding, see
+    iter_batches_from_file
+    """
+    def consume_files(self, files, consume, *, per_file=False, **filters) -> list:
+        if self.decode_mode == "range" and not per_file:
+            return [consume(self.iter_batches_from_range(files, **filters))] if files else []
+        if self.decode_mode == "parallel" and self.backend == "nfdump" and len(files) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(files))) as pool:
+                consume_file = lambda fp: consume(self.iter_batches_from_file(fp, **filters))
+                # the stages run in the pool count towards the request
+                futures = [pool.submit(metrics.bind_context(consume_file), fp) for fp in files]
+                return [future.result() for future in futures]
+        return [consume(self.iter_batches_from_file(fp, **filters)) for fp in files]
+
+    """
+    columnar counterparts of iter_data_from_file/iter_data_from_range,
+    yielding FlowBatch objects of at most BATCH_SIZE records
+    records failing tcp_only/exclude_src are dropped while decoding: nfdump
+    gets them as a filter expression, the native reader skips the rows
+    before filling the batch
+    """
+    def iter_batches_from_file(self, fp, *, tcp_only=False, exclude_src=None):
+        self._observe_files([fp])
+        nfdump = lambda: self._to_batches(self._iter_nfdump(["-r", fp], self.nfdump_filter(tcp_only=tcp_only, exclude_src=exclude_src)))
+        if self.backend == "native":
+            return self._native_or_nfdump(fp, lambda: self._count_batches(NfcapdReader(fp).iter_batches(
+                BATCH_SIZE, ipv4_only=True,
+                proto=PROTO_TCP if tcp_only else None,
+                exclude_src=pack_ip(exclude_src) if exclude_src else None,
+            )), nfdump)
+        return nfdump()
+
+    def iter_batches_from_range(self, files, *, tcp_only=False, exclude_src=None):
+        if self.backend == "native" or len(files) == 1:
+            return itertools.chain.from_iterable(
+                self.iter_batches_from_file(fp, tcp_only=tcp_only, exclude_src=exclude_src) for fp in files
+            )
+        self._observe_files(files)
+        expression = self.nfdump_filter(tcp_only=tcp_only, exclude_src=exclude_src)
+        return self._to_batches(self._iter_nfdump(["-R", f"{files[0]}:{os.path.basename(files[-1])}"], expression))
+
+    """
+    translate the flow filters into an nfdump filter expression, None when
+    there is nothing to filter
+    """
+    @staticmethod
+    def nfdump_filter(*, tcp_only=False, exclude_src=None) -> str | None:
+        terms = []
+        if tcp_only:
+            terms.append("proto tcp")
+        if exclude_src:
+            terms.append(f"not src ip {exclude_src}")
+        return " and ".join(terms) or None
 
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            return data
+    def to_batch(self, records) -> FlowBatch:
+        builder = FlowBatchBuilder()
+        append = builder.append
+        for record in records:
+            src_hi, src_lo = pack_ip(record["src4_addr"])
+            dst = record.get("dst4_addr")
+            dst_hi, dst_lo = pack_ip(dst) if dst else (0, 0)
+            append(
+                src_hi, src_lo, dst_hi, dst_lo,
+                record.get("src_port") or 0, _dst_port(record.get("dst_port")),
+                proto_number(record.get("proto")),
+                record.get("in_packets", 0), record.get("in_bytes", 0),
+                parse_timestamp_ms(record.get("t_first")),
+            )
+        return builder.build()
+
+    def _to_batches(self, records):
+        for chunk in iter_chunks(records, BATCH_SIZE):
+            yield self.to_batch(chunk)
+
+    """
+    yield from native(), the in-process decoding of fp; files it rejects or
+    fails on before yielding anything are decoded by nfdump() instead, a
+    failure after that skips the rest of the file (what was yielded cannot
+    be taken back)
+    """
+    def _native_or_nfdump(self, fp, native, nfdump):
+        yielded = False
+        try:
+            for item in native():
+                yielded = True
+                yield item
+        except (NfcapdError, OSError, struct.error) as e:
+            if yielded:
+                print(f"Skipping the rest of {fp}: {e}")
+                return
+            yield from nfdump()
+
+    def _iter_native(self, reader):
+        records = 0
         try:
-            records = json.loads(result.stdout)
-            for record in records:
-                # filters out some fields
-                keep_fields = ["t_first", "src4_addr", "dst4_addr", "src_port", "dst_port", "in_packets", "in_bytes"]
+            for record in reader:
                 if "src4_addr" not in record:
                     continue
-                new_record = {k: v for k, v in record.items() if k in keep_fields}
-                data.append(new_record)
-        except json.JSONDecodeError:
-            pass
+                records += 1
+                yield record
+        finally:
+            metrics.observe_read("softflowd", records=records)
+
+    def _count_batches(self, batches):
+        records = 0
+        try:
+            for batch in batches:
+                records += len(batch)
+                yield batch
+        finally:
+            metrics.observe_read("softflowd", records=records)
+
+    def _observe_files(self, files):
+        size = 0
+        for fp in files:
+            try:
+                size += os.path.getsize(fp)
+            except OSError:
+                pass
+        metrics.observe_read("softflowd", files=len(files), bytes_=size)
 
-        return data
+    def _iter_nfdump(self, args, expression=None):
+        # the stage counts running and decoding nfdump, not the consumer of the records
+        return metrics.timed("nfdump", self._run_nfdump(args, expression))
+
+    def _run_nfdump(self, args, expression=None):
+        cmd = ["nfdump", *args, "-o", "json"]
+        if expression:
+            cmd.append(expression)
+
+        start = time.perf_counter()
+        records = 0
+        with tempfile.TemporaryFile("w+") as errors, \
+                subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors, text=True) as proc:
+            try:
+                for record in iter_json_array(proc.stdout):
+                    # filters out some fields
+                    if "src4_addr" not in record:
+                        continue
+                    records += 1
+                    yield {k: record[k] for k in KEEP_FIELDS if k in record}
+                # the output of a failed nfdump may be cut short, the records
+                # yielded so far are not to be aggregated (nor cached)
+                if proc.wait() != 0:
+                    errors.seek(0)
+                    raise NfdumpError(f"nfdump {' '.join(args)} exited with code {proc.returncode}: {errors.read()[-1000:].strip()}")
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                metrics.SUBPROCESS_SECONDS.observe(time.perf_counter() - start, command="nfdump")
+                metrics.observe_read("softflowd", records=records)
 
     def get_files(self, start_date, start_time, end_date, end_time):
-        prefix = "nfcapd"
-        files = []
-        # find all files in the range
-        # first get all files in the data dir
-        import os
-        all_files = os.listdir(self._data_dir)
-        for file in all_files:
-            # example: nfcapd.202511031536
-            if re.match(r"nfcapd\.\d{12}", file):
-                # extract date and time
-                suffix = file[len(prefix)+1:]
-                # compare the suffix
-                start = start_date + start_time
-                end = end_date + end_time
-                if suffix >= start and suffix <= end:
-                    files.append(os.path.join(self._data_dir, file))
-        files.sort()
-        return files
-
-    def get_range_from_now(self, hours=1):
-        end = datetime.now()
+        # find all files in the range from the sorted file index
+        return self._index.range(start_date + start_time, end_date + end_time)
+
+    """
+    minute key 'YYYYMMDDHHMM' of a data file
+    """
+    def file_key(self, fp) -> str:
+        return os.path.basename(fp)[7:19]
+
+    """
+    minute key of a file name, None if it is not a nfcapd.YYYYMMDDHHMM file
+    (e.g. nfcapd.current.<pid> still being written)
+    """
+    @staticmethod
+    def parse_file_key(name) -> str | None:
+        match_ = FILE_NAME.fullmatch(name)
+        return match_.group(1) if match_ else None
+
+    """
+    current time in the clock of the file names (nfcapd uses local time)
+    """
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def get_range_from_now(self, hours=1, now=None):
+        end = now or self.now()
         start = end - timedelta(hours=hours)
 
         start_date = start.strftime("%Y%m%d")
@@ -59,6 +273,16 @@ class DriverSoftflowd:
 
         return [start_date, start_time, end_date, end_time]
 
+    """
+    [start_date, start_time, end_date, end_time] of the minute files
+    overlapping [start, end), timezone-aware datetimes, in the clock of the
+    file names (local time)
+    """
+    def get_range(self, start: datetime, end: datetime):
+        start = start.astimezone()
+        last = (end - timedelta(microseconds=1)).astimezone()
+        return [start.strftime("%Y%m%d"), start.strftime("%H%M"), last.strftime("%Y%m%d"), last.strftime("%H%M")]
+
 
 if __name__ == "__main__":
     driver = DriverSoftflowd(data_dir="./monitor/softflowd/data")
@@ -0,0 +1,305 @@
+"""
+Sliding-window per-source state, fed incrementally.
+
+Instead of aggregating every record of the last N hours on each query, the
+data of each minute is consumed once, after the minute has closed, into a
+minute bucket, and running per-source totals are kept for each configured
+window length. As the window moves, the buckets falling out of it are
+subtracted from the totals. A query reads the totals and merges the few
+minutes that are not closed yet, so it costs O(active sources) rather than
+O(records in the window).
+
+- FlowWindow: packets and distinct dst ports per source, from the minute
+  files of the flow monitors
+- JournalWindow: counts per key (e.g. rule, source address, user) of the
+  entries of the followed journal
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+
+from driver.flow import FlowAggregate
+from driver.journaltail import entry_time_us
+from driver.rollup import CLOSE_DELAY
+
+MINUTE_US = 60 * 1_000_000
+
+
+class WindowCounts:
+    """
+    Running totals over a sequence of buckets, added newest last and removed
+    oldest first, a bucket mapping key -> (value, items).
+
+    totals: key -> [value, occurrences, {item: occurrences}, item order], the
+    value summed over the buckets and the items of all of them. Occurrences
+    are the (bucket key, position) of the key or item in each bucket holding
+    it, oldest first (lists, as most hold one or a few): adding a bucket
+    appends to them and removing the oldest drops their head, so the first occurrence of everything the removed bucket
+    held is found without scanning the other buckets.
+
+    The keys (and the items of each key) are kept in first-seen order as the
+    buckets come and go, see `ordered`.
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self._buckets = deque()  # (bucket key, bucket), oldest first
+        self._order = []         # keys of totals, by first occurrence
+
+    @property
+    def oldest_key(self):
+        return self._buckets[0][0] if self._buckets else None
+
+    def add(self, bucket_key, bucket):
+        self._buckets.append((bucket_key, bucket))
+        totals = self.totals
+        for index, (key, (value, items)) in enumerate(bucket.items()):
+            entry = totals.get(key)
+            if entry is None:
+                entry = totals[key] = [0, [], {}, []]
+                # first seen in the newest bucket: after every other key
+                self._order.append(key)
+            entry[0] += value
+            entry[1].append((bucket_key, index))
+            refs = entry[2]
+            item_order = entry[3]
+            for position, item in enumerate(items):
+                occurrences = refs.get(item)
+                if occurrences is None:
+                    refs[item] = [(bucket_key, position)]
+                    if item_order is not None:
+                        item_order.append(item)
+                else:
+                    occurrences.append((bucket_key, position))
+
+    def remove_oldest(self):
+        _, bucket = self._buckets.popleft()
+        totals = self.totals
+        moved = []
+        # being the oldest, the bucket held the first occurrence of everything
+        # in it: what remains moves to its next occurrence
+        for key, (value, items) in bucket.items():
+            entry = totals[key]
+            del entry[1][0]
+            if not entry[1]:
+                del totals[key]
+                continue
+            entry[0] -= value
+            moved.append(key)
+            refs = entry[2]
+            for item in items:
+                occurrences = refs[item]
+                del occurrences[0]
+                if not occurrences:
+                    del refs[item]
+            # sorted again on the next `ordered`
+            entry[3] = None
+
+        # the other keys keep their first occurrence and their order
+        first = lambda key: totals[key][1][0]
+        moved.sort(key=first)
+        self._order = list(heapq.merge((key for key in self._order if key not in bucket), moved, key=first))
+
+    def ordered(self) -> list:
+        """
+        (key, value, items) of the totals in first-seen order, the order of
+        merging the buckets one after another into insertion-ordered dicts;
+        the item lists are the window's own and are not to be modified
+        """
+        totals = self.totals
+        result = []
+        for key in self._order:
+            entry = totals[key]
+            if entry[3] is None:
+                refs = entry[2]
+                entry[3] = sorted(refs, key=lambda item: refs[item][0])
+            result.append((key, entry[0], entry[3]))
+        return result
+
+
+class SlidingWindow:
+    """
+    Minute buckets, added in key order, with running WindowCounts for each
+    window length of `hours`.
+    """
+
+    def __init__(self, hours):
+        self.hours = tuple(sorted(set(hours)))
+        self.last_key = None
+        self._windows = {h: WindowCounts() for h in self.hours}
+
+    def add(self, key, bucket):
+        for counts in self._windows.values():
+            counts.add(key, bucket)
+        self.last_key = key
+
+    def expire(self, hours, start_key):
+        """
+        drop the buckets of the `hours` window with a key before `start_key`
+        """
+        counts = self._windows[hours]
+        while counts.oldest_key is not None and counts.oldest_key < start_key:
+            counts.remove_oldest()
+
+    def counts(self, hours) -> WindowCounts:
+        return self._windows[hours]
+
+
+class FlowWindow:
+    """
+    driver: flow driver, for its file index, minute keys and clock
+    load_minutes: (paths, **filters) -> list of FlowAggregate, one per path,
+        normally the rollup's cached minute partials
+    hours: window lengths answered from the state, e.g. (1, 24)
+    filters: tcp_only/exclude_src the state is built with
+
+    `advance` (called periodically) consumes the minute files closed since the
+    last call; `aggregate` answers a window from the state.
+    """
+
+    def __init__(self, driver, load_minutes, hours, **filters):
+        self.driver = driver
+        self.load_minutes = load_minutes
+        self.filters = filters
+        self.ready = False
+        self._window = SlidingWindow(hours)
+        self._lock = threading.Lock()
+        # advances run one at a time, queries only wait for `_lock`
+        self._advance_lock = threading.Lock()
+
+    def covers(self, hours, **filters) -> bool:
+        return self.ready and hours in self._window.hours and filters == self.filters
+
+    def advance(self, now=None):
+        with self._advance_lock:
+            self._advance(now or self.driver.now())
+
+    def _advance(self, now):
+        # the file of minute M is complete once M has ended, plus the close delay
+        closed = now - timedelta(minutes=1) - CLOSE_DELAY
+        last_key = self._window.last_key
+        if last_key is None:
+            range_ = self.driver.get_range_from_now(max(self._window.hours), now=now)
+            start_date, start_time = range_[0], range_[1]
+        else:
+            start_date, start_time = last_key[:8], last_key[8:]
+        files = [
+            fp for fp in self.driver.get_files(start_date, start_time, closed.strftime("%Y%m%d"), closed.strftime("%H%M"))
+            if last_key is None or self.driver.file_key(fp) > last_key
+        ]
+
+        partials = self.load_minutes(files, **self.filters) if files else []
+        # the partials are shared with the rollup caches, the window keeps its own copy
+        buckets = [
+            (self.driver.file_key(fp), {ip_src: (packets, tuple(ports)) for ip_src, (packets, ports) in partial.sources.items()})
+            for fp, partial in zip(files, partials)
+        ]
+        with self._lock:
+            for key, bucket in buckets:
+                self._window.add(key, bucket)
+            for hours in self._window.hours:
+                range_ = self.driver.get_range_from_now(hours, now=now)
+                self._window.expire(hours, range_[0] + range_[1])
+        self.ready = True
+
+    def aggregate(self, hours, now=None) -> FlowAggregate:
+        now = now or self.driver.now()
+        range_ = self.driver.get_range_from_now(hours, now=now)
+        result = FlowAggregate()
+        with self._lock:
+            self._window.expire(hours, range_[0] + range_[1])
+            # in first-seen order, as merging the minute partials gives it
+            for ip_src, packets, ports in self._window.counts(hours).ordered():
+                result.sources[ip_src] = [packets, dict.fromkeys(ports)]
+            last_key = self._window.last_key
+
+        # minutes not closed yet, read from their (cached) partials
+        if last_key is not None and last_key < range_[0] + range_[1]:
+            last_key = None
+        if last_key is None:
+            files = self.driver.get_files(range_[0], range_[1], range_[2], range_[3])
+        else:
+            files = [
+                fp for fp in self.driver.get_files(last_key[:8], last_key[8:], range_[2], range_[3])
+                if self.driver.file_key(fp) > last_key
+            ]
+        for partial in self.load_minutes(files, **self.filters) if files else ():
+            result.update(partial)
+        return result
+
+
+class JournalWindow:
+    """
+    tail: JournalTail the entries are read from
+    count: entries -> Counter of keys, e.g. RuleSet.counts
+    hours: window lengths answered from the state, at most the tail's window
+
+    Entries are bucketed by minute of their timestamp. `advance` (called
+    periodically) counts the minutes closed since the last call; entries
+    arriving more than the close delay late are not counted.
+    """
+
+    def __init__(self, tail, count, hours):
+        self.tail = tail
+        self.count = count
+        self.ready = False
+        self._window = SlidingWindow(hours)
+        self._lock = threading.Lock()
+        # advances run one at a time, queries only wait for `_lock`
+        self._advance_lock = threading.Lock()
+
+    def covers(self, hours) -> bool:
+        return self.ready and hours in self._window.hours
+
+    def advance(self, now_us=None):
+        with self._advance_lock:
+            self._advance(now_us or int(time.time() * 1_000_000))
+
+    def _advance(self, now_us):
+        if not self.tail.covers(max(self._window.hours)):
+            return
+        closed_before = (now_us - int(CLOSE_DELAY.total_seconds() * 1_000_000)) // MINUTE_US
+        last_key = self._window.last_key
+        if last_key is None:
+            first = (now_us - max(self._window.hours) * 3600 * 1_000_000) // MINUTE_US
+        else:
+            first = last_key + 1
+        if first >= closed_before:
+            return
+
+        entries = self.tail.entries_between(first * MINUTE_US, closed_before * MINUTE_US)
+        buckets = [
+            (minute, {key: (n, ()) for key, n in self.count(list(group)).items()})
+            for minute, group in itertools.groupby(entries, lambda entry: entry_time_us(entry) // MINUTE_US)
+        ]
+        with self._lock:
+            for minute, bucket in buckets:
+                self._window.add(minute, bucket)
+            # minutes without entries are consumed too
+            self._window.last_key = closed_before - 1
+            for hours in self._window.hours:
+                self._window.expire(hours, (now_us - hours * 3600 * 1_000_000) // MINUTE_US)
+        self.ready = True
+
+    def counts(self, hours, now_us=None) -> Counter:
+        now_us = now_us or int(time.time() * 1_000_000)
+        since_us = now_us - hours * 3600 * 1_000_000
+        start = since_us // MINUTE_US
+        with self._lock:
+            self._window.expire(hours, start)
+            result = Counter({key: entry[0] for key, entry in self._window.counts(hours).totals.items()})
+            last_key = self._window.last_key
+
+        # the first bucket starts up to a minute before the window
+        if start <= last_key:
+            result.subtract(self.count(self.tail.entries_between(start * MINUTE_US, since_us)))
+            open_since_us = (last_key + 1) * MINUTE_US
+        else:
+            open_since_us = since_us
+        # minutes not closed yet
+        result.update(self.count(self.tail.entries_between(open_since_us, None)))
+        return +result
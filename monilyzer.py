@@ -1,12 +1,22 @@
-from api.monitor import MonitorManager, MonitorPmacct, MonitorJournalctl, MonitorSoftflowd
+from api.monitor import MonitorManager, MonitorPmacct, MonitorJournalctl, MonitorSoftflowd, get_default_filter
 from api.analyzer import AnalyzerManager
 from analyzer import SnortAnalyzer, LLMAnalyzer, SimpleJournalAnalyzer
+from analyzer.verdict_cache import VerdictCache
 from processor import Processor
+from api.profiling import ResourceSampler
 
 import configparser
 
 CONFIG_PATH = "monilyzer.ini"
 
+
+"""
+comma-separated window lengths in hours, e.g. "1, 24"
+"""
+def parse_hours(value) -> list[int]:
+    return [int(hours) for hours in value.split(",") if hours.strip()]
+
+
 """
 1. Initializes all the modules we need.
 2. Register the modules if needed.
@@ -23,32 +33,99 @@ if __name__ == "__main__":
     processor = Processor(monitor_manager, analyzer_manager, dict(config["server"]))
 
     # initializes and registers monitors
+    # how the flow monitors render their summaries into LLM prompts
+    llm_encoding_config = {
+        key: config["llm"][key] for key in ("llm_encoding", "top_k", "token_budget")
+        if config.has_section("llm") and key in config["llm"]
+    }
     pmacct_config = {
         "data_dir": config["pmacct"]["data_dir"],
         "ip": config["nic"]["ip"],
+        **llm_encoding_config,
     }
     monitor_pmacct = MonitorPmacct(pmacct_config)
     monitor_manager.register_monitor("pmacct", monitor_pmacct)
+    if int(config["pmacct"].get("rollup_refresh", 0)):
+        monitor_pmacct.start_rollup_refresh(
+            int(config["pmacct"].get("rollup_hours", 48)), get_default_filter()["pmacct"], int(config["pmacct"]["rollup_refresh"])
+        )
+    if config["pmacct"].get("detect_windows"):
+        monitor_pmacct.start_detection(
+            parse_hours(config["pmacct"]["detect_windows"]), get_default_filter()["pmacct"], int(config["pmacct"].get("detect_interval", 60))
+        )
 
     softflowd_config = {
         "data_dir": config["softflowd"]["data_dir"],
+        "backend": config["softflowd"].get("backend", "nfdump"),
+        "decode_mode": config["softflowd"].get("decode_mode", "file"),
+        "workers": config["softflowd"].get("workers", ""),
         "ip": config["nic"]["ip"],
+        **llm_encoding_config,
     }
     monitor_softflowd = MonitorSoftflowd(softflowd_config)
     monitor_manager.register_monitor("softflowd", monitor_softflowd)
+    if int(config["softflowd"].get("rollup_refresh", 0)):
+        monitor_softflowd.start_rollup_refresh(
+            int(config["softflowd"].get("rollup_hours", 48)), get_default_filter()["softflowd"], int(config["softflowd"]["rollup_refresh"])
+        )
+    if config["softflowd"].get("detect_windows"):
+        monitor_softflowd.start_detection(
+            parse_hours(config["softflowd"]["detect_windows"]), get_default_filter()["softflowd"], int(config["softflowd"].get("detect_interval", 60))
+        )
 
     journalctl_config = {
         "services": config["journalctl"]["services"]
     }
     monitor_journalctl = MonitorJournalctl(journalctl_config)
     monitor_manager.register_monitor("journalctl", monitor_journalctl)
+    if config["journalctl"].getboolean("follow", False):
+        monitor_journalctl.start_tail(
+            int(config["journalctl"].get("window_hours", 48)),
+            int(config["journalctl"].get("max_entries", 200000)),
+            config["journalctl"].get("cursor_file") or None,
+            config["journalctl"].getboolean("backfill", True),
+            get_default_filter()["journalctl"],
+        )
 
-    analyzer_snort = SnortAnalyzer()
-    analyzer_llm = LLMAnalyzer()
-    analyzer_simple_journal = SimpleJournalAnalyzer()
+    snort_config = config["snort"] if config.has_section("snort") else {}
+    analyzer_snort = SnortAnalyzer(
+        workers=int(snort_config.get("workers", 0)),
+        shards=int(snort_config.get("shards", 1)),
+        job_timeout=float(snort_config.get("job_timeout", 120)),
+    )
+    llm_config = config["llm"] if config.has_section("llm") else {}
+    verdict_cache = None
+    if int(llm_config.get("cache_ttl", 0)):
+        verdict_cache = VerdictCache(
+            ttl=int(llm_config["cache_ttl"]),
+            max_entries=int(llm_config.get("cache_size", 1024)),
+            directory=llm_config.get("cache_dir") or None,
+            max_disk_entries=int(llm_config.get("cache_disk_size", 16384)),
+        )
+    analyzer_llm = LLMAnalyzer(
+        max_chunk_chars=int(llm_config.get("max_chunk_chars", 60000)),
+        concurrency=int(llm_config.get("concurrency", 4)),
+        timeout=float(llm_config.get("timeout", 60)),
+        max_retries=int(llm_config.get("max_retries", 2)),
+        cache=verdict_cache,
+    )
+    simple_journal_config = config["simple_journal"] if config.has_section("simple_journal") else {}
+    analyzer_simple_journal = SimpleJournalAnalyzer(simple_journal_config.get("rules") or None)
     analyzer_manager.register_analyzer("snort", analyzer_snort)
     analyzer_manager.register_analyzer("llm", analyzer_llm)
     analyzer_manager.register_analyzer("simple_journal", analyzer_simple_journal)
 
+    # journal detection counts with the simple_journal rules, from the followed journal
+    if monitor_journalctl.tail is not None and config["journalctl"].get("detect_windows"):
+        monitor_journalctl.start_detection(
+            analyzer_simple_journal.rules.counts,
+            parse_hours(config["journalctl"]["detect_windows"]),
+            int(config["journalctl"].get("detect_interval", 60)),
+        )
+
+    # sample our own resource usage in the background
+    if config.has_section("sampler") and config["sampler"].get("output"):
+        ResourceSampler(config["sampler"]["output"], float(config["sampler"].get("interval", 1))).start()
+
     # run processor
     processor.run()
@@ -3,10 +3,20 @@
 from transport.message import Message
 from api.monitor import MonitorManager, get_default_filter
 from api.analyzer import AnalyzerManager
+from api.cache import ResultCache
+from api import metrics
+from api.profiling import RequestProfiler
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import selectors
+import socket
+import threading
 import json
+import time
+import zlib
 
 """
 1. Transfer data.
@@ -17,6 +27,62 @@ class Processor:
         self.monitor_manager = monitor_manager
         self.analyzer_manager = analyzer_manager
         self.config = config
+        ttl = int(config.get("result_cache_ttl", 0))
+        self.result_cache = ResultCache(ttl=ttl, max_entries=int(config.get("result_cache_size", 256))) if ttl > 0 else None
+        # analyzers of fan-out queries (analyzer=llm,snort or all) run concurrently in this pool
+        self.fanout_pool = ThreadPoolExecutor(
+            max_workers=int(config.get("fanout_workers", 8)), thread_name_prefix="monilyzer-analyzer"
+        )
+        self.fanout_timeout = float(config.get("fanout_timeout", 120)) or None
+        self.profiler = None
+        if str(config.get("profiling", "false")).lower() in ("1", "true", "yes", "on"):
+            self.profiler = RequestProfiler(top=int(config.get("profile_top", 25)), directory=config.get("profile_dir") or None)
+
+    """
+    process and analyze a query, identical queries within the same minute
+    share one computation through the result cache, unless `use_cache` is False
+    returns (status code, response) and the cache status
+    """
+    def query(self, options: dict, use_cache: bool = True) -> tuple[tuple[int, dict], str]:
+        def compute():
+            with metrics.stage("process"):
+                msg = self.process(options)
+            if msg is None:
+                return 400, {"error": "Not a support monitor or failed to process"}
+            return 200, self.analyze(options, msg)
+
+        labels = self._labels(options)
+        start = time.perf_counter()
+        try:
+            if self.result_cache is None or not use_cache:
+                result = compute(), "BYPASS"
+            else:
+                # only successful results are kept, and no fan-out result missing an analyzer's verdict
+                cacheable = lambda value: value[0] == 200 and not (isinstance(value[1], dict) and value[1].get("complete") is False)
+                result = self.result_cache.get_or_compute(self.result_cache.key(options), compute, cacheable)
+        except Exception:
+            metrics.REQUESTS.inc(code="500", cache="", **labels)
+            raise
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+        metrics.REQUESTS.inc(code=str(result[0][0]), cache=result[1], **labels)
+        return result
+
+    """
+    metric labels of a query, names that are not registered are labelled
+    "unknown" so that arbitrary query strings do not each add a series
+    """
+    def _labels(self, options: dict) -> dict:
+        monitor = options.get("monitor", "pmacct")
+        if monitor not in self.monitor_manager.support:
+            monitor = "unknown"
+        analyzer = options.get("analyzer", "snort")
+        if analyzer != "all":
+            names = sorted({name.strip() for name in analyzer.split(",") if name.strip()})
+            if names and all(name in self.analyzer_manager.support for name in names):
+                analyzer = ",".join(names)
+            else:
+                analyzer = "unknown"
+        return {"monitor": monitor, "analyzer": analyzer}
 
     """
     wrap the data in a Message object and return it
@@ -28,22 +94,88 @@ class Processor:
         monitor = self.monitor_manager.monitors.get(monitor_name, None)
 
         data_filter = get_default_filter()[monitor_name]
-        monitor.preprocess(options, data_filter=data_filter)
-        if not monitor.data:
+        with metrics.stage("preprocess"):
+            data = monitor.preprocess(options, data_filter=data_filter)
+        if not data:
             return None
-        return monitor.to_message(options)
+        with metrics.stage("to_message"):
+            return monitor.to_message(options, data)
 
     def analyze(self, options: dict, msg: Message) -> dict | None:
         analyzer_name = options.get("analyzer", "snort")
+        if analyzer_name == "all":
+            return self.fan_out(self.analyzer_manager.compatible(msg), msg)
+        if "," in analyzer_name:
+            return self.fan_out([name.strip() for name in analyzer_name.split(",") if name.strip()], msg)
         if analyzer_name not in self.analyzer_manager.support:
             return None
+        return self._run_analyzer(analyzer_name, msg)
+
+    """
+    run several analyzers on the same message concurrently, a failing or
+    slow analyzer (past fanout_timeout) does not hold back the others
+    returns {"is_attack", "complete", "analyzers": {name: {"status", "seconds", "result" or "error"}}},
+    status being ok, error, timeout, unsupported (cannot consume the message) or unknown
+    """
+    def fan_out(self, names: list[str], msg: Message) -> dict:
+        analyzers = {}
+        compatible = set(self.analyzer_manager.compatible(msg))
+        futures = {}
+        for name in dict.fromkeys(names):
+            # filled in request order
+            analyzers[name] = None
+            if name not in self.analyzer_manager.support:
+                analyzers[name] = {"status": "unknown"}
+            elif name not in compatible and getattr(self.analyzer_manager.analyzers[name], "kind", None) is not None:
+                analyzers[name] = {"status": "unsupported"}
+            else:
+                # bound so that the analyzers' stages count towards the request
+                futures[name] = self.fanout_pool.submit(metrics.bind_context(self._timed_analyzer), name, msg)
+
+        start = time.perf_counter()
+        wait(futures.values(), timeout=self.fanout_timeout)
+        for name, future in futures.items():
+            if not future.done():
+                # left running, its result is dropped
+                analyzers[name] = {"status": "timeout", "seconds": round(time.perf_counter() - start, 3)}
+                continue
+            seconds, result, error = future.result()
+            if error is None:
+                analyzers[name] = {"status": "ok", "seconds": round(seconds, 3), "result": result}
+            else:
+                analyzers[name] = {"status": "error", "seconds": round(seconds, 3), "error": error}
+
+        ok = [entry["result"] for entry in analyzers.values() if entry["status"] == "ok"]
+        return {
+            "is_attack": any(isinstance(result, dict) and bool(result.get("is_attack")) for result in ok),
+            "complete": bool(analyzers) and len(ok) == len(analyzers),
+            "analyzers": analyzers,
+        }
+
+    def _timed_analyzer(self, name, msg):
+        start = time.perf_counter()
+        try:
+            result, error = self._run_analyzer(name, msg), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        return time.perf_counter() - start, result, error
 
-        result = self.analyzer_manager.analyze(analyzer_name, msg)
+    def _run_analyzer(self, name, msg):
+        start = time.perf_counter()
+        with metrics.stage("analyze"):
+            result = self.analyzer_manager.analyze(name, msg)
+        metrics.ANALYZER_SECONDS.observe(time.perf_counter() - start, analyzer=name)
         return result
 
     def run(self):
         print('Starting MoniLyzer server...')
-        server = HTTPServer((self.config["host"], int(self.config["port"])), MonilyzerHandler)
+        server = PooledHTTPServer(
+            (self.config["host"], int(self.config["port"])),
+            MonilyzerHandler,
+            workers=int(self.config.get("workers", 4)),
+            queue_size=int(self.config.get("queue_size", 16)),
+            keepalive_timeout=float(self.config.get("keepalive_timeout", 5)),
+        )
         server.injected_processor = self
         try:
             server.serve_forever()
@@ -51,12 +183,279 @@ class Processor:
             print('Stopping MoniLyzer server...')
             server.server_close()
 
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands accepted connections to a bounded worker pool.
+
+    At most `workers` requests run at once and `queue_size` more wait for a
+    worker. When both are taken, the connection is answered with 503 right
+    away from the accepting thread instead of piling up.
+
+    A worker handles one request of a connection at a time. Between requests
+    a kept-alive connection waits in a selector, without a worker, and is
+    closed after `keepalive_timeout` idle seconds; its next request is queued
+    for a worker like a new connection. 0 closes connections after each
+    response. The handler handles one request per `handle` and leaves the
+    connection open unless `close_connection` is set (see MonilyzerHandler).
+    """
+
+    def __init__(self, server_address, handler_class, *, workers=4, queue_size=16, keepalive_timeout=5.0):
+        super().__init__(server_address, handler_class)
+        self.keepalive_timeout = keepalive_timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="monilyzer")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        # idle kept-alive connections: handlers parked by the workers, watched by the idle thread
+        self._selector = selectors.DefaultSelector()
+        self._parked = []
+        self._parked_lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._closing = False
+        self._idle_thread = None
+        if keepalive_timeout:
+            self._idle_thread = threading.Thread(target=self._serve_idle, daemon=True, name="monilyzer-idle")
+            self._idle_thread.start()
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            self._slots.release()
+            return
+        self._done(handler)
+
+    def _resume(self, handler):
+        try:
+            handler.handle()
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+            handler.close_connection = True
+        self._done(handler)
+
+    def _done(self, handler):
+        """
+        after a request: close the connection, or park it until its next request
+        """
+        try:
+            if handler.close_connection or self._closing:
+                self._close(handler)
+            elif self._buffered(handler):
+                # pipelined, the next request is already read
+                self._pool.submit(self._resume, handler)
+                return
+            else:
+                with self._parked_lock:
+                    self._parked.append(handler)
+                self._wakeup_w.send(b"\0")
+        except OSError:
+            self._close(handler)
+        self._slots.release()
+
+    def _buffered(self, handler) -> bool:
+        request = handler.request
+        request.setblocking(False)
+        try:
+            return bool(handler.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            request.settimeout(handler.timeout)
+
+    def _serve_idle(self):
+        deadlines = {}  # handler -> monotonic time it is closed at
+        while not self._closing:
+            timeout = max(0.0, min(deadlines.values()) - time.monotonic()) if deadlines else None
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                handler = key.data
+                self._selector.unregister(key.fileobj)
+                del deadlines[handler]
+                if self._slots.acquire(blocking=False):
+                    self._pool.submit(self._resume, handler)
+                else:
+                    self._reject(handler.request)
+            with self._parked_lock:
+                parked, self._parked = self._parked, []
+            deadline = time.monotonic() + self.keepalive_timeout
+            for handler in parked:
+                self._selector.register(handler.request, selectors.EVENT_READ, handler)
+                deadlines[handler] = deadline
+            now = time.monotonic()
+            for handler in [h for h, at in deadlines.items() if at <= now]:
+                self._selector.unregister(handler.request)
+                del deadlines[handler]
+                self._close(handler)
+        for handler in deadlines:
+            self._close(handler)
+
+    def _close(self, handler):
+        try:
+            handler.close_connection = True
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(handler.request)
+
+    def _reject(self, request):
+        body = bytes(json.dumps({"error": "Server busy, retry later"}), "utf8")
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-type: application/json\r\n"
+            "Retry-After: 1\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        try:
+            request.sendall(bytes(head, "utf8") + body)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._closing = True
+        if self._idle_thread is not None:
+            self._wakeup_w.send(b"\0")
+            self._idle_thread.join()
+        self._pool.shutdown(wait=True)
+        with self._parked_lock:
+            parked, self._parked = self._parked, []
+        for handler in parked:
+            self._close(handler)
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+"""
+a query time, epoch seconds or ISO 8601, as a timezone-aware UTC datetime;
+ISO times without an offset are in the server's local time, like the
+timestamps of the collected data
+"""
+def parse_time(value: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    # fromisoformat only accepts "Z" from Python 3.11 on
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    return parsed.astimezone(timezone.utc)
+
+
+"""
+whether an Accept-Encoding header value accepts gzip
+"""
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() not in ("gzip", "x-gzip", "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+class BodyWriter:
+    """
+    Writes a response body piece by piece, gzip-compressed when `gzip` is set.
+
+    chunked: use chunked transfer encoding (HTTP/1.1), otherwise the body is
+    written as is and ended by closing the connection (HTTP/1.0)
+    Pieces are buffered, then compressed and sent once `buffer_size` bytes
+    are pending.
+    """
+
+    def __init__(self, wfile, *, chunked, gzip, buffer_size=65536):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        # wbits 31: gzip container
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, data: str | bytes):
+        if isinstance(data, str):
+            data = data.encode("utf8")
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.buffer_size:
+            self._send()
+
+    def close(self):
+        self._send()
+        if self._compressor is not None:
+            self._write_chunk(self._compressor.flush())
+        if self.chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _send(self):
+        data = b"".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._write_chunk(data)
+
+    def _write_chunk(self, data):
+        if not data:
+            return
+        if self.chunked:
+            self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+        else:
+            self.wfile.write(data)
+
 class MonilyzerHandler(BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 with keep-alive. Once a result is computed, it is serialized
+    piece by piece into a chunked body, gzip-compressed when the client
+    accepts it.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # a request is read within this many seconds
+        self.timeout = self.server.keepalive_timeout or None
+        super().setup()
+
+    def handle(self):
+        # one request, between requests PooledHTTPServer keeps the connection
+        self.handle_one_request()
+
+    def finish(self):
+        if self.close_connection:
+            super().finish()
+
     def do_GET(self):
         # Parse URL path and query string
         parsed_url = urlparse(self.path)
         query_params = parse_qs(parsed_url.query)
 
+        if parsed_url.path == '/metrics':
+            self.send_metrics()
+            return
+
         # Only accept /opt path
         if parsed_url.path != '/opt':
             self.send_error_response(400, "Invalid path. Expected: /opt")
@@ -67,40 +466,116 @@ class MonilyzerHandler(BaseHTTPRequestHandler):
             self.send_error_response(400, "No query parameters provided. Expected: /opt?monitor=value&hours=value&analyzer=value")
             return
 
-        if "monitor" not in query_params or "hours" not in query_params or "analyzer" not in query_params:
-            self.send_error_response(400, "Missing required parameters: monitor and hours")
+        if "monitor" not in query_params or "analyzer" not in query_params or not ("hours" in query_params or "start" in query_params):
+            self.send_error_response(400, "Missing required parameters: monitor, analyzer and hours or start")
             return
 
-        try:
-            options = {
-                "monitor": query_params["monitor"][0],
-                "hours": int(query_params["hours"][0]),
-                "analyzer": query_params["analyzer"][0],
-            }
-        except ValueError:
-            self.send_error_response(400, "Invalid query parameters. Hours must be a valid integer")
-            return
+        options = {
+            "monitor": query_params["monitor"][0],
+            "analyzer": query_params["analyzer"][0],
+        }
+        # the last `hours`, or the range [start, end) (end defaults to now)
+        if "start" in query_params:
+            try:
+                options["start"] = parse_time(query_params["start"][0])
+                options["end"] = parse_time(query_params["end"][0]) if "end" in query_params else datetime.now(timezone.utc)
+                # an implicit end is keyed like `hours`, by the cache's time bucket
+                options["open_end"] = "end" not in query_params
+            except ValueError:
+                self.send_error_response(400, "Invalid query parameters. start and end must be epoch seconds or ISO 8601 times")
+                return
+            if options["start"] >= options["end"]:
+                self.send_error_response(400, "Invalid query parameters. start must be before end")
+                return
+        else:
+            try:
+                options["hours"] = int(query_params["hours"][0])
+            except ValueError:
+                self.send_error_response(400, "Invalid query parameters. Hours must be a valid integer")
+                return
 
-        # Process and analyze
+        # profiled on ?profile=1 or X-Profile: 1, when profiling is enabled
         processor = self.server.injected_processor
-        msg = processor.process(options)
-        if msg is None:
-            self.send_error_response(400, "Not a support monitor or failed to process")
+        profile = "1" in (query_params.get("profile", [""])[0], self.headers.get("X-Profile", ""))
+        if profile and processor.profiler is None:
+            self.send_error_response(403, "Profiling is disabled, set profiling = true in [server]")
             return
-        resp = processor.analyze(options, msg)
+
+        # Process and analyze, timing the stages of the request
+        with metrics.request_timings() as timings:
+            start = time.perf_counter()
+            if profile:
+                # the computation itself is profiled, not a cached result
+                with processor.profiler.profile(options["monitor"] + "_" + options["analyzer"]) as report:
+                    (code, resp), cache_status = processor.query(options, use_cache=False)
+            else:
+                (code, resp), cache_status = processor.query(options)
+        timing = metrics.server_timing([("total", time.perf_counter() - start)] + timings)
+        if code != 200:
+            self.send_error_response(code, resp["error"], headers={"X-Cache": cache_status, "Server-Timing": timing})
+            return
+        if profile:
+            resp = {"result": resp, "profile": report}
 
         # Send response status code and headers
+        gzip = accepts_gzip(self.headers.get("Accept-Encoding"))
+        chunked = self.request_version != "HTTP/1.0"
         self.send_response(200)
-        self.send_header('Content-type','application/json')
+        self.send_header('Content-type', 'application/json')
+        self.send_header('X-Cache', cache_status)
+        self.send_header('Server-Timing', timing)
+        self.send_header('Vary', 'Accept-Encoding')
+        if gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # without a length the end of the body is the end of the connection
+            self.close_connection = True
+        self._send_connection_header()
         self.end_headers()
-        self.wfile.write(bytes(json.dumps(resp), "utf8"))
+
+        # serialized piece by piece instead of one json.dumps of the whole result
+        body = BodyWriter(self.wfile, chunked=chunked, gzip=gzip)
+        for piece in json.JSONEncoder().iterencode(resp):
+            body.write(piece)
+        body.close()
 
         return
 
-    def send_error_response(self, code, message):
+    def log_error(self, format, *args):
+        # clients stalling within a request on a kept-alive connection are expected
+        if format.startswith("Request timed out"):
+            return
+        super().log_error(format, *args)
+
+    def send_metrics(self):
+        """Send the metrics in the Prometheus text format"""
+        body = metrics.REGISTRY.render().encode("utf8")
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self._send_connection_header()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_response(self, code, message, headers=None):
         """Send an error response with JSON body"""
+        error_resp = {"error": message}
+        body = bytes(json.dumps(error_resp), "utf8")
         self.send_response(code)
         self.send_header('Content-type','application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self._send_connection_header()
         self.end_headers()
-        error_resp = {"error": message}
-        self.wfile.write(bytes(json.dumps(error_resp), "utf8"))
+        self.wfile.write(body)
+
+    def _send_connection_header(self):
+        if not self.server.keepalive_timeout:
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        elif self.request_version == "HTTP/1.0":
+            self.send_header('Connection', 'keep-alive')
@@ -0,0 +1,317 @@
+"""
+Benchmark of the monitor and analyzer pipelines on synthetic data.
+
+Generates the data of the last `--hours` with testbed/synth.py, then measures
+- decode: records/sec of a cold `preprocess` of each monitor, best of `--repeat`
+- memory: peak traced allocations of a cold `preprocess` + `to_message`
+- requests: latency of /opt for each monitor/analyzer pair, served by the
+  real handler on a local port over one kept-alive connection, with the
+  result cache off so that every request is computed
+
+The llm and snort analyzers need OPENAI_API_KEY and a snort executable; without
+them the pairs run `llm_prompt` (the LLM prompt chunks are built but not sent)
+and `snort_pcap` (the pcap is written but not inspected) instead.
+
+Results are written as JSON, keyed by commit, and compared with a previous run
+with --compare; regressions beyond --tolerance make the exit status 1.
+
+Usage:
+    python testbed/benchmark.py [--hours 1] [--rate 2000] [--output results.json]
+    python testbed/benchmark.py --compare baseline.json --output results.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import synth  # noqa: E402
+from analyzer import LLMAnalyzer, SimpleJournalAnalyzer, SnortAnalyzer  # noqa: E402
+from api.analyzer import AnalyzerManager  # noqa: E402
+from api.monitor import MonitorJournalctl, MonitorManager, MonitorPmacct, MonitorSoftflowd, get_default_filter  # noqa: E402
+from driver.journalctl import DriverJournalctl  # noqa: E402
+from driver.jsonstream import loads  # noqa: E402
+from processor import MonilyzerHandler, PooledHTTPServer, Processor  # noqa: E402
+from transport.message import Analyzer  # noqa: E402
+
+FLOW_MONITORS = ("pmacct", "softflowd")
+# metric -> whether higher is better, for --compare
+COMPARED = {"records_per_sec": True, "peak_bytes": False, "p50_ms": False, "p95_ms": False}
+
+
+class FileJournalDriver(DriverJournalctl):
+    """
+    DriverJournalctl reading `journalctl -o json` output from a file
+    instead of running journalctl
+    """
+
+    def __init__(self, path):
+        super().__init__(listen_services=["sshd"])
+        self.path = path
+
+    def iter_logs(self, hours=1, fields=None):
+        since_us = int((time.time() - hours * 3600) * 1_000_000)
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                entry = loads(line)
+                if int(entry["_SOURCE_REALTIME_TIMESTAMP"]) < since_us:
+                    continue
+                if fields:
+                    entry = {key: value for key, value in entry.items() if key in fields or key.startswith("__")}
+                yield entry
+
+
+class LLMPromptAnalyzer:
+    """
+    builds the LLM prompt chunks of a message, as LLMAnalyzer does, without sending them
+    """
+
+    kind = Analyzer.LLM
+
+    def __init__(self, max_chunk_chars=60000):
+        self.max_chunk_chars = max_chunk_chars
+
+    def analyze(self, message):
+        chunks = message.to_text_chunks_of_analyzer(Analyzer.LLM, self.max_chunk_chars)
+        return {"chunks": len(chunks), "chars": sum(len(chunk) for chunk in chunks)}
+
+
+class _CountingStream:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+
+class SnortPcapAnalyzer:
+    """
+    writes the pcap of a message, as SnortAnalyzer does, without running snort
+    """
+
+    kind = Analyzer.Snort
+
+    def analyze(self, message):
+        stream = _CountingStream()
+        message.write_format_of_analyzer(Analyzer.Snort, stream)
+        return {"pcap_bytes": stream.written}
+
+
+class QuietHandler(MonilyzerHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_monitors(data_dir, args) -> dict:
+    ip = args.host_ip
+    journalctl = MonitorJournalctl({"services": "sshd"})
+    journalctl.driver = FileJournalDriver(os.path.join(data_dir, "journal.json"))
+    return {
+        "pmacct": MonitorPmacct({"data_dir": os.path.join(data_dir, "pmacct"), "ip": ip}),
+        "softflowd": MonitorSoftflowd({
+            "data_dir": os.path.join(data_dir, "softflowd"), "backend": args.backend, "decode_mode": "file", "workers": "", "ip": ip,
+        }),
+        "journalctl": journalctl,
+    }
+
+
+def make_analyzers() -> dict:
+    analyzers = {"simple_journal": SimpleJournalAnalyzer()}
+    if os.environ.get("OPENAI_API_KEY"):
+        analyzers["llm"] = LLMAnalyzer()
+    else:
+        analyzers["llm_prompt"] = LLMPromptAnalyzer()
+    if os.environ.get("SNORT_EXECUTABLE") or shutil.which("snort"):
+        analyzers["snort"] = SnortAnalyzer()
+    else:
+        analyzers["snort_pcap"] = SnortPcapAnalyzer()
+    return analyzers
+
+
+def pairs(analyzers) -> list[tuple[str, str]]:
+    llm = "llm" if "llm" in analyzers else "llm_prompt"
+    snort = "snort" if "snort" in analyzers else "snort_pcap"
+    # "all": the message built once for the compatible analyzers, run concurrently
+    return [(monitor, analyzer) for monitor in FLOW_MONITORS for analyzer in (llm, snort, "all")] + [
+        ("journalctl", llm), ("journalctl", "simple_journal"), ("journalctl", "all"),
+    ]
+
+
+def bench_decode(data_dir, args, records) -> dict:
+    """
+    cold preprocess of each monitor, a new monitor (and so empty caches) per run
+    """
+    options = {"hours": args.hours}
+    results = {}
+    for name in ("pmacct", "softflowd", "journalctl"):
+        data_filter = get_default_filter()[name]
+        seconds = []
+        for _ in range(args.repeat):
+            monitor = make_monitors(data_dir, args)[name]
+            start = time.perf_counter()
+            monitor.preprocess(options, data_filter=data_filter)
+            seconds.append(time.perf_counter() - start)
+
+        monitor = make_monitors(data_dir, args)[name]
+        tracemalloc.start()
+        try:
+            data = monitor.preprocess(options, data_filter=data_filter)
+            monitor.to_message(options, data)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        best = min(seconds)
+        results[name] = {
+            "records": records[name],
+            "seconds": round(best, 4),
+            "median_seconds": round(statistics.median(seconds), 4),
+            "records_per_sec": round(records[name] / best) if best else None,
+            "peak_bytes": peak,
+        }
+        print(f"decode {name}: {results[name]['records_per_sec']} records/s, peak {peak / 1e6:.1f} MB", file=sys.stderr)
+    return results
+
+
+def bench_requests(data_dir, args) -> dict:
+    monitor_manager = MonitorManager()
+    for name, monitor in make_monitors(data_dir, args).items():
+        monitor_manager.register_monitor(name, monitor)
+    analyzer_manager = AnalyzerManager()
+    analyzers = make_analyzers()
+    for name, analyzer in analyzers.items():
+        analyzer_manager.register_analyzer(name, analyzer)
+    processor = Processor(monitor_manager, analyzer_manager, {"result_cache_ttl": 0})
+
+    server = PooledHTTPServer(("127.0.0.1", 0), QuietHandler, workers=2, queue_size=4, keepalive_timeout=30)
+    server.injected_processor = processor
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    results = {}
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=600)
+        for monitor, analyzer in pairs(analyzers):
+            path = f"/opt?monitor={monitor}&hours={args.hours}&analyzer={analyzer}"
+            latencies = []
+            status = None
+            for _ in range(args.requests + 1):
+                start = time.perf_counter()
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                latencies.append((time.perf_counter() - start) * 1000)
+                status = response.status
+            # the first request also fills the monitor's caches
+            first, warm = latencies[0], sorted(latencies[1:])
+            results[f"{monitor}/{analyzer}"] = {
+                "status": status,
+                "first_ms": round(first, 1),
+                "p50_ms": round(statistics.median(warm), 1),
+                "p95_ms": round(warm[min(len(warm) - 1, int(len(warm) * 0.95))], 1),
+                "max_ms": round(warm[-1], 1),
+                "server_timing": response.getheader("Server-Timing"),
+            }
+            print(f"request {monitor}/{analyzer}: {status}, first {first:.1f} ms, p50 {results[f'{monitor}/{analyzer}']['p50_ms']} ms", file=sys.stderr)
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, tolerance) -> list[str]:
+    """
+    the compared metrics of `current` worse than `baseline` by more than `tolerance`
+    """
+    if baseline.get("params") != current["params"]:
+        print("baseline was run with other params, the comparison is only indicative", file=sys.stderr)
+    regressions = []
+    for section in ("decode", "requests"):
+        for name, metrics_ in current["results"][section].items():
+            base = baseline["results"].get(section, {}).get(name)
+            if base is None:
+                continue
+            for metric, higher_is_better in COMPARED.items():
+                old, new = base.get(metric), metrics_.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = -change if higher_is_better else change
+                line = f"{section} {name} {metric}: {old} -> {new} ({change:+.1%})"
+                print(("REGRESSION " if worse > tolerance else "           ") + line, file=sys.stderr)
+                if worse > tolerance:
+                    regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the monitor and analyzer pipelines on synthetic data")
+    synth.add_shape_arguments(parser)
+    parser.add_argument("--backend", default="native", choices=("native", "nfdump"), help="nfcapd decoder of softflowd")
+    parser.add_argument("--repeat", type=int, default=3, help="cold decodes per monitor")
+    parser.add_argument("--requests", type=int, default=5, help="requests per monitor/analyzer pair, after the first")
+    parser.add_argument("--data", help="directory for the generated data, kept afterwards (default: a temporary one)")
+    parser.add_argument("--output", help="results file (default: stdout)")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    data_dir = args.data or tempfile.mkdtemp(prefix="monilyzer-bench-")
+    try:
+        start = time.perf_counter()
+        records = synth.generate(data_dir, hours=args.hours, **synth.shape_options(args))
+        print(f"generated {records} in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+        results = {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {**synth.shape_options(args), "hours": args.hours, "backend": args.backend, "repeat": args.repeat, "requests": args.requests},
+            "results": {
+                "decode": bench_decode(data_dir, args, records),
+                "requests": bench_requests(data_dir, args),
+            },
+        }
+    finally:
+        if not args.data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
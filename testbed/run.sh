@@ -16,6 +16,7 @@ pid_MoniLyzer=816161
 # bash ./monitor_precise.sh $pid_softflowd &
 # echo "Monitoring nfcapd process $pid_nfcapd ..."
 # bash ./monitor_precise.sh $pid_nfcapd &
+# MoniLyzer samples itself into the same CSV schema, see [sampler] in monilyzer.ini
 # echo "Monitoring nfcapd process $pid_MoniLyzer ..."
 # bash ./monitor_precise.sh $pid_MoniLyzer &
 
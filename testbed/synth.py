@@ -0,0 +1,231 @@
+"""
+Synthetic monitor data for benchmarks.
+
+Generates, for the last `hours` up to now:
+- pmacct: traffic_YYYYMMDD_HHMM.json minute files (UTC names, like rotatelogs)
+- softflowd: nfcapd.YYYYMMDDHHMM minute files (local time names, like nfcapd),
+  written in nfdump 1.7's LAYOUT_VERSION_2 with uncompressed V3 records
+- journal: journalctl -o json lines of sshd, one file for the whole window
+
+Every minute holds `rate` flow records of background clients talking to a few
+service ports, plus the attack shapes:
+- port scan: each scanner probes `scan_ports` sequential ports per minute
+- SSH brute force: each attacker opens `bruteforce_attempts` connections to
+  port 22 per minute, logged in the journal as invalid users and failed passwords
+
+Usage: python testbed/synth.py <output dir> [--hours 1] [--rate 2000] ...
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from driver.nfcapd import (  # noqa: E402
+    BLOCK_HEADER, DATA_BLOCK_TYPE_3, ELEMENT_HEADER, EX_GENERIC_FLOW, EX_IPV4_FLOW, EXgenericFlowID, EXipv4FlowID,
+    FILE_HEADER_V2, LAYOUT_VERSION_2, MAGIC, NOT_COMPRESSED, V3_RECORD_HEADER, V3Record,
+)
+
+SERVICE_PORTS = (22, 80, 443, 3306, 5432)
+SSH_USERS = ("root", "admin", "test", "oracle", "ubuntu", "postgres", "user", "guest", "git", "pi")
+# nfcapd data blocks are flushed at about this many records
+RECORDS_PER_BLOCK = 1024
+
+
+class Shape:
+    """
+    host_ip: address of the monitored host, the destination of the traffic
+    rate: background flow records per minute
+    scanners, scan_ports: port scan sources and ports probed per minute each
+    attackers, bruteforce_attempts: SSH brute force sources and attempts per minute each
+    """
+
+    def __init__(self, *, host_ip="10.10.1.2", rate=2000, clients=500, scanners=2, scan_ports=200,
+                 attackers=3, bruteforce_attempts=30, seed=1):
+        self.host_ip = host_ip
+        self.rate = rate
+        self.scanners = [f"203.0.113.{i + 1}" for i in range(scanners)]
+        self.scan_ports = scan_ports
+        self.attackers = [f"198.51.100.{i + 1}" for i in range(attackers)]
+        self.bruteforce_attempts = bruteforce_attempts
+        self.random = random.Random(seed)
+        self.clients = [f"10.{self.random.randint(0, 255)}.{self.random.randint(0, 255)}.{self.random.randint(1, 254)}" for _ in range(clients)]
+
+    def flows(self, minute_index, start_ms):
+        """
+        flow records of one minute: (src, dst, src_port, dst_port, proto, packets, bytes, ts_ms)
+        """
+        rnd = self.random
+        host = self.host_ip
+        for _ in range(self.rate):
+            ts = start_ms + rnd.randrange(60000)
+            if rnd.random() < 0.3:
+                # outbound traffic of the host, filtered out by traffic_in_only
+                yield host, rnd.choice(self.clients), rnd.choice(SERVICE_PORTS), rnd.randint(32768, 60999), 6, rnd.randint(1, 40), rnd.randint(60, 60000), ts
+            else:
+                proto = 6 if rnd.random() < 0.85 else 17
+                yield rnd.choice(self.clients), host, rnd.randint(32768, 60999), rnd.choice(SERVICE_PORTS), proto, rnd.randint(1, 40), rnd.randint(60, 60000), ts
+        for i, scanner in enumerate(self.scanners):
+            first = (minute_index * self.scan_ports + i * 997) % 65535
+            for k in range(self.scan_ports):
+                yield scanner, host, 40000 + i, (first + k) % 65535 + 1, 6, 1, 44, start_ms + k * 60000 // self.scan_ports
+        for attacker in self.attackers:
+            for k in range(self.bruteforce_attempts):
+                yield attacker, host, rnd.randint(32768, 60999), 22, 6, rnd.randint(10, 20), rnd.randint(2000, 5000), start_ms + k * 60000 // self.bruteforce_attempts
+
+    def journal(self, start_us):
+        """
+        sshd journal entries of one minute
+        """
+        rnd = self.random
+        entries = []
+        for attacker in self.attackers:
+            for k in range(self.bruteforce_attempts):
+                user = rnd.choice(SSH_USERS)
+                port = rnd.randint(32768, 60999)
+                if rnd.random() < 0.5:
+                    message = f"Invalid user {user} from {attacker} port {port}"
+                else:
+                    message = f"Failed password for {user} from {attacker} port {port} ssh2"
+                entries.append((start_us + k * 60_000_000 // self.bruteforce_attempts, message))
+        for _ in range(max(1, self.rate // 100)):
+            client = rnd.choice(self.clients)
+            user = rnd.choice(SSH_USERS)
+            port = rnd.randint(32768, 60999)
+            message = rnd.choice((
+                f"Accepted publickey for {user} from {client} port {port} ssh2: ED25519 SHA256:abc",
+                f"pam_unix(sshd:session): session opened for user {user}(uid=1000) by (uid=0)",
+                f"Received disconnect from {client} port {port}:11: disconnected by user",
+                f"pam_unix(sshd:session): session closed for user {user}",
+            ))
+            entries.append((start_us + rnd.randrange(60_000_000), message))
+        entries.sort()
+        return entries
+
+
+def _minutes(hours, now):
+    start = (now - timedelta(hours=hours)).replace(second=0, microsecond=0)
+    for i in range(hours * 60 + 1):
+        yield i, start + timedelta(minutes=i)
+
+
+def write_pmacct(directory, shape: Shape, hours, now=None) -> int:
+    now = now or datetime.now(timezone.utc)
+    os.makedirs(directory, exist_ok=True)
+    records = 0
+    for i, minute in _minutes(hours, now):
+        start_ms = int(minute.timestamp() * 1000)
+        lines = []
+        for src, dst, sport, dport, proto, packets, bytes_, ts in shape.flows(i, start_ms):
+            # pmacct writes local timestamps
+            first = datetime.fromtimestamp(ts / 1000)
+            lines.append(json.dumps({
+                "event_type": "purge", "ip_src": src, "ip_dst": dst, "port_src": sport, "port_dst": dport,
+                "ip_proto": "tcp" if proto == 6 else "udp", "packets": packets, "bytes": bytes_,
+                "timestamp_start": first.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                "timestamp_end": (first + timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S.%f"),
+            }))
+        with open(os.path.join(directory, f"traffic_{minute:%Y%m%d_%H%M}.json"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        records += len(lines)
+    return records
+
+
+def _v3_record(src, dst, sport, dport, proto, packets, bytes_, ts) -> bytes:
+    generic = ELEMENT_HEADER.pack(EXgenericFlowID, ELEMENT_HEADER.size + EX_GENERIC_FLOW.size) + EX_GENERIC_FLOW.pack(
+        ts, ts + 1000, ts + 1000, packets, bytes_, sport, dport, proto, 0, 0, 0)
+    ipv4 = ELEMENT_HEADER.pack(EXipv4FlowID, ELEMENT_HEADER.size + EX_IPV4_FLOW.size) + EX_IPV4_FLOW.pack(
+        struct.unpack(">I", socket.inet_aton(src))[0], struct.unpack(">I", socket.inet_aton(dst))[0])
+    body = generic + ipv4
+    return V3_RECORD_HEADER.pack(V3Record, V3_RECORD_HEADER.size + len(body), 2, 0, 0, 0, 0, 9, 0) + body
+
+
+def write_nfcapd(directory, shape: Shape, hours, now=None) -> int:
+    now = now or datetime.now()
+    os.makedirs(directory, exist_ok=True)
+    records = 0
+    for i, minute in _minutes(hours, now):
+        start_ms = int(minute.timestamp() * 1000)
+        blocks = []
+        batch = []
+        for flow in shape.flows(i, start_ms):
+            batch.append(_v3_record(*flow))
+            if len(batch) == RECORDS_PER_BLOCK:
+                blocks.append(batch)
+                batch = []
+        if batch:
+            blocks.append(batch)
+        with open(os.path.join(directory, f"nfcapd.{minute:%Y%m%d%H%M}"), "wb") as f:
+            f.write(FILE_HEADER_V2.pack(MAGIC, LAYOUT_VERSION_2, 9, int(time.time()), NOT_COMPRESSED, 0, 0, 0, 0, 0, len(blocks)))
+            for batch in blocks:
+                data = b"".join(batch)
+                f.write(BLOCK_HEADER.pack(len(batch), len(data), DATA_BLOCK_TYPE_3, 0) + data)
+                records += len(batch)
+    return records
+
+
+def write_journal(path, shape: Shape, hours, now=None) -> int:
+    now = now or datetime.now(timezone.utc)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    records = 0
+    with open(path, "w") as f:
+        for _, minute in _minutes(hours, now):
+            for ts_us, message in shape.journal(int(minute.timestamp() * 1_000_000)):
+                f.write(json.dumps({
+                    "__CURSOR": f"s=bench;i={records:x}",
+                    "__REALTIME_TIMESTAMP": str(ts_us),
+                    "_SOURCE_REALTIME_TIMESTAMP": str(ts_us),
+                    "_COMM": "sshd",
+                    "SYSLOG_IDENTIFIER": "sshd",
+                    "PRIORITY": "6",
+                    "MESSAGE": message,
+                }) + "\n")
+                records += 1
+    return records
+
+
+def generate(directory, *, hours=1, **shape_options) -> dict:
+    """
+    write the three fixtures under `directory`, returns their record counts
+    """
+    counts = {}
+    counts["pmacct"] = write_pmacct(os.path.join(directory, "pmacct"), Shape(**shape_options), hours)
+    counts["softflowd"] = write_nfcapd(os.path.join(directory, "softflowd"), Shape(**shape_options), hours)
+    counts["journalctl"] = write_journal(os.path.join(directory, "journal.json"), Shape(**shape_options), hours)
+    return counts
+
+
+def add_shape_arguments(parser):
+    parser.add_argument("--hours", type=int, default=1, help="window length of the generated data")
+    parser.add_argument("--rate", type=int, default=2000, help="background flow records per minute")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--scanners", type=int, default=2)
+    parser.add_argument("--scan-ports", type=int, default=200, help="ports probed per minute by each scanner")
+    parser.add_argument("--attackers", type=int, default=3)
+    parser.add_argument("--bruteforce-attempts", type=int, default=30, help="SSH attempts per minute by each attacker")
+    parser.add_argument("--host-ip", default="10.10.1.2")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def shape_options(args) -> dict:
+    return {
+        "host_ip": args.host_ip, "rate": args.rate, "clients": args.clients,
+        "scanners": args.scanners, "scan_ports": args.scan_ports,
+        "attackers": args.attackers, "bruteforce_attempts": args.bruteforce_attempts, "seed": args.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic pmacct, nfcapd and journal data")
+    parser.add_argument("directory")
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+    counts = generate(args.directory, hours=args.hours, **shape_options(args))
+    print(json.dumps(counts))
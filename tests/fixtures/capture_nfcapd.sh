@@ -0,0 +1,31 @@
+#!/bin/sh
+# Capture an nfcapd fixture with the installed softflowd and nfcapd/nfdump:
+# replays <pcap> through softflowd into nfcapd and writes the closed file to
+# tests/fixtures/captured/<name>, and nfdump's json of it to <name>.json
+# (t_first in UTC), which tests/test_nfcapd.py compares the reader with.
+#
+# Usage: sh tests/fixtures/capture_nfcapd.sh <pcap> <name>, e.g.
+#   sh tests/fixtures/capture_nfcapd.sh small.pcap nfcapd-1.6.23   (Ubuntu 22.04's nfdump)
+#   sh tests/fixtures/capture_nfcapd.sh small.pcap nfcapd-1.7.4    (Ubuntu 24.04's nfdump)
+
+set -e
+
+PCAP=$1
+NAME=$2
+PORT=${PORT:-9995}
+OUT=$(cd "$(dirname "$0")" && pwd)/captured
+WORK=$(mktemp -d)
+
+nfcapd -l "$WORK" -p "$PORT" -t 3600 &
+NFCAPD=$!
+sleep 1
+softflowd -r "$PCAP" -n "127.0.0.1:$PORT" -v 9
+sleep 2
+# nfcapd closes (and renames) its file on exit
+kill -TERM $NFCAPD
+wait $NFCAPD || true
+
+mkdir -p "$OUT"
+cp "$(ls "$WORK"/nfcapd.2* | head -n 1)" "$OUT/$NAME"
+TZ=UTC nfdump -r "$OUT/$NAME" -o json > "$OUT/$NAME.json"
+rm -rf "$WORK"
@@ -0,0 +1,128 @@
+"""
+Writes the synthetic nfcapd fixtures of tests/test_nfcapd.py, one per layout:
+- nfcapd.v1: LAYOUT_VERSION_1 (nfdump 1.6), an extension map and common records
+- nfcapd.v2: LAYOUT_VERSION_2 (nfdump 1.7), V3 records
+
+The byte layouts are transcribed here from nfdump's headers (nffile.h of
+1.6, nffileV2.h and nfxV3.h of 1.7) rather than taken from driver.nfcapd, so
+that a mistake in the reader's layouts is not repeated in its fixtures. The
+records nfdump's `-o json` gives for them are kept by hand next to each
+(nfcapd.v1.json, nfcapd.v2.json), t_first in UTC; files captured from real
+nfcapd builds go to tests/fixtures/captured (see capture_nfcapd.sh).
+
+Usage: python tests/fixtures/make_nfcapd.py
+"""
+
+import os
+import socket
+import struct
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+MAGIC = 0xA50C
+
+# nffile.h (1.6): file_header_t {magic, version, flags, NumBlocks, ident[128]},
+# then stat_record_t (136 bytes)
+FILE_HEADER_V1 = "<HHII128s"
+STAT_RECORD_V1 = 136
+# data_block_header_t {NumRecords, size, id, flags}
+BLOCK_HEADER = "<IIHH"
+# extension_map_t {type, size, map_id, extension_size, ex_id[]}
+EXTENSION_MAP = "<HHHH"
+# common_record_t {type, size, flags, ext_map, msec_first, msec_last, first, last,
+# fwd_status, tcp_flags, prot, tos, srcport, dstport, exporter_sysid, biFlowDir, flowEndReason}
+COMMON_RECORD = "<HHHHHHIIBBBBHHHBB"
+
+# nffileV2.h (1.7): fileHeaderV2_t {magic, version, nfdversion, created, compression,
+# encryption, appendixBlocks, unused, offAppendix, BlockSize, NumBlocks}
+FILE_HEADER_V2 = "<HHIqBBHIqII"
+# nfxV3.h: recordHeaderV3_t {type, size, numElements, engineType, engineID, align,
+# exporterID, flags, nfversion}, elementHeader_t {type, length}
+V3_RECORD_HEADER = "<HHBBBBHBB"
+ELEMENT_HEADER = "<HH"
+# EXgenericFlow_t {msecFirst, msecLast, msecReceived, inPackets, inBytes, srcPort,
+# dstPort, proto, tcpFlags, fwdStatus, srcTos}
+EX_GENERIC_FLOW = "<QQQQQHHBBBB"
+EX_IPV4_FLOW = "<II"
+EX_IPV6_FLOW = "<QQQQ"
+
+# (src, dst, src_port, dst_port, proto, packets, bytes, msec_first), as in the .json files
+FLOWS = [
+    ("192.0.2.10", "10.10.1.2", 51514, 22, 6, 12, 3120, 1700000000123),
+    ("198.51.100.7", "10.10.1.2", 40001, 443, 6, 1, 44, 1700000001000),
+    ("10.10.1.2", "203.0.113.5", 53, 33333, 17, 2, 180, 1700000002999),
+    # 64-bit counters in V1
+    ("203.0.113.9", "10.10.1.2", 60000, 80, 6, 5_000_000_000, 7_000_000_000, 1700000004001),
+    ("2001:db8::1", "2001:db8::2", 50000, 443, 6, 7, 900, 1700000005250),
+]
+
+
+def _v4(addr) -> int:
+    return struct.unpack(">I", socket.inet_aton(addr))[0]
+
+
+def _v6(addr) -> tuple:
+    return struct.unpack(">QQ", socket.inet_pton(socket.AF_INET6, addr))
+
+
+def _element(element_type, layout, *values) -> bytes:
+    return struct.pack(ELEMENT_HEADER, element_type, struct.calcsize(ELEMENT_HEADER) + struct.calcsize(layout)) + struct.pack(layout, *values)
+
+
+def _common_record(src, dst, sport, dport, proto, packets, bytes_, ms) -> bytes:
+    # flags: 1 IPv6 addresses, 2 64-bit packets, 4 64-bit bytes
+    flags = 0
+    if ":" in src:
+        flags |= 0x01
+        addresses = struct.pack("<QQQQ", *_v6(src), *_v6(dst))
+    else:
+        addresses = struct.pack("<II", _v4(src), _v4(dst))
+    if packets > 0xFFFFFFFF:
+        flags |= 0x02
+    if bytes_ > 0xFFFFFFFF:
+        flags |= 0x04
+    counters = struct.pack("<Q" if flags & 0x02 else "<I", packets)
+    counters += struct.pack("<Q" if flags & 0x04 else "<I", bytes_)
+    size = struct.calcsize(COMMON_RECORD) + len(addresses) + len(counters)
+    # type 10: CommonRecordType
+    return struct.pack(
+        COMMON_RECORD, 10, size, flags, 0, ms % 1000, ms % 1000, ms // 1000, ms // 1000 + 1,
+        0, 0, proto, 0, sport, dport, 0, 0, 0,
+    ) + addresses + counters
+
+
+def write_v1(path):
+    # type 2: ExtensionMapType, map 0 without optional extensions
+    ext_map = struct.pack(EXTENSION_MAP, 2, 12, 0, 4) + struct.pack("<HH", 0, 0)
+    records = [ext_map] + [_common_record(*flow) for flow in FLOWS]
+    data = b"".join(records)
+    with open(path, "wb") as f:
+        f.write(struct.pack(FILE_HEADER_V1, MAGIC, 1, 0, 1, b"fixture"))
+        f.write(b"\0" * STAT_RECORD_V1)
+        # block type 2: DATA_BLOCK_TYPE_2
+        f.write(struct.pack(BLOCK_HEADER, len(records), len(data), 2, 0) + data)
+
+
+def _v3_record(src, dst, sport, dport, proto, packets, bytes_, ms) -> bytes:
+    # element 1: EXgenericFlow, 2: EXipv4Flow, 3: EXipv6Flow
+    body = _element(1, EX_GENERIC_FLOW, ms, ms + 1000, ms + 1000, packets, bytes_, sport, dport, proto, 0, 0, 0)
+    if ":" in src:
+        body += _element(3, EX_IPV6_FLOW, *_v6(src), *_v6(dst))
+    else:
+        body += _element(2, EX_IPV4_FLOW, _v4(src), _v4(dst))
+    # type 11: V3Record, netflow version 9
+    return struct.pack(V3_RECORD_HEADER, 11, struct.calcsize(V3_RECORD_HEADER) + len(body), 2, 0, 0, 0, 0, 0, 9) + body
+
+
+def write_v2(path):
+    records = [_v3_record(*flow) for flow in FLOWS]
+    data = b"".join(records)
+    with open(path, "wb") as f:
+        f.write(struct.pack(FILE_HEADER_V2, MAGIC, 2, 0x01070000, 1700000000, 0, 0, 0, 0, 0, 0, 1))
+        # block type 3: DATA_BLOCK_TYPE_3
+        f.write(struct.pack(BLOCK_HEADER, len(records), len(data), 3, 0) + data)
+
+
+if __name__ == "__main__":
+    write_v1(os.path.join(DIRECTORY, "nfcapd.v1"))
+    write_v2(os.path.join(DIRECTORY, "nfcapd.v2"))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the snort command line SnortPool runs: reads the pcap given with
+-r as a stream, in batches of 64 packets like the DAQ, and prints alert_json
+lines with the fields `seconds timestamp sid src_addr dst_addr dst_port pid`:
+- sid 1 for every IPv4 TCP packet to port 23
+- sid 2 once a source reached 5 ports of one host within 60 seconds, a
+  port_scan of sorts
+- the sid of the --rule option for UDP packets whose payload is its content
+
+Usage: tests/fixtures/stand_in_snort.py ... -r <pcap> [--rule <rule>]
+"""
+
+import json
+import os
+import re
+import socket
+import struct
+import sys
+import time
+
+BATCH = 64
+SCAN_PORTS = 5
+SCAN_WINDOW = 60
+
+
+def main(argv):
+    path = argv[argv.index("-r") + 1]
+    marker_sid, marker_content = None, None
+    if "--rule" in argv:
+        rule = argv[argv.index("--rule") + 1]
+        marker_sid = int(re.search(r"sid:(\d+)", rule).group(1))
+        marker_content = re.search(r'content:"([^"]*)"', rule).group(1).encode()
+    scans = {}
+
+    def alert(sec, usec, sid, src, dst, dst_port):
+        stamp = time.strftime("%m/%d-%H:%M:%S", time.localtime(sec)) + f".{usec:06d}"
+        print(json.dumps({
+            "seconds": sec, "timestamp": stamp, "sid": sid, "src_addr": socket.inet_ntoa(src),
+            "dst_addr": socket.inet_ntoa(dst), "dst_port": dst_port, "pid": os.getpid(),
+        }))
+
+    def inspect(sec, usec, frame):
+        if frame[12:14] != b"\x08\x00":
+            return
+        proto, src, dst = frame[23], frame[26:30], frame[30:34]
+        ports = 14 + (frame[14] & 0x0F) * 4
+        dst_port = struct.unpack("!H", frame[ports + 2:ports + 4])[0]
+        if proto == 17 and marker_content is not None and frame[ports + 8:] == marker_content:
+            alert(sec, usec, marker_sid, src, dst, dst_port)
+        if proto != 6:
+            return
+        if dst_port == 23:
+            alert(sec, usec, 1, src, dst, dst_port)
+        seen = scans.setdefault((src, dst), {})
+        seen[dst_port] = sec
+        for port, last in list(seen.items()):
+            if last < sec - SCAN_WINDOW:
+                del seen[port]
+        if len(seen) >= SCAN_PORTS:
+            alert(sec, usec, 2, src, dst, dst_port)
+            seen.clear()
+
+    with open(path, "rb") as f:
+        if len(f.read(24)) < 24:
+            return
+        batch = []
+        while True:
+            header = f.read(16)
+            if len(header) == 16:
+                sec, usec, caplen, _ = struct.unpack("<IIII", header)
+                batch.append((sec, usec, f.read(caplen)))
+            if len(batch) == BATCH or len(header) < 16:
+                for packet in batch:
+                    inspect(*packet)
+                batch = []
+                sys.stdout.flush()
+            if len(header) < 16:
+                return
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,156 @@
+"""
+ResultCache: TTL and LRU expiry, single-flight computation of identical
+queries, and what Processor.query lets it keep.
+
+Usage: python -m pytest tests
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.cache import ResultCache  # noqa: E402
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def test_hit_after_miss(self):
+        cache = ResultCache(ttl=60)
+        self.assertEqual(cache.get_or_compute("k", lambda: 1), (1, ResultCache.MISS))
+        self.assertEqual(cache.get_or_compute("k", lambda: 2), (1, ResultCache.HIT))
+
+    def test_expired_entry_is_computed_again(self):
+        cache = ResultCache(ttl=60)
+        with mock.patch("api.cache.time.monotonic", return_value=1000.0):
+            cache.get_or_compute("k", lambda: 1)
+        with mock.patch("api.cache.time.monotonic", return_value=1061.0):
+            self.assertEqual(cache.get_or_compute("k", lambda: 2), (2, ResultCache.MISS))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResultCache(ttl=60, max_entries=2)
+        cache.get_or_compute("a", lambda: "a")
+        cache.get_or_compute("b", lambda: "b")
+        cache.get_or_compute("a", lambda: "a")
+        cache.get_or_compute("c", lambda: "c")
+        self.assertEqual(cache.get_or_compute("a", lambda: None)[1], ResultCache.HIT)
+        self.assertEqual(cache.get_or_compute("b", lambda: "b")[1], ResultCache.MISS)
+
+    def test_failures_and_rejected_results_are_not_kept(self):
+        cache = ResultCache(ttl=60)
+
+        def fail():
+            raise RuntimeError("monitor failed")
+        with self.assertRaises(RuntimeError):
+            cache.get_or_compute("k", fail)
+        self.assertEqual(cache.get_or_compute("k", lambda: 1, cacheable=lambda value: value > 1), (1, ResultCache.MISS))
+        self.assertEqual(cache.get_or_compute("k", lambda: 2, cacheable=lambda value: value > 1), (2, ResultCache.MISS))
+        self.assertEqual(cache.get_or_compute("k", lambda: 3), (2, ResultCache.HIT))
+
+    def run_identical(self, count, compute):
+        cache = ResultCache(ttl=60)
+        results = [None] * count
+        errors = [None] * count
+
+        def run(i):
+            try:
+                results[i] = cache.get_or_compute("k", compute)
+            except Exception as e:
+                errors[i] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_identical_queries_share_one_computation(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            # the other queries arrive while this one computes
+            time.sleep(0.2)
+            return "result"
+        results, errors = self.run_identical(4, compute)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [None] * 4)
+        self.assertEqual(sorted(status for _, status in results), [ResultCache.COALESCED] * 3 + [ResultCache.MISS])
+        self.assertTrue(all(value == "result" for value, _ in results))
+
+    def test_failure_is_shared_with_waiting_queries(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            raise RuntimeError("nfdump failed")
+        results, errors = self.run_identical(3, compute)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(error, RuntimeError) for error in errors))
+
+    def test_key_buckets_queries_by_minute(self):
+        cache = ResultCache(ttl=60, bucket_seconds=60)
+        options = {"monitor": "pmacct", "analyzer": "snort", "hours": 1}
+        with mock.patch("api.cache.time.time", return_value=6000.0):
+            first = cache.key(options)
+        with mock.patch("api.cache.time.time", return_value=6059.0):
+            self.assertEqual(cache.key(options), first)
+        with mock.patch("api.cache.time.time", return_value=6060.0):
+            self.assertNotEqual(cache.key(options), first)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        ranged = {"monitor": "pmacct", "analyzer": "snort", "start": start, "end": start.replace(hour=1)}
+        self.assertNotEqual(cache.key(ranged), cache.key({**ranged, "end": start.replace(hour=2)}))
+
+    def test_implicit_end_is_not_keyed(self):
+        cache = ResultCache(ttl=60, bucket_seconds=60)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        options = {"monitor": "pmacct", "analyzer": "snort", "start": start, "open_end": True}
+        with mock.patch("api.cache.time.time", return_value=6000.0):
+            first = cache.key({**options, "end": datetime(2025, 1, 1, 1, 0, 0, 1000, tzinfo=timezone.utc)})
+            self.assertEqual(cache.key({**options, "end": datetime(2025, 1, 1, 1, 0, 30, 5000, tzinfo=timezone.utc)}), first)
+        with mock.patch("api.cache.time.time", return_value=6060.0):
+            self.assertNotEqual(cache.key({**options, "end": datetime(2025, 1, 1, 1, 1, tzinfo=timezone.utc)}), first)
+
+
+class ProcessorCacheTest(unittest.TestCase):
+    """
+    Processor.query keeps successful results only
+    """
+
+    def setUp(self):
+        from processor import Processor
+        from api.analyzer import AnalyzerManager
+        from api.monitor import MonitorManager
+        self.monitor_manager = MonitorManager()
+        self.analyzer_manager = AnalyzerManager()
+        self.processor = Processor(self.monitor_manager, self.analyzer_manager, {"result_cache_ttl": "60"})
+        self.addCleanup(self.processor.fanout_pool.shutdown)
+
+    def test_only_successful_results_are_cached(self):
+        options = {"monitor": "pmacct", "analyzer": "snort", "hours": 1}
+        # pmacct is not registered: 400
+        self.assertEqual(self.processor.query(options)[1], "MISS")
+        self.assertEqual(self.processor.query(options)[1], "MISS")
+        with mock.patch.object(self.processor, "process", return_value=object()), \
+                mock.patch.object(self.processor, "analyze", return_value={"is_attack": False}):
+            self.assertEqual(self.processor.query(options), ((200, {"is_attack": False}), "MISS"))
+            self.assertEqual(self.processor.query(options), ((200, {"is_attack": False}), "HIT"))
+
+    def test_incomplete_fan_out_is_not_cached(self):
+        options = {"monitor": "pmacct", "analyzer": "all", "hours": 1}
+        incomplete = {"is_attack": False, "complete": False, "analyzers": {}}
+        with mock.patch.object(self.processor, "process", return_value=object()), \
+                mock.patch.object(self.processor, "analyze", return_value=incomplete):
+            self.assertEqual(self.processor.query(options)[1], "MISS")
+            self.assertEqual(self.processor.query(options)[1], "MISS")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+RuleSet: the rules of analyzer/journal_rules.ini on journal messages, the
+literal prefilter with overlapping and prefix literals, and rules files that
+do not load.
+
+Usage: python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analyzer.journal_rules import RuleError, RuleSet  # noqa: E402
+from analyzer.simple_journal_analyzer import DEFAULT_RULES  # noqa: E402
+
+MESSAGES = [
+    "Failed password for root from 203.0.113.5 port 52311 ssh2",
+    "Failed password for invalid user admin from 203.0.113.6 port 40022 ssh2",
+    "Invalid user admin from 203.0.113.6 port 40022",
+    "Accepted publickey for alice from 192.0.2.10 port 50000 ssh2",
+    "pam_unix(sshd:auth): authentication failure; logname= uid=0 euid=0 tty=ssh ruser= rhost=203.0.113.5  user=root",
+    "bob : 3 incorrect password attempts ; TTY=pts/0 ; PWD=/home/bob ; USER=root ; COMMAND=/bin/sh",
+    "Unable to negotiate with 198.51.100.7 port 41000: no matching key exchange method found.",
+]
+
+
+def entries(*messages):
+    return [{"MESSAGE": message} for message in messages]
+
+
+class RuleSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = RuleSet.from_file(DEFAULT_RULES)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def write_rules(self, text) -> str:
+        path = os.path.join(self.tmp_dir, "rules.ini")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_default_rules(self):
+        rule_counts, ip_counts, user_counts = self.rules.scan(entries(*MESSAGES))
+        self.assertEqual(rule_counts, Counter({
+            "failed_password": 2, "invalid_user": 2, "pam_auth_failure": 1,
+            "sudo_incorrect_password": 1, "ssh_negotiation_failure": 1,
+        }))
+        # "Failed password for invalid user" is matched by two rules, and
+        # counts once for its ip and user
+        self.assertEqual(ip_counts, Counter({"203.0.113.5": 2, "203.0.113.6": 2, "198.51.100.7": 1}))
+        self.assertEqual(user_counts, Counter({"root": 2, "admin": 2, "bob": 1}))
+
+    def test_min_count(self):
+        negotiation = "Unable to negotiate with 198.51.100.7 port 41000: no matching host key type found."
+        rule_counts, _, _ = self.rules.scan(entries(*[negotiation] * 4))
+        self.assertNotIn("ssh_negotiation_failure", self.rules.triggered(rule_counts))
+        rule_counts, _, _ = self.rules.scan(entries(*[negotiation] * 5))
+        self.assertEqual(self.rules.triggered(rule_counts), ["ssh_negotiation_failure"])
+
+    def test_messages_are_matched_case_insensitively(self):
+        rule_counts, _, _ = self.rules.scan(entries("FAILED PASSWORD FOR root FROM 203.0.113.5 port 1 ssh2"))
+        self.assertEqual(rule_counts, Counter({"failed_password": 1}))
+
+    def test_binary_and_missing_messages_are_skipped(self):
+        scanned = self.rules.scan([{"MESSAGE": [70, 97, 105, 108]}, {"MESSAGE": None}, {}, *entries(MESSAGES[0])])
+        self.assertEqual(scanned[0], Counter({"failed_password": 1}))
+
+    def test_prefix_and_overlapping_literals(self):
+        rules = RuleSet.from_file(self.write_rules(
+            "[short]\nliteral = fail\npattern = fail(?P<user>\\w*)\n"
+            "[long]\nliteral = failed login\npattern = failed login from (?P<ip>\\S+)\n"
+            "[overlap]\nliteral = login from\npattern = login from (?P<ip>\\S+)\n"
+        ))
+        # "failed login" is the longest literal at its position and stands for
+        # its prefix "fail"; "login from" starts inside it
+        rule_counts, ip_counts, _ = rules.scan(entries("failed login from 192.0.2.1", "fail2ban started"))
+        self.assertEqual(rule_counts, Counter({"short": 2, "long": 1, "overlap": 1}))
+        self.assertEqual(ip_counts, Counter({"192.0.2.1": 1}))
+
+    def test_counts_round_trip(self):
+        scanned = self.rules.scan(entries(*MESSAGES))
+        counts = self.rules.counts(entries(*MESSAGES))
+        self.assertEqual(counts[("rule", "failed_password")], 2)
+        self.assertEqual(RuleSet.split(counts), scanned)
+
+    def test_empty_rule_set(self):
+        self.assertEqual(RuleSet([]).scan(entries(*MESSAGES)), (Counter(), Counter(), Counter()))
+
+    def test_bad_rules_files(self):
+        with self.assertRaisesRegex(RuleError, "not found"):
+            RuleSet.from_file(os.path.join(self.tmp_dir, "missing.ini"))
+        with self.assertRaisesRegex(RuleError, "no literal"):
+            RuleSet.from_file(self.write_rules("[rule]\npattern = x\n"))
+        with self.assertRaisesRegex(RuleError, "bad pattern"):
+            RuleSet.from_file(self.write_rules("[rule]\nliteral = x\n"))
+        with self.assertRaisesRegex(RuleError, "bad pattern"):
+            RuleSet.from_file(self.write_rules("[rule]\nliteral = x\npattern = (x\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Stage timings: `timed` counts the time spent producing the items of an
+iterator, not the time its consumer spends between them.
+
+Usage: python -m pytest tests
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api import metrics  # noqa: E402
+
+
+def producer(closed, delay=0.02, count=3):
+    try:
+        for i in range(count):
+            time.sleep(delay)
+            yield i
+    finally:
+        closed.append(True)
+
+
+class TimedTest(unittest.TestCase):
+
+    def test_consumer_time_is_left_out(self):
+        closed = []
+        with metrics.request_timings() as timings:
+            for _ in metrics.timed("decode", producer(closed)):
+                time.sleep(0.1)
+        self.assertEqual([name for name, _ in timings], ["decode"])
+        self.assertGreaterEqual(timings[0][1], 0.06)
+        self.assertLess(timings[0][1], 0.2)
+        self.assertEqual(closed, [True])
+
+    def test_early_stop_closes_the_producer(self):
+        closed = []
+        with metrics.request_timings() as timings:
+            items = metrics.timed("decode", producer(closed))
+            self.assertEqual(next(items), 0)
+            items.close()
+        self.assertEqual(closed, [True])
+        self.assertEqual(len(timings), 1)
+
+    def test_producer_errors_are_raised(self):
+        def failing():
+            yield 1
+            raise OSError("nfdump failed")
+        with metrics.request_timings() as timings:
+            with self.assertRaises(OSError):
+                list(metrics.timed("decode", failing()))
+        self.assertEqual(len(timings), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+MonitorPmacct called from several request threads at once: the aggregates
+of concurrent requests, through the shared ingestion cache, rollups and
+detection window, against the same requests run one after another.
+
+Usage: python -m pytest tests
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.monitor import MonitorPmacct, get_default_filter  # noqa: E402
+from driver.window import FlowWindow  # noqa: E402
+
+THREADS = 8
+HOST_IP = "10.10.1.2"
+# two and a half hours of minute files, 10:30 to 12:59 UTC
+NOW = datetime(2025, 1, 1, 13, 0, 30, tzinfo=timezone.utc)
+FIRST_MINUTE = datetime(2025, 1, 1, 10, 30, tzinfo=timezone.utc)
+MINUTES = 150
+
+FILTER = get_default_filter()["pmacct"]
+QUERIES = [
+    ({"hours": 1}, FILTER),
+    ({"hours": 2}, FILTER),
+    ({"hours": 2}, set()),
+    ({"hours": 1}, {"tcp_only"}),
+    ({"start": datetime(2025, 1, 1, 10, 45, 20, tzinfo=timezone.utc), "end": datetime(2025, 1, 1, 12, 30, 40, tzinfo=timezone.utc)}, FILTER),
+]
+
+
+def write_minute(data_dir, minute, rnd):
+    t = FIRST_MINUTE + timedelta(minutes=minute)
+    fp = os.path.join(data_dir, t.strftime("traffic_%Y%m%d_%H%M.json"))
+    with open(fp, "w", encoding="utf-8") as f:
+        for _ in range(40):
+            f.write(json.dumps({
+                "event_type": "purge",
+                "ip_src": rnd.choice([f"192.0.2.{i}" for i in range(30)] + [HOST_IP]),
+                "ip_dst": HOST_IP,
+                "port_src": rnd.randrange(1024, 65536),
+                "port_dst": rnd.choice([22, 80, 443, rnd.randrange(1, 65536)]),
+                "ip_proto": rnd.choice(["tcp", "tcp", "udp"]),
+                "packets": rnd.randrange(1, 50),
+                "bytes": 60,
+                "timestamp_start": (t + timedelta(seconds=rnd.randrange(60))).strftime("%Y-%m-%d %H:%M:%S.000000"),
+            }) + "\n")
+
+
+class MonitorConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        rnd = random.Random(0)
+        for minute in range(MINUTES):
+            write_minute(self.data_dir, minute, rnd)
+
+    def monitor(self) -> MonitorPmacct:
+        monitor = MonitorPmacct({"data_dir": self.data_dir, "ip": HOST_IP})
+        monitor.driver.now = lambda: NOW
+        return monitor
+
+    def serial(self) -> list:
+        monitor = self.monitor()
+        return [monitor.preprocess(options, data_filter) for options, data_filter in QUERIES]
+
+    def run_concurrently(self, monitor, calls) -> list:
+        barrier = threading.Barrier(len(calls))
+        results = [None] * len(calls)
+        errors = []
+
+        def run(i):
+            barrier.wait()
+            try:
+                results[i] = calls[i]()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(calls))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def query(self, monitor, i):
+        options, data_filter = QUERIES[i % len(QUERIES)]
+        return lambda: monitor.preprocess(options, data_filter)
+
+    def test_concurrent_requests_match_serial_requests(self):
+        expected = self.serial()
+        for _ in range(3):
+            monitor = self.monitor()
+            results = self.run_concurrently(monitor, [self.query(monitor, i) for i in range(THREADS * 2)])
+            for i, result in enumerate(results):
+                self.assertEqual(result, expected[i % len(QUERIES)])
+
+    def test_concurrent_window_advances_count_each_minute_once(self):
+        expected = self.serial()[0]
+        for _ in range(3):
+            monitor = self.monitor()
+            window = FlowWindow(monitor.driver, monitor.rollup.partials, (1, 2), tcp_only=True, exclude_src=HOST_IP)
+            self.run_concurrently(monitor, [lambda: window.advance(NOW)] * 4 + [self.query(monitor, i) for i in range(THREADS)])
+            monitor.window = window
+            self.assertTrue(window.covers(1, tcp_only=True, exclude_src=HOST_IP))
+            self.assertEqual(monitor.preprocess({"hours": 1}, FILTER), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
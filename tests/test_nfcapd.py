@@ -0,0 +1,129 @@
+"""
+NfcapdReader against the records nfdump gives for the synthetic fixtures in
+tests/fixtures (see make_nfcapd.py) and for the files captured from real
+nfcapd builds in tests/fixtures/captured (see capture_nfcapd.sh), and the
+softflowd driver's fallback from the native reader to nfdump.
+
+Usage: python -m pytest tests
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from driver.nfcapd import NfcapdError, NfcapdReader  # noqa: E402
+from driver.softflowd import KEEP_FIELDS, DriverSoftflowd  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CAPTURED = os.path.join(FIXTURES, "captured")
+LAYOUTS = ("nfcapd.v1", "nfcapd.v2")
+# nfdump's json keys compared, IPv6 flows have src6_addr/dst6_addr instead
+COMPARED = KEEP_FIELDS + ("src6_addr", "dst6_addr")
+
+
+def setUpModule():
+    # t_first is in local time, the expected records are in UTC
+    global _tz
+    _tz = os.environ.get("TZ")
+    os.environ["TZ"] = "UTC"
+    time.tzset()
+
+
+def tearDownModule():
+    if _tz is None:
+        os.environ.pop("TZ", None)
+    else:
+        os.environ["TZ"] = _tz
+    time.tzset()
+
+
+def _expected(name, directory=FIXTURES) -> list[dict]:
+    with open(os.path.join(directory, name + ".json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _captured() -> list[str]:
+    if not os.path.isdir(CAPTURED):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(CAPTURED) if name.endswith(".json"))
+
+
+class NfcapdReaderTest(unittest.TestCase):
+
+    def test_records_match_nfdump_json(self):
+        for name in LAYOUTS:
+            with self.subTest(name):
+                self.assertEqual(list(NfcapdReader(os.path.join(FIXTURES, name))), _expected(name))
+
+    @unittest.skipIf(shutil.which("nfdump") is None, "nfdump is not installed")
+    def test_records_match_nfdump(self):
+        for name in LAYOUTS:
+            with self.subTest(name):
+                fp = os.path.join(FIXTURES, name)
+                output = subprocess.run(["nfdump", "-r", fp, "-o", "json"], capture_output=True, text=True, check=True).stdout
+                records = [{k: record[k] for k in COMPARED if k in record} for record in json.loads(output)]
+                self.assertEqual(list(NfcapdReader(fp)), records)
+
+    @unittest.skipIf(not _captured(), "no captured nfcapd files, see tests/fixtures/capture_nfcapd.sh")
+    def test_captured_files_match_nfdump_json(self):
+        for name in _captured():
+            with self.subTest(name):
+                records = list(NfcapdReader(os.path.join(CAPTURED, name)))
+                expected = _expected(name, CAPTURED)
+                self.assertEqual(len(records), len(expected))
+                for record, nfdump in zip(records, expected):
+                    keys = [k for k in COMPARED if k in nfdump]
+                    self.assertEqual({k: record.get(k) for k in keys}, {k: nfdump[k] for k in keys})
+
+    def test_batches_match_records(self):
+        for name in LAYOUTS:
+            with self.subTest(name):
+                reader = NfcapdReader(os.path.join(FIXTURES, name))
+                records = [record for record in _expected(name) if "src4_addr" in record]
+                batches = list(reader.iter_batches(2, ipv4_only=True))
+                self.assertEqual([len(batch) for batch in batches], [2, 2])
+                self.assertEqual(sum(int(batch.packets.sum()) for batch in batches), sum(r["in_packets"] for r in records))
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(NfcapdError):
+            NfcapdReader(os.path.join(FIXTURES, "nfcapd.v1.json"))
+
+
+class NativeFallbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver = DriverSoftflowd(data_dir=FIXTURES, backend="native")
+
+    def test_rejected_file_falls_back(self):
+        fp = os.path.join(FIXTURES, "nfcapd.v1.json")
+        native = lambda: self.driver._iter_native(NfcapdReader(fp))
+        records = list(self.driver._native_or_nfdump(fp, native, lambda: iter([{"from": "nfdump"}])))
+        self.assertEqual(records, [{"from": "nfdump"}])
+
+    def test_failure_during_iteration_falls_back(self):
+        def native():
+            raise NfcapdError("corrupt bz2 block")
+            yield
+        records = list(self.driver._native_or_nfdump("f", native, lambda: iter([1, 2])))
+        self.assertEqual(records, [1, 2])
+
+    def test_failure_after_records_skips_the_rest(self):
+        def native():
+            yield 1
+            raise NfcapdError("corrupt bz2 block")
+        records = list(self.driver._native_or_nfdump("f", native, lambda: iter([1, 2])))
+        self.assertEqual(records, [1])
+
+    def test_native_backend_reads_fixture(self):
+        records = list(self.driver.iter_data_from_file(os.path.join(FIXTURES, "nfcapd.v2")))
+        self.assertEqual(records, [record for record in _expected("nfcapd.v2") if "src4_addr" in record])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+The columnar pmacct aggregation against the record-based one it replaced,
+and PmacctIngestCache: tail ingestion of growing files, and concurrent
+callers reading the same file.
+
+Usage: python -m pytest tests
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from driver import pmacct  # noqa: E402
+from driver.flow import FlowAggregate  # noqa: E402
+from driver.pmacct import DriverPmacct, PmacctIngestCache  # noqa: E402
+
+THREADS = 4
+HOST_IP = "10.10.1.2"
+
+
+def write_records(fp, start, count):
+    with open(fp, "a", encoding="utf-8") as f:
+        for i in range(start, start + count):
+            f.write(json.dumps({
+                "event_type": "purge", "ip_src": f"192.0.2.{i % 50}", "ip_dst": "10.10.1.2",
+                "port_src": 40000 + i % 7, "port_dst": i % 1000, "ip_proto": "tcp", "packets": 1, "bytes": 60,
+                "timestamp_start": "2025-01-01 00:00:00.000000",
+            }) + "\n")
+
+
+def random_records(seed, count) -> list[dict]:
+    rnd = random.Random(seed)
+    sources = [f"192.0.2.{i}" for i in range(20)] + ["2001:db8::1", "2001:db8::a:2", HOST_IP]
+    records = []
+    for _ in range(count):
+        record = {
+            "event_type": "purge",
+            "ip_src": rnd.choice(sources),
+            "ip_dst": rnd.choice([HOST_IP, "198.51.100.3", "2001:db8::ff", "n/a"]),
+            "port_src": rnd.randrange(1024, 65536),
+            "ip_proto": rnd.choice(["tcp", "tcp", "udp", "icmp", "TCP", "6", 6]),
+            "packets": rnd.randrange(1, 100),
+            "bytes": rnd.randrange(40, 10000),
+            "timestamp_start": "2025-01-01 00:00:00.000000",
+        }
+        port = rnd.random()
+        if port < 0.1:
+            pass  # no port_dst
+        elif port < 0.2:
+            record["port_dst"] = 0
+        else:
+            record["port_dst"] = rnd.choice([22, 80, 443, 8080]) if port < 0.6 else rnd.randrange(1, 65536)
+        if rnd.random() < 0.05:
+            del record["ip_src"]
+        if rnd.random() < 0.05:
+            del record["ip_proto"]
+        records.append(record)
+    return records
+
+
+def record_summary(records, ip, data_filter) -> list[dict]:
+    """
+    the record-based aggregation of MonitorPmacct.preprocess before the columnar batches
+    """
+    tcp_only = "tcp_only" in data_filter
+    traffic_in_only = "traffic_in_only" in data_filter
+    aggregation = {}
+    for record in records:
+        if tcp_only and record.get("ip_proto") != "tcp":
+            continue
+        if traffic_in_only and record.get("ip_src") == ip:
+            continue
+        aggregation_key = record.get("ip_src", None)
+        if aggregation_key:
+            if aggregation_key not in aggregation:
+                aggregation[aggregation_key] = [0, []]  # packets, ports
+            aggregation[aggregation_key][0] += record.get("packets", 0)
+            aggregation[aggregation_key][1].append(record.get("port_dst"))
+    return [
+        {"ip_src": ip_src, "total_packets": packets, "dst_ports": list(set(ports))}
+        for ip_src, (packets, ports) in aggregation.items()
+    ]
+
+
+def total_packets(partial) -> int:
+    return sum(packets for packets, _ in partial.sources.values())
+
+
+class PmacctAggregationTest(unittest.TestCase):
+
+    FILTERS = (set(), {"tcp_only"}, {"traffic_in_only"}, {"tcp_only", "traffic_in_only"})
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.driver = DriverPmacct(data_dir=self.data_dir)
+        self.files = []
+        self.records = []
+        for minute in range(3):
+            records = random_records(minute, 400)
+            fp = os.path.join(self.data_dir, f"traffic_20250101_000{minute}.json")
+            with open(fp, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+            self.files.append(fp)
+            self.records += records
+
+    def test_summary_matches_record_aggregation(self):
+        for data_filter in self.FILTERS:
+            for batch_size in (pmacct.BATCH_SIZE, 7):
+                with self.subTest(data_filter=data_filter, batch_size=batch_size), \
+                        mock.patch.object(pmacct, "BATCH_SIZE", batch_size):
+                    filters = {"tcp_only": "tcp_only" in data_filter,
+                               "exclude_src": HOST_IP if "traffic_in_only" in data_filter else None}
+                    expected = record_summary(self.records, HOST_IP, data_filter)
+                    self.assertEqual(self.driver.aggregate_files(self.files, **filters).to_summary(), expected)
+                    cache = PmacctIngestCache(self.driver)
+                    self.assertEqual(cache.aggregate(self.files, **filters).to_summary(), expected)
+
+    def test_sources_that_are_not_addresses_are_dropped(self):
+        records = [{"ip_src": "unknown", "port_dst": 22, "packets": 1}, {"ip_src": "192.0.2.1", "port_dst": 22, "packets": 1}]
+        summary = FlowAggregate.from_batches(self.driver.iter_batches(records)).to_summary()
+        self.assertEqual([entry["ip_src"] for entry in summary], ["192.0.2.1"])
+
+
+class PmacctIngestCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.fp = os.path.join(self.data_dir, "traffic_20250101_0000.json")
+        self.cache = PmacctIngestCache(DriverPmacct(data_dir=self.data_dir))
+
+    def test_reads_only_the_appended_tail(self):
+        write_records(self.fp, 0, 100)
+        first = self.cache.get_partial(self.fp)
+        self.assertEqual(total_packets(first), 100)
+        write_records(self.fp, 100, 50)
+        second = self.cache.get_partial(self.fp)
+        self.assertEqual(total_packets(second), 150)
+        # a partial handed out is not modified afterwards
+        self.assertEqual(total_packets(first), 100)
+        self.assertIs(self.cache.get_partial(self.fp), second)
+
+    def test_truncated_file_is_read_again(self):
+        write_records(self.fp, 0, 100)
+        self.cache.get_partial(self.fp)
+        os.truncate(self.fp, 0)
+        write_records(self.fp, 0, 10)
+        self.assertEqual(total_packets(self.cache.get_partial(self.fp)), 10)
+
+    def test_concurrent_tail_reads_count_each_line_once(self):
+        for _ in range(10):
+            with self.subTest():
+                open(self.fp, "w").close()
+                cache = PmacctIngestCache(DriverPmacct(data_dir=self.data_dir))
+                write_records(self.fp, 0, 1000)
+                cache.get_partial(self.fp)
+                write_records(self.fp, 1000, 1000)
+
+                barrier = threading.Barrier(THREADS)
+                results = [None] * THREADS
+
+                def read(i):
+                    barrier.wait()
+                    results[i] = cache.get_partial(self.fp)
+
+                threads = [threading.Thread(target=read, args=(i,)) for i in range(THREADS)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                self.assertEqual([total_packets(result) for result in results], [2000] * THREADS)
+                self.assertEqual(total_packets(cache.get_partial(self.fp)), 2000)
+
+
+if __name__ == "__main__":
+    unittest.main()
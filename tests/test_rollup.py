@@ -0,0 +1,177 @@
+"""
+FlowRollup: query planning over hour and minute rollups, the cached
+rollups, and the single-flight loading of a rollup several queries need.
+
+Usage: python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from driver.flow import FlowAggregate  # noqa: E402
+from driver.rollup import FlowRollup, plan_rollups  # noqa: E402
+
+# two closed hours of minute files, 10:00 to 11:59
+NOW = datetime(2025, 1, 1, 13, 0)
+KEYS = [f"20250101{hour:02d}{minute:02d}" for hour in (10, 11) for minute in range(60)]
+
+
+def partial_of(fp) -> FlowAggregate:
+    """
+    the partial of a minute file: one source per hour, the minute as dst port
+    """
+    key = os.path.basename(fp)
+    partial = FlowAggregate()
+    partial.add(f"192.0.2.{int(key[8:10])}", 1, int(key[10:12]))
+    return partial
+
+
+class Loaders:
+    """
+    counts the calls of the rollup's loaders, which block while `gate` is clear
+    """
+
+    def __init__(self):
+        self.minute_calls = []
+        self.hour_calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail = None
+        self._lock = threading.Lock()
+
+    def load_minutes(self, paths, **filters):
+        with self._lock:
+            self.minute_calls.append(list(paths))
+        self.gate.wait()
+        if self.fail is not None:
+            raise self.fail
+        return [partial_of(fp) for fp in paths]
+
+    def load_hour(self, paths, **filters):
+        with self._lock:
+            self.hour_calls.append(list(paths))
+        self.gate.wait()
+        if self.fail is not None:
+            raise self.fail
+        result = FlowAggregate()
+        for fp in paths:
+            result.update(partial_of(fp))
+        return result
+
+
+def merged(paths) -> list[dict]:
+    result = FlowAggregate()
+    for fp in paths:
+        result.update(partial_of(fp))
+    return result.to_summary()
+
+
+class PlanRollupsTest(unittest.TestCase):
+
+    def test_whole_closed_hours_and_minute_edges(self):
+        keyed = [(key, key) for key in KEYS]
+        plan = plan_rollups(keyed, "202501011030", "202501011159", "2025010112")
+        self.assertEqual([(kind, hour, len(paths)) for kind, hour, paths in plan], [("minute", None, 60), ("hour", "2025010111", 60)])
+        # files missing at the start of an hour do not stop it from being covered
+        plan = plan_rollups(keyed[5:], "202501011000", "202501011159", "2025010112")
+        self.assertEqual([(kind, hour) for kind, hour, _ in plan], [("hour", "2025010110"), ("hour", "2025010111")])
+
+    def test_open_hour_is_read_per_minute(self):
+        keyed = [(key, key) for key in KEYS]
+        plan = plan_rollups(keyed, "202501011000", "202501011159", "2025010111")
+        self.assertEqual([(kind, hour, len(paths)) for kind, hour, paths in plan], [("hour", "2025010110", 60), ("minute", None, 60)])
+
+
+class FlowRollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.files = []
+        for key in KEYS:
+            fp = os.path.join(self.data_dir, key)
+            with open(fp, "w") as f:
+                f.write(key)
+            self.files.append(fp)
+        self.loaders = Loaders()
+        self.rollup = FlowRollup(os.path.basename, self.loaders.load_minutes, self.loaders.load_hour)
+
+    def aggregate(self, files=None, start="202501011030", end="202501011159"):
+        files = self.files[30:] if files is None else files
+        return self.rollup.aggregate(files, start, end, NOW).to_summary()
+
+    def test_matches_merging_the_minutes(self):
+        self.assertEqual(self.aggregate(), merged(self.files[30:]))
+        self.assertEqual(self.aggregate(self.files, "202501011000"), merged(self.files))
+
+    def test_rollups_are_reused(self):
+        self.aggregate()
+        self.aggregate()
+        self.assertEqual(len(self.loaders.hour_calls), 1)
+        self.assertEqual(sum(len(paths) for paths in self.loaders.minute_calls), 30)
+
+    def test_changed_minute_file_is_read_again(self):
+        self.aggregate()
+        fp = self.files[40]
+        with open(fp, "a") as f:
+            f.write(" grown")
+        self.aggregate()
+        self.assertEqual(self.loaders.minute_calls[-1], [fp])
+
+    def test_hour_is_reloaded_when_its_files_change(self):
+        self.aggregate()
+        os.remove(self.files[-1])
+        self.assertEqual(self.aggregate(self.files[30:-1]), merged(self.files[30:-1]))
+        self.assertEqual(len(self.loaders.hour_calls), 2)
+
+    def run_concurrently(self, count, call):
+        results = [None] * count
+        errors = [None] * count
+
+        def run(i):
+            try:
+                results[i] = call()
+            except Exception as e:
+                errors[i] = e
+
+        self.loaders.gate.clear()
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        # every query is either loading or waiting for the one loading
+        deadline = time.monotonic() + 5
+        while not self.loaders.minute_calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.loaders.gate.set()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_queries_load_each_rollup_once(self):
+        results, errors = self.run_concurrently(4, self.aggregate)
+        self.assertEqual(errors, [None] * 4)
+        self.assertEqual(results, [merged(self.files[30:])] * 4)
+        self.assertEqual(len(self.loaders.hour_calls), 1)
+        self.assertEqual(sum(len(paths) for paths in self.loaders.minute_calls), 30)
+
+    def test_failed_load_is_shared_and_not_cached(self):
+        self.loaders.fail = OSError("nfdump failed")
+        results, errors = self.run_concurrently(3, self.aggregate)
+        self.assertTrue(all(isinstance(error, OSError) for error in errors))
+        self.assertEqual(len(self.loaders.minute_calls), 1)
+        self.loaders.fail = None
+        self.assertEqual(self.aggregate(), merged(self.files[30:]))
+        self.assertEqual(len(self.loaders.minute_calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
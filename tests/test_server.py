@@ -0,0 +1,161 @@
+"""
+PooledHTTPServer and MonilyzerHandler over real sockets, with a processor
+answering canned results: kept-alive connections, chunked and gzip bodies,
+HTTP/1.0 clients, and 503 when every worker and queue slot is taken.
+
+Usage: python -m pytest tests
+"""
+
+import gzip
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from processor import MonilyzerHandler, PooledHTTPServer  # noqa: E402
+
+RESULT = {"is_attack": True, "attack_ips": [{"ip": f"192.0.2.{i % 250}", "count": i} for i in range(5000)]}
+
+
+class Processor:
+    """
+    answers every query with RESULT, blocking while `gate` is clear
+    """
+
+    profiler = None
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def query(self, options, use_cache=True):
+        with self._lock:
+            self.queries.append(options)
+        self.gate.wait()
+        return (200, RESULT), "MISS"
+
+
+class ServerTest(unittest.TestCase):
+
+    def start(self, **kwargs):
+        server = PooledHTTPServer(("127.0.0.1", 0), MonilyzerHandler, **kwargs)
+        server.injected_processor = self.processor
+        thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        thread.start()
+
+        def stop():
+            self.processor.gate.set()
+            server.shutdown()
+            server.server_close()
+        self.addCleanup(stop)
+        return server.server_address[1]
+
+    def setUp(self):
+        self.processor = Processor()
+        # the handler logs every request to stderr
+        quiet = mock.patch.object(MonilyzerHandler, "log_message", lambda *args: None)
+        quiet.start()
+        self.addCleanup(quiet.stop)
+
+    def get(self, conn, path="/opt?monitor=pmacct&analyzer=snort&hours=1", headers=None):
+        conn.request("GET", path, headers=headers or {})
+        response = conn.getresponse()
+        return response, response.read()
+
+    def test_keep_alive_serves_several_requests_on_one_connection(self):
+        port = self.start(keepalive_timeout=5)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        self.addCleanup(conn.close)
+        for _ in range(3):
+            response, body = self.get(conn)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+            self.assertEqual(response.getheader("X-Cache"), "MISS")
+            self.assertEqual(json.loads(body), RESULT)
+            sock = conn.sock
+        # the connection was reused: http.client only reconnects after a close
+        self.assertIs(conn.sock, sock)
+        self.assertEqual(len(self.processor.queries), 3)
+
+    def test_idle_connection_is_closed_after_the_timeout(self):
+        port = self.start(keepalive_timeout=0.2)
+        with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+            sock.sendall(b"GET /opt?monitor=pmacct&analyzer=snort&hours=1 HTTP/1.1\r\nHost: x\r\n\r\n")
+            data = b""
+            while True:
+                piece = sock.recv(65536)
+                if not piece:
+                    break
+                data += piece
+        self.assertTrue(data.startswith(b"HTTP/1.1 200"))
+        self.assertTrue(data.endswith(b"0\r\n\r\n"))
+
+    def test_gzip_is_negotiated(self):
+        port = self.start()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        self.addCleanup(conn.close)
+        response, body = self.get(conn, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.getheader("Content-Encoding"), "gzip")
+        self.assertEqual(json.loads(gzip.decompress(body)), RESULT)
+        response, body = self.get(conn, headers={"Accept-Encoding": "gzip;q=0, identity"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertEqual(json.loads(body), RESULT)
+
+    def test_http_1_0_body_ends_with_the_connection(self):
+        port = self.start()
+        with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+            sock.sendall(b"GET /opt?monitor=pmacct&analyzer=snort&hours=1 HTTP/1.0\r\n\r\n")
+            data = b""
+            while True:
+                piece = sock.recv(65536)
+                if not piece:
+                    break
+                data += piece
+        head, _, body = data.partition(b"\r\n\r\n")
+        self.assertIn(b"Connection: close", head)
+        self.assertNotIn(b"Transfer-Encoding", head)
+        self.assertEqual(json.loads(body), RESULT)
+
+    def test_bad_requests_keep_the_connection(self):
+        port = self.start()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        self.addCleanup(conn.close)
+        response, body = self.get(conn, "/opt?monitor=pmacct&analyzer=snort&hours=x")
+        self.assertEqual(response.status, 400)
+        self.assertIn("Hours", json.loads(body)["error"])
+        response, body = self.get(conn)
+        self.assertEqual(response.status, 200)
+
+    def test_busy_server_answers_503(self):
+        port = self.start(workers=1, queue_size=1)
+        self.processor.gate.clear()
+        conns = [http.client.HTTPConnection("127.0.0.1", port, timeout=5) for _ in range(3)]
+        for conn in conns:
+            self.addCleanup(conn.close)
+        # the first request runs, the second waits for the worker
+        for conn in conns[:2]:
+            conn.request("GET", "/opt?monitor=pmacct&analyzer=snort&hours=1")
+        deadline = time.monotonic() + 5
+        while not self.processor.queries and time.monotonic() < deadline:
+            time.sleep(0.01)
+        response, body = self.get(conns[2])
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.getheader("Retry-After"), "1")
+        self.processor.gate.set()
+        for conn in conns[:2]:
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(json.loads(response.read()), RESULT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+SnortPool's protocol with a stand-in snort (tests/fixtures/stand_in_snort.py):
+processes kept across jobs, alerts of one job only, times shifted back,
+parallel jobs, host pair sharding and workers restarted after a failure.
+What a real Snort 3 does with the stream is not covered, see
+`python -m analyzer.snort_pool --verify`.
+
+Usage: python -m pytest tests
+"""
+
+import io
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analyzer.snort_pool import SnortPool, SnortWorkerError  # noqa: E402
+from transport.pcap import SynPcapWriter  # noqa: E402
+
+STAND_IN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "stand_in_snort.py")
+TARGET = socket.inet_aton("198.51.100.1")
+START = 1_735_732_800_000_000
+
+
+def capture(packets) -> io.BytesIO:
+    """
+    packets: (seconds after START, source host number, destination port)
+    """
+    stream = io.BytesIO()
+    writer = SynPcapWriter(stream)
+    for i, (offset, host, port) in enumerate(packets):
+        writer.write_syn(START + offset * 1_000_000 + i, socket.inet_aton(f"192.0.2.{host}"), TARGET, 40000 + i, port, i)
+    writer.flush()
+    stream.seek(0)
+    return stream
+
+
+def telnet(hosts, offset=0):
+    return capture([(offset, host, 23) for host in hosts])
+
+
+def scan(host, ports, offset=0):
+    return capture([(offset + i, host, port) for i, port in enumerate(ports)])
+
+
+class SnortPoolTest(unittest.TestCase):
+
+    def pool(self, **kwargs) -> SnortPool:
+        pool = SnortPool(STAND_IN, None, job_timeout=10, startup_timeout=10, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_processes_are_kept_across_jobs(self):
+        pool = self.pool(workers=1)
+        pids = set()
+        for hosts in ([1, 2], [3], [], [4, 5, 6]):
+            alerts = pool.analyze_pcap(telnet(hosts))
+            self.assertEqual(sorted(alert["src_addr"] for alert in alerts), [f"192.0.2.{host}" for host in hosts])
+            pids.update(alert["pid"] for alert in alerts)
+        self.assertEqual(len(pids), 1)
+        self.assertEqual(pids, {pool._workers[0].proc.pid})
+
+    def test_alert_times_are_shifted_back(self):
+        pool = self.pool(workers=1)
+        for _ in range(3):
+            alerts = pool.analyze_pcap(telnet([1], offset=30))
+            self.assertEqual(len(alerts), 1)
+            self.assertNotIn("seconds", alerts[0])
+            expected = time.strftime("%m/%d-%H:%M:%S", time.localtime(START // 1_000_000 + 30)) + ".000000"
+            self.assertEqual(alerts[0]["timestamp"], expected)
+
+    def test_state_does_not_carry_over_between_jobs(self):
+        pool = self.pool(workers=1)
+        # 3 + 3 ports within the scan window if the jobs were not kept apart
+        self.assertEqual(pool.analyze_pcap(scan(1, [1, 2, 3])), [])
+        self.assertEqual(pool.analyze_pcap(scan(1, [4, 5, 6])), [])
+        alerts = pool.analyze_pcap(scan(1, [1, 2, 3, 4, 5]))
+        self.assertEqual([alert["sid"] for alert in alerts], [2])
+
+    def test_scans_stay_within_one_shard(self):
+        pool = self.pool(workers=2, shards=2)
+        # ten sources scanning the same target land on both shards, each scan on one
+        packets = [(i, host, port) for host in range(1, 11) for i, port in enumerate(range(1000, 1005))]
+        alerts = pool.analyze_pcap(capture(packets))
+        self.assertEqual(sorted(alert["src_addr"] for alert in alerts), sorted(f"192.0.2.{host}" for host in range(1, 11)))
+        self.assertEqual(len({alert["pid"] for alert in alerts}), 2)
+
+    def test_independent_jobs_run_in_parallel(self):
+        pool = self.pool(workers=4, shards=2)
+        results, errors = {}, []
+
+        def run(n):
+            try:
+                for _ in range(5):
+                    alerts = pool.analyze_pcap(telnet(range(n * 10, n * 10 + n + 1)))
+                    results.setdefault(n, []).append(sorted(alert["src_addr"] for alert in alerts))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        for n, runs in results.items():
+            expected = sorted(f"192.0.2.{host}" for host in range(n * 10, n * 10 + n + 1))
+            self.assertEqual(runs, [expected] * 5)
+        self.assertEqual(len(pool._idle), 4)
+
+    def test_failed_worker_is_restarted(self):
+        pool = self.pool(workers=1)
+        worker = pool._workers[0]
+        pool.analyze_pcap(telnet([1]))
+        # exited between jobs: started again by the next one
+        first = worker.proc.pid
+        worker.proc.kill()
+        worker.proc.wait()
+        self.assertEqual(len(pool.analyze_pcap(telnet([2]))), 1)
+        self.assertNotEqual(worker.proc.pid, first)
+
+        # exited during a job: the job fails, the next one gets a new snort
+        finish_job = worker.finish_job
+
+        def killed(timeout):
+            worker.proc.kill()
+            worker.proc.wait()
+            return finish_job(timeout)
+        worker.finish_job = killed
+        with self.assertRaises(SnortWorkerError):
+            pool.analyze_pcap(telnet([3]))
+        del worker.finish_job
+        alerts = pool.analyze_pcap(telnet([4]))
+        self.assertEqual([alert["src_addr"] for alert in alerts], ["192.0.2.4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
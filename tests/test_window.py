@@ -0,0 +1,137 @@
+"""
+Sliding windows: WindowCounts against merging its buckets from scratch as
+buckets come and go, and FlowWindow's own copy of the minute partials.
+
+Usage: python -m pytest tests
+"""
+
+import os
+import random
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from driver.flow import FlowAggregate  # noqa: E402
+from driver.window import FlowWindow, WindowCounts  # noqa: E402
+
+
+def random_bucket(rnd) -> dict:
+    bucket = {}
+    for _ in range(rnd.randrange(0, 12)):
+        key = f"192.0.2.{rnd.randrange(20)}"
+        items = bucket[key][1] if key in bucket else {}
+        for _ in range(rnd.randrange(0, 5)):
+            items[rnd.choice([None, 22, 80, 443, rnd.randrange(1024, 1100)])] = None
+        bucket[key] = (rnd.randrange(1, 100), items)
+    return bucket
+
+
+def merged(buckets) -> list:
+    """
+    the buckets merged one after another into insertion-ordered dicts
+    """
+    result = {}
+    for _, bucket in buckets:
+        for key, (value, items) in bucket.items():
+            entry = result.setdefault(key, [0, {}])
+            entry[0] += value
+            entry[1].update(dict.fromkeys(items))
+    return [(key, value, list(items)) for key, (value, items) in result.items()]
+
+
+class WindowCountsTest(unittest.TestCase):
+
+    def test_matches_merging_the_buckets(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                rnd = random.Random(seed)
+                counts = WindowCounts()
+                buckets = []
+                for minute in range(200):
+                    bucket = random_bucket(rnd)
+                    counts.add(minute, bucket)
+                    buckets.append((minute, bucket))
+                    while buckets and rnd.random() < 0.4:
+                        counts.remove_oldest()
+                        buckets.pop(0)
+                    self.assertEqual(counts.ordered(), merged(buckets))
+                while buckets:
+                    counts.remove_oldest()
+                    buckets.pop(0)
+                self.assertEqual(counts.totals, {})
+                self.assertEqual(counts.ordered(), [])
+
+
+class Driver:
+    """
+    the clock and minute files of a flow driver, minute keys as file names
+    """
+
+    def __init__(self, now, minutes):
+        self._now = now
+        self.files = [(now - timedelta(minutes=minutes - i)).strftime("%Y%m%d%H%M") for i in range(minutes)]
+
+    def now(self):
+        return self._now
+
+    def file_key(self, fp):
+        return fp
+
+    def get_range_from_now(self, hours, now=None):
+        start = (now or self._now) - timedelta(hours=hours)
+        end = now or self._now
+        return [start.strftime("%Y%m%d"), start.strftime("%H%M"), end.strftime("%Y%m%d"), end.strftime("%H%M")]
+
+    def get_files(self, start_date, start_time, end_date, end_time):
+        return [fp for fp in self.files if start_date + start_time <= fp <= end_date + end_time]
+
+
+def partial_of(i) -> FlowAggregate:
+    partial = FlowAggregate()
+    partial.add(f"192.0.2.{i % 7}", 1, 1000 + i % 11)
+    partial.add("198.51.100.1", 2, None)
+    return partial
+
+
+class FlowWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.end = datetime(2025, 1, 1, 13, 0, 30)
+        self.driver = Driver(self.end, 120)
+        self.driver._now = self.end - timedelta(minutes=30)
+        self.partials = {fp: partial_of(i) for i, fp in enumerate(self.driver.files)}
+
+    def load_minutes(self, paths, **filters):
+        return [self.partials[fp] for fp in paths]
+
+    def expected(self, hours) -> list[dict]:
+        result = FlowAggregate()
+        for fp in self.driver.get_files(*self.driver.get_range_from_now(hours)):
+            result.update(partial_of(self.driver.files.index(fp)))
+        return result.to_summary()
+
+    def test_matches_the_partials_as_it_slides(self):
+        window = FlowWindow(self.driver, self.load_minutes, (1,))
+        for _ in range(30):
+            window.advance()
+            self.assertEqual(window.aggregate(1).to_summary(), self.expected(1))
+            self.driver._now += timedelta(minutes=1)
+
+    def test_keeps_its_own_copy_of_the_partials(self):
+        window = FlowWindow(self.driver, self.load_minutes, (1,))
+        window.advance()
+        # the partials handed to the window are shared with the rollup caches
+        for partial in self.partials.values():
+            for entry in partial.sources.values():
+                entry[0] += 1000
+                entry[1][9999] = None
+        self.partials = {fp: partial_of(i) for i, fp in enumerate(self.driver.files)}
+        self.driver._now = self.end
+        window.advance()
+        self.assertEqual(window.aggregate(1).to_summary(), self.expected(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
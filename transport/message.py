@@ -10,10 +10,17 @@ those artifacts are serialized.
 from enum  import Enum
 from abc import ABC, abstractmethod
 from typing import override, Sequence
+from collections.abc import Sequence as SequenceABC
+from types import MappingProxyType
 import pickle
 import scapy.all as scapy
 import tempfile
 import json
+import io
+import socket
+import time
+
+from transport.pcap import SynPcapWriter
 
 class MessageKind(Enum):
     """Enumerates logical categories of data exchanged between modules."""
@@ -64,17 +71,158 @@ class Message(ABC):
         """Convert the message into analyzer-specific bytes ready for ingestion."""
         pass
 
+    def write_format_of_analyzer(self, analyzer: Analyzer, stream) -> None:
+        """Write the analyzer-specific bytes to a binary stream.
+
+        Messages whose payload can be large override ``_write_format_of_analyzer``
+        to stream it instead of building it in memory.
+        """
+        if analyzer not in self.supported_analyzers():
+            raise ValueError(f"Analyzer {analyzer} is not supported by this message")
+        self._write_format_of_analyzer(analyzer, stream)
+
+    def _write_format_of_analyzer(self, analyzer: Analyzer, stream) -> None:
+        stream.write(self._to_format_of_analyzer(analyzer))
+
+    def to_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[bytes]:
+        """Split the analyzer-specific payload into self-contained chunks.
+
+        Each chunk is at most ``max_bytes`` long, except when a single item
+        (one flow summary, one log line) is larger on its own.
+        """
+        if analyzer not in self.supported_analyzers():
+            raise ValueError(f"Analyzer {analyzer} is not supported by this message")
+        return self._to_chunks_of_analyzer(analyzer, max_bytes)
+
+    def _to_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[bytes]:
+        """Messages that cannot be split return their whole payload as one chunk."""
+        return [self._to_format_of_analyzer(analyzer)]
+
+    def to_text_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[str]:
+        """Same as ``to_chunks_of_analyzer`` for text-based analyzers (prompts),
+        without encoding the text to bytes and decoding it back."""
+        if analyzer not in self.supported_analyzers():
+            raise ValueError(f"Analyzer {analyzer} is not supported by this message")
+        return self._to_text_chunks_of_analyzer(analyzer, max_bytes)
+
+    def _to_text_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[str]:
+        return [chunk.decode("utf-8", errors="replace") for chunk in self._to_chunks_of_analyzer(analyzer, max_bytes)]
+
+    @abstractmethod
+    def native_view(self) -> "MessageView":
+        """Return a typed, read-only view of the payload for in-process analyzers.
+
+        Nothing is serialized or copied; bytes are only produced by
+        ``to_format_of_analyzer`` when the payload leaves the process.
+        """
+        pass
+
+class EntriesView(SequenceABC):
+    """Read-only sequence over a list of dicts, items are read-only mappings."""
+
+    __slots__ = ("_items",)
+
+    def __init__(self, items: list[dict]):
+        self._items = items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return EntriesView(self._items[index])
+        return MappingProxyType(self._items[index])
+
+    def __iter__(self):
+        return map(MappingProxyType, self._items)
+
+class MessageView:
+    """Base of the native views returned by ``Message.native_view``."""
+
+    __slots__ = ()
+
+class JournalView(MessageView):
+    """Journal entries of a JournalMessage.
+
+    window_counts: Counter computed over the same window by `counted_by`,
+    None when the message was not built from a detection window
+    """
+
+    __slots__ = ("entries", "window_counts", "counted_by")
+
+    def __init__(self, entries: list[dict], window_counts=None, counted_by=None):
+        self.entries = EntriesView(entries)
+        self.window_counts = window_counts
+        self.counted_by = counted_by
+
+class FlowSummaryView(MessageView):
+    """Per-source flow summary rows of a NetworkPacketMessage.
+
+    rows: {ip_src, total_packets, dst_ports} per source
+    """
+
+    __slots__ = ("rows", "hours", "host_ip")
+
+    def __init__(self, rows: list[dict], hours, host_ip: str | None):
+        self.rows = EntriesView(rows)
+        self.hours = hours
+        self.host_ip = host_ip
+
 class LinkLayerType(Enum):
     """Link-layer encapsulations supported when decoding packet captures."""
 
     Ethernet = 1
     WiFi = 2
 
+class LLMEncoding(Enum):
+    """How flow summaries are rendered into LLM prompts."""
+
+    # Python repr of the whole summary dict
+    Repr = 1
+    # port ranges, top sources plus an "others" bucket, bounded by a token budget
+    Compact = 2
+
+# rough characters per token of the compact text, used to turn token budgets into sizes
+CHARS_PER_TOKEN = 4
+
 class NetworkPacketMessage(Message):
-    """Carries one or more captured packets for downstream inspection."""
+    """Carries one or more captured packets for downstream inspection.
+
+    With ``LLMEncoding.Compact`` the LLM prompt lists the ``top_k`` sources by
+    packets and the ``top_k`` sources by distinct destination ports (the
+    signals of floods and scans), each with its destination ports collapsed
+    into ranges; the remaining sources are summed into one "others" line. The
+    prompt never exceeds ``token_budget`` tokens: sources that do not fit are
+    folded into "others", in a deterministic order.
+
+    When ``host_ip`` (the monitored host, the destination of the summarized
+    flows) is an IPv4 address the message can also be handed to Snort as a
+    synthetic pcap: per source, TCP SYNs to each of its destination ports,
+    ``total_packets`` spread over the ports up to ``max_packets_per_port``,
+    1ms apart so that scans stay within Snort's port_scan windows. At most
+    ``max_packets`` are written; IPv6 sources are skipped.
+    """
 
-    def __init__(self, packet: dict):
+    def __init__(
+        self,
+        packet: dict,
+        *,
+        llm_encoding: LLMEncoding = LLMEncoding.Repr,
+        top_k: int = 20,
+        token_budget: int = 4000,
+        max_port_ranges: int = 32,
+        host_ip: str | None = None,
+        max_packets: int = 200000,
+        max_packets_per_port: int = 16,
+    ):
         self._packet = packet
+        self._llm_encoding = llm_encoding
+        self._top_k = top_k
+        self._token_budget = token_budget
+        self._max_port_ranges = max_port_ranges
+        self._host_ip = host_ip
+        self._max_packets = max_packets
+        self._max_packets_per_port = max_packets_per_port
 
     @property
     @override
@@ -84,29 +232,178 @@ class NetworkPacketMessage(Message):
     @property
     @override
     def json_obj(self) -> dict:
-        return {
+        json_obj = {
             "packet": self._packet
         }
+        if self._host_ip is not None:
+            json_obj["host_ip"] = self._host_ip
+        return json_obj
 
     @classmethod
     @override
     def load(cls, json_obj: dict) -> "NetworkPacketMessage":
         packet = json_obj["packet"]
-        return cls(packet)
+        return cls(packet, host_ip=json_obj.get("host_ip"))
 
     @override
     def supported_analyzers(self) -> set[Analyzer]:
+        if self._host_ipv4() is not None:
+            return {Analyzer.LLM, Analyzer.Snort}
         return {Analyzer.LLM}
 
     def _to_format_of_analyzer(self, analyzer: Analyzer) -> bytes:
         match analyzer:
             case Analyzer.LLM:
                 return self._to_llm_format()
+            case Analyzer.Snort:
+                stream = io.BytesIO()
+                self._write_snort_pcap(stream)
+                return stream.getvalue()
         raise ValueError(f"Unsupported analyzer {analyzer} for NetworkPacketMessage")
 
+    def _write_format_of_analyzer(self, analyzer: Analyzer, stream) -> None:
+        match analyzer:
+            case Analyzer.Snort:
+                self._write_snort_pcap(stream)
+                return
+        super()._write_format_of_analyzer(analyzer, stream)
+
+    def _host_ipv4(self) -> bytes | None:
+        if not self._host_ip:
+            return None
+        try:
+            return socket.inet_aton(self._host_ip)
+        except OSError:
+            return None
+
+    def _write_snort_pcap(self, stream) -> None:
+        dst = self._host_ipv4()
+        writer = SynPcapWriter(stream)
+        hours = self._packet.get("collected in hours", 1) if isinstance(self._packet, dict) else 1
+        ts_usec = int((time.time() - float(hours) * 3600) * 1_000_000)
+        budget = self._max_packets
+        for n, entry in enumerate(self._packet.get("packets_summary") or []):
+            try:
+                src = socket.inet_aton(entry["ip_src"])
+            except OSError:
+                continue
+            # records without a dst port are reported as None
+            ports = sorted(port for port in set(entry["dst_ports"]) if port is not None)
+            if not ports:
+                continue
+            per_port = min(self._max_packets_per_port, max(1, int(entry["total_packets"]) // len(ports)))
+            # a fixed ephemeral source port per source, like a single scanner
+            src_port = 32768 + n % 28000
+            for repeat in range(per_port):
+                for port in ports:
+                    if budget <= 0:
+                        writer.flush()
+                        return
+                    writer.write_syn(ts_usec, src, dst, src_port, port, (n << 20 | repeat << 16 | port) & 0xFFFFFFFF)
+                    ts_usec += 1000
+                    budget -= 1
+        writer.flush()
+
+    @override
+    def native_view(self) -> FlowSummaryView:
+        summary = self._packet.get("packets_summary") if isinstance(self._packet, dict) else None
+        hours = self._packet.get("collected in hours") if isinstance(self._packet, dict) else None
+        return FlowSummaryView(summary or [], hours, self._host_ip)
+
     def _to_llm_format(self) -> bytes:
-        full_prompt = f"Analyze the following network packets we captured:\n\n{self._packet} and decide if it indicates a likely attack."
-        return full_prompt.encode('utf-8')
+        return self._llm_text().encode("utf-8")
+
+    def _llm_text(self) -> str:
+        if self._llm_encoding == LLMEncoding.Compact:
+            return self._to_compact_llm_format(self._token_budget * CHARS_PER_TOKEN)
+        return self._to_llm_format_of(self._packet)
+
+    def _to_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[bytes]:
+        match analyzer:
+            case Analyzer.LLM:
+                return [chunk.encode("utf-8") for chunk in self._to_llm_chunks(max_bytes)]
+        return super()._to_chunks_of_analyzer(analyzer, max_bytes)
+
+    def _to_text_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[str]:
+        match analyzer:
+            case Analyzer.LLM:
+                return self._to_llm_chunks(max_bytes)
+        return super()._to_text_chunks_of_analyzer(analyzer, max_bytes)
+
+    def _to_llm_chunks(self, max_bytes: int) -> list[str]:
+        if self._llm_encoding == LLMEncoding.Compact:
+            # the compact prompt is a summary of all the sources, it is
+            # shrunk to the chunk size rather than split
+            return [self._to_compact_llm_format(min(self._token_budget * CHARS_PER_TOKEN, max_bytes))]
+
+        whole = self._llm_text()
+        summary = self._packet.get("packets_summary") if isinstance(self._packet, dict) else None
+        if len(whole.encode("utf-8")) <= max_bytes or not summary:
+            return [whole]
+
+        # the prompt without any summary entry, each chunk repeats it
+        overhead = len(self._to_llm_format_of({**self._packet, "packets_summary": []}).encode("utf-8"))
+        parts = _pack_by_size(summary, lambda item: len(repr(item).encode("utf-8")) + 2, max_bytes - overhead)
+        return [self._to_llm_format_of({**self._packet, "packets_summary": part}) for part in parts]
+
+    def _to_llm_format_of(self, packet) -> str:
+        full_prompt = f"Analyze the following network packets we captured:\n\n{packet} and decide if it indicates a likely attack."
+        return full_prompt
+
+    def _to_compact_llm_format(self, max_bytes: int) -> str:
+        summary = self._packet.get("packets_summary") or []
+        sources = sorted(
+            ((e["ip_src"], int(e["total_packets"]), sorted(port for port in set(e["dst_ports"]) if port is not None)) for e in summary),
+            key=lambda s: (-s[1], -len(s[2]), s[0]),
+        )
+        if self._top_k > 0:
+            by_ports = sorted(sources, key=lambda s: (-len(s[2]), -s[1], s[0]))[:self._top_k]
+            chosen = {s[0] for s in sources[:self._top_k]} | {s[0] for s in by_ports}
+        else:
+            chosen = {s[0] for s in sources}
+
+        head = (
+            "Analyze the following network flow summary we captured and decide if it indicates a likely attack.\n"
+            f"collected in hours: {self._packet.get('collected in hours')}; "
+            f"sources: {len(sources)}; total packets: {sum(s[1] for s in sources)}\n"
+            "src | packets | distinct dst ports | dst ports\n"
+        )
+        # room kept for the "others" line and the truncation note
+        reserve = 160
+        used = len(head.encode("utf-8"))
+        lines = []
+        others = []
+        full = False
+        for source in sources:
+            if source[0] in chosen and not full:
+                line = f"{source[0]} | {source[1]} | {len(source[2])} | {_port_ranges(source[2], self._max_port_ranges)}\n"
+                size = len(line.encode("utf-8"))
+                if used + size + reserve <= max_bytes:
+                    lines.append(line)
+                    used += size
+                    continue
+                # the order stays deterministic: past the first source that
+                # does not fit, every remaining one goes to "others"
+                full = True
+            others.append(source)
+
+        tail = ""
+        if others:
+            folded = sum(1 for s in others if s[0] in chosen)
+            ports = set()
+            for s in others:
+                ports.update(s[2])
+            tail = (
+                f"others ({len(others)} sources) | {sum(s[1] for s in others)} | {len(ports)} | "
+                f"max per source {max(len(s[2]) for s in others)}\n"
+            )
+            if folded:
+                tail += f"[{folded} top sources folded into others to fit the budget]\n"
+        # hard limit, only reached when the budget is smaller than the header
+        text = head + "".join(lines) + tail
+        if len(text.encode("utf-8")) > max_bytes:
+            text = text.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+        return text
 
 class JournalMessage(Message):
     """Carries journalctl log entries for analyzers.
@@ -114,10 +411,15 @@ class JournalMessage(Message):
     This message encapsulates one or more journalctl JSON objects (dicts).
     It preserves the original dicts for pass-through in SimpleJournal analyzer
     and can convert them into an LLM-friendly prompt for the LLM analyzer.
+
+    window_counts: counts of the entries precomputed by the monitor's
+    detection stage with the `counted_by` function, in-process only
     """
 
-    def __init__(self, entries: Sequence[dict]):
+    def __init__(self, entries: Sequence[dict], *, window_counts=None, counted_by=None):
         self._entries = list(entries)
+        self._window_counts = window_counts
+        self._counted_by = counted_by
 
     @property
     @override
@@ -156,7 +458,36 @@ class JournalMessage(Message):
         # Pass-through: original dicts as JSON array
         return json.dumps(self._entries, ensure_ascii=False).encode("utf-8")
 
+    @override
+    def native_view(self) -> JournalView:
+        return JournalView(self._entries, self._window_counts, self._counted_by)
+
+    def _to_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[bytes]:
+        match analyzer:
+            case Analyzer.LLM:
+                return [chunk.encode("utf-8") for chunk in self._to_llm_chunks(max_bytes)]
+        return super()._to_chunks_of_analyzer(analyzer, max_bytes)
+
+    def _to_text_chunks_of_analyzer(self, analyzer: Analyzer, max_bytes: int) -> list[str]:
+        match analyzer:
+            case Analyzer.LLM:
+                return self._to_llm_chunks(max_bytes)
+        return super()._to_text_chunks_of_analyzer(analyzer, max_bytes)
+
+    def _to_llm_chunks(self, max_bytes: int) -> list[str]:
+        lines = self._llm_lines()
+        overhead = len(self._llm_prompt_of([]).encode("utf-8"))
+        parts = _pack_by_size(lines, lambda line: len(line.encode("utf-8")) + 1, max_bytes - overhead)
+        return [self._llm_prompt_of(part) for part in parts] or [self._llm_prompt_of([])]
+
     def _to_llm_format(self) -> bytes:
+        return self._llm_prompt_of(self._llm_lines()).encode("utf-8")
+
+    def _llm_prompt_of(self, lines: list[str]) -> str:
+        prompt = "Analyze the following journalctl logs for potential security incidents. For each log, assess if it indicates suspicious or malicious activity and summarize why.\n\n" + "\n".join(lines)
+        return prompt
+
+    def _llm_lines(self) -> list[str]:
         # Build a concise, analyzable prompt summarizing key fields per entry
         lines = []
         for e in self._entries:
@@ -170,5 +501,40 @@ class JournalMessage(Message):
                 msg = json.dumps({k: e[k] for k in ("PRIORITY", "SYSLOG_IDENTIFIER", "_COMM", "_PID") if k in e})
             line = f"[{ts}] host={host} unit={unit} pid={pid} message={msg}"
             lines.append(line)
-        prompt = "Analyze the following journalctl logs for potential security incidents. For each log, assess if it indicates suspicious or malicious activity and summarize why.\n\n" + "\n".join(lines)
-        return prompt.encode("utf-8")
+        return lines
+
+
+def _port_ranges(ports: list[int], max_ranges: int) -> str:
+    """Collapse sorted distinct ports into ``a-b`` ranges, at most ``max_ranges`` of them."""
+    ranges = []
+    start = prev = None
+    for port in ports:
+        if prev is not None and port == prev + 1:
+            prev = port
+            continue
+        if start is not None:
+            ranges.append(f"{start}-{prev}" if prev != start else str(start))
+        start = prev = port
+    if start is not None:
+        ranges.append(f"{start}-{prev}" if prev != start else str(start))
+    if len(ranges) > max_ranges:
+        return ",".join(ranges[:max_ranges]) + f",...(+{len(ranges) - max_ranges} ranges)"
+    return ",".join(ranges)
+
+
+def _pack_by_size(items: Sequence, size_of, budget: int) -> list[list]:
+    """Greedily pack items, in order, into parts whose total size fits ``budget``."""
+    parts = []
+    current = []
+    used = 0
+    for item in items:
+        size = size_of(item)
+        if current and used + size > budget:
+            parts.append(current)
+            current = []
+            used = 0
+        current.append(item)
+        used += size
+    if current:
+        parts.append(current)
+    return parts
@@ -0,0 +1,159 @@
+"""
+Minimal pcap (libpcap classic format) reading and writing.
+
+Only what the Snort path needs: the global header, per-record headers and
+hand-built Ethernet/IPv4 frames, without going through scapy objects.
+SynPcapWriter writes TCP SYN packets in bulk from one fixed frame layout,
+filling in only addresses, ports and checksums per packet.
+"""
+
+import struct
+
+MAGIC_USEC = 0xA1B2C3D4
+MAGIC_NSEC = 0xA1B23C4D
+LINKTYPE_ETHERNET = 1
+SNAPLEN = 65535
+
+GLOBAL_HEADER = struct.Struct("<IHHiIII")
+RECORD_HEADER = struct.Struct("<IIII")
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+
+
+class PcapError(Exception):
+    pass
+
+
+def global_header(linktype=LINKTYPE_ETHERNET, snaplen=SNAPLEN) -> bytes:
+    return GLOBAL_HEADER.pack(MAGIC_USEC, 2, 4, 0, 0, snaplen, linktype)
+
+
+def record(ts_usec: int, frame: bytes) -> bytes:
+    return RECORD_HEADER.pack(ts_usec // 1_000_000, ts_usec % 1_000_000, len(frame), len(frame)) + frame
+
+
+def _fold(total: int) -> int:
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total
+
+
+class SynPcapWriter:
+    """
+    Streams a pcap of Ethernet/IPv4/TCP SYN packets to `stream`.
+
+    The 54-byte frame layout and its record header are built once. Per packet only
+    the addresses, ports, sequence number and the two checksums change; the
+    checksums are derived from precomputed sums of the constant fields.
+    Output is buffered and written every `flush_every` packets.
+    """
+
+    FRAME = struct.Struct("!6s6sH" "BBHHHBBH4s4s" "HHIIBBHHH")
+    RECORD = struct.Struct("<IIII")
+
+    def __init__(self, stream, flush_every=4096):
+        self.stream = stream
+        self.flush_every = flush_every
+        self.count = 0
+        self._buffer = []
+        stream.write(global_header(LINKTYPE_ETHERNET))
+
+        frame_len = self.FRAME.size
+        ip_total_len = frame_len - 14
+        # constant IPv4 header words: version/ihl/tos, total length, id, flags, ttl/proto
+        self._ip_sum = 0x4500 + ip_total_len + 0 + 0x4000 + (64 << 8 | 6)
+        # constant TCP words: data offset/flags (SYN), window, urgent pointer,
+        # plus the pseudo-header protocol and TCP length
+        self._tcp_sum = (5 << 12 | 0x02) + 64240 + 0 + 6 + 20
+        self._record_header = self.RECORD.pack(0, 0, frame_len, frame_len)[8:]
+
+    def write_syn(self, ts_usec: int, src: bytes, dst: bytes, src_port: int, dst_port: int, seq: int):
+        """
+        src, dst: IPv4 addresses as 4 packed bytes
+        """
+        addr_sum = (src[0] << 8 | src[1]) + (src[2] << 8 | src[3]) + (dst[0] << 8 | dst[1]) + (dst[2] << 8 | dst[3])
+        ip_checksum = ~_fold(self._ip_sum + addr_sum) & 0xFFFF
+        tcp_checksum = ~_fold(self._tcp_sum + addr_sum + src_port + dst_port + (seq >> 16) + (seq & 0xFFFF)) & 0xFFFF
+        self._buffer.append(struct.pack("<II", ts_usec // 1_000_000, ts_usec % 1_000_000))
+        self._buffer.append(self._record_header)
+        self._buffer.append(self.FRAME.pack(
+            b"\x02\x00\x00\x00\x00\x02", b"\x02\x00\x00\x00\x00\x01", ETHERTYPE_IPV4,
+            0x45, 0, self.FRAME.size - 14, 0, 0x4000, 64, 6, ip_checksum, src, dst,
+            src_port, dst_port, seq, 0, 5 << 4, 0x02, 64240, tcp_checksum, 0,
+        ))
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.stream.write(b"".join(self._buffer))
+            self._buffer = []
+
+
+class PcapReader:
+    """
+    Iterates (ts_usec, frame) over a pcap stream. Little and big endian,
+    microsecond and nanosecond files are accepted.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        head = stream.read(GLOBAL_HEADER.size)
+        if len(head) < GLOBAL_HEADER.size:
+            raise PcapError("truncated pcap global header")
+        for endian in ("<", ">"):
+            (magic,) = struct.unpack(endian + "I", head[:4])
+            if magic in (MAGIC_USEC, MAGIC_NSEC):
+                break
+        else:
+            raise PcapError(f"bad pcap magic {head[:4].hex()}")
+        self._record = struct.Struct(endian + "IIII")
+        self._nsec = magic == MAGIC_NSEC
+        (self.linktype,) = struct.unpack(endian + "I", head[20:24])
+
+    def __iter__(self):
+        read = self.stream.read
+        unpack = self._record.unpack
+        size = self._record.size
+        while True:
+            head = read(size)
+            if len(head) < size:
+                return
+            sec, frac, incl_len, _ = unpack(head)
+            frame = read(incl_len)
+            if len(frame) < incl_len:
+                return
+            yield sec * 1_000_000 + (frac // 1000 if self._nsec else frac), frame
+
+
+def host_pair_key(frame: bytes) -> bytes:
+    """
+    the two addresses of an Ethernet IPv4/IPv6 frame in sorted order, so that
+    both directions of a conversation, and every session between the two
+    hosts, give the same key; b"" for other frames
+    """
+    ethertype = frame[12:14]
+    if ethertype == b"\x08\x00":
+        src, dst = frame[26:30], frame[30:34]
+    elif ethertype == b"\x86\xdd":
+        src, dst = frame[22:38], frame[38:54]
+    else:
+        return b""
+    return src + dst if src <= dst else dst + src
+
+
+def udp_frame(src: bytes, dst: bytes, src_port: int, dst_port: int, payload: bytes) -> bytes:
+    """
+    Ethernet/IPv4/UDP frame, src and dst as 4 packed bytes; the UDP checksum
+    is left at 0 (none), as IPv4 allows
+    """
+    ip_len = 20 + 8 + len(payload)
+    ip_header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, ip_len, 0, 0x4000, 64, 17, 0, src, dst)
+    checksum = ~_fold(sum(struct.unpack("!10H", ip_header))) & 0xFFFF
+    ip_header = ip_header[:10] + struct.pack("!H", checksum) + ip_header[12:]
+    return (
+        b"\x02\x00\x00\x00\x00\x02" + b"\x02\x00\x00\x00\x00\x01" + struct.pack("!H", ETHERTYPE_IPV4)
+        + ip_header + struct.pack("!HHHH", src_port, dst_port, 8 + len(payload), 0) + payload
+    )